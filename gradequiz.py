@@ -0,0 +1,666 @@
+#! /usr/bin/python
+# encoding: utf-8
+#
+# File:     gradequiz.py
+# Descr:    Grades the response sheets of the students of an exam
+#           generated by shufflequiz.py
+
+# Input
+# -----
+
+# The answer key is the evaluation information generated by
+# shufflequiz.py, either in wide format («name».eval.csv: a row with
+# the headers question_nr.answer_id and a row with their weights) or in
+# long format («name».eval.long.csv: a row per answer).
+
+# A response sheet is a csv file with a row per student. Its first row
+# is a header: the first column is the id of the student, and each
+# other column is a question number of the answer key. Each cell holds
+# the ids of the answers marked by the student (e.g. "b", or "ac" when
+# more than one is marked), or it is empty when the question was left
+# blank. Columns of questions not on the answer key (the questions
+# without answers are left out of it) are ignored, with a warning.
+#
+#   Example:
+
+#       "student","1","2","3"
+#       "alice","a","bc",""
+#       "bob","d","b","a"
+
+# Output
+# ------
+
+# A csv file with a row per student with its id, its total score and
+# its score on each question of the answer key. The score of a question
+# is the sum of the weights of the marked answers.
+#
+# The number of graded sheets per second is shown on stderr.
+
+# Variants
+# --------
+
+# When the exam has variants (shufflequiz.py --variants), each sheet
+# has a "variant" column with the number of its variant, and its
+# questions and answer ids are the ones of its variant. Given the
+# orders of the variants («name».orders.json), grade aligns each sheet
+# to the unshuffled exam, so every sheet is graded against its key (the
+# evaluation information of shufflequiz.py --noShuffle on the same
+# quiz files).
+#
+# The align command just writes the aligned sheets, as sheets of the
+# unshuffled exam.
+
+# Item analysis
+# -------------
+
+# The analyze command reads the sheets as grade does, and writes a row
+# per question of the key with its difficulty (mean score over max
+# score), its discrimination (point-biserial correlation between its
+# score and the score on the rest of the exam) and its ratio of blanks.
+# With the answer key in long format, each row has the file and line of
+# the question on its .quiz source, so it can be joined back to it.
+# Optionally (--answersReport), it writes a row per answer with the
+# ratio of students that marked it and its correlation with the total.
+
+# Options
+# -------
+#
+#   Just call this script with -h option to check them
+
+import sys, os
+import argparse
+import csv
+import json
+import math
+import operator
+import string
+import time
+#
+_EVAL_LONG_QUESTION_HEADER = "question"    # first header of the long format
+_STUDENT_HEADER = "student"
+_TOTAL_HEADER = "total"
+_VARIANT_HEADER = "variant"
+_ANALYSIS_CHUNK_SIZE = 1024            # sheets accumulated at once by analyze
+_ANALYSIS_QUESTION_HEADER = ('"question"', '"file"', '"line"', '"students"', '"blank"',
+        '"mean"', '"difficulty"', '"discrimination"')
+_ANALYSIS_ANSWER_HEADER = ('"question"', '"answer"', '"file"', '"line"', '"weight"',
+        '"frequency"', '"discrimination"')
+#
+class AnswerKey(object):
+    """ the weight of each answer of each question of an exam """
+    def __init__(self):
+        self.questions = []     # question numbers, as they appear in the key
+        self.weights = []       # { answer_id: weight } of each question
+        self.answer_ids = []    # answer ids of each question, as they appear
+        self.sources = []       # (file, line) of each question, when known
+        self._positions = {}    # position of each question number
+
+    def add_weight(self, question_nr, answer_id, weight, source=("", "")):
+        position = self._positions.get(question_nr)
+        if position == None:
+            position = self._positions[question_nr] = len(self.questions)
+            self.questions.append(question_nr)
+            self.weights.append({})
+            self.answer_ids.append([])
+            self.sources.append(source)
+        self.weights[position][answer_id] = weight
+        self.answer_ids[position].append(answer_id)
+
+    def position(self, question_nr):
+        """ returns the position of question_nr on the key, or None when
+        it is not on the key """
+        return self._positions.get(question_nr)
+
+    def nr_questions(self):
+        return len(self.questions)
+
+    @classmethod
+    def from_file(cls, filename, csvseparator):
+        """ returns the answer key read from filename, in wide or long
+        format """
+        key = cls()
+        with open(filename, "rb") as f:
+            rows = list(csv.reader(f, delimiter=csvseparator))
+        if rows and rows[0] and rows[0][0] == _EVAL_LONG_QUESTION_HEADER:
+            key._read_long(filename, rows[1:])
+        else:
+            key._read_wide(filename, rows)
+        if not key.questions:
+            show_error_and_exit("file: %s -> empty answer key."%filename)
+        return key
+
+    def _read_wide(self, filename, rows):
+        """ reads the headers and weights rows of the wide format """
+        rows = [ row for row in rows if row ]
+        if len(rows) != 2 or len(rows[0]) != len(rows[1]):
+            show_error_and_exit("file: %s -> expected a row of headers and a row of weights."%filename)
+        for header, weight in zip(*rows):
+            question_nr, sep, answer_id = header.rpartition(".")
+            if not sep:
+                show_error_and_exit("file: %s -> bad header %s."%(filename, header))
+            self.add_weight(question_nr, answer_id, parse_weight(filename, 2, weight))
+
+    def _read_long(self, filename, rows):
+        """ reads the rows of answers of the long format. The file and
+        line of the source of each question are the 6th and 7th columns """
+        for nlin, row in enumerate(rows, 2):
+            if not row:
+                continue
+            if len(row) < 3:
+                show_error_and_exit("file: %s [line: %s] -> expected question, answer and weight."%(filename, nlin))
+            source = tuple(row[5:7]) if len(row) >= 7 else ("", "")
+            self.add_weight(row[0], row[1], parse_weight(filename, nlin, row[2]), source)
+#
+class QuestionScorer(object):
+    """ scores the marks of a question. Each distinct marks cell is
+    scored once, so grading a sheet is just a lookup per question """
+    def __init__(self, weights):
+        self.weights = weights
+        self.scores = { "": 0.0 }
+
+    def score(self, marks):
+        """ returns the score of marks, or None when it marks an answer
+        that is not on the question """
+        score = self.scores.get(marks)
+        if score == None:
+            answer_ids = parse_marks(marks)
+            if any(answer_id not in self.weights for answer_id in answer_ids):
+                return None
+            score = self.scores[marks] = sum(self.weights[answer_id] for answer_id in answer_ids)
+        return score
+#
+class VariantOrders(object):
+    """ the question and answer orders of each variant of an exam, as
+    written by shufflequiz.py on «name».orders.json.
+    For each variant and each question number on it, it keeps the
+    canonical (i.e. unshuffled) question number and a translation table
+    from the answer ids on the variant to the canonical ones """
+    def __init__(self):
+        self.questions = []     # canonical question numbers
+        self.variants = {}      # { variant nr: { question nr: (canonical question nr, table) } }
+
+    @classmethod
+    def from_file(cls, filename):
+        """ returns the orders read from filename """
+        with open(filename) as f:
+            try:
+                contents = json.load(f)
+            except ValueError:
+                show_error_and_exit("file: %s -> bad orders."%filename, 3)
+        if "answercounts" not in contents:
+            show_error_and_exit("file: %s -> orders without answer counts. Regenerate the variants."%filename, 3)
+        orders = cls()
+        orders._compose(contents["startnr"], contents["answercounts"], contents["variants"])
+        return orders
+
+    def _compose(self, startnr, answercounts, variants):
+        nr_questions = sum(len(counts) for counts in answercounts)
+        self.questions = [ str(nr) for nr in range(startnr, startnr + nr_questions) ]
+        for variant in variants:
+            questions = {}
+            start_nr = startnr
+            for counts, order in zip(answercounts, variant["orders"]):
+                offset = 0
+                for nr, i in enumerate(order["questions"], start_nr):
+                    nr_answers = counts[i]
+                    table = compose_answer_table(order["answers"][offset:offset + nr_answers])
+                    questions[str(nr)] = (str(start_nr + i), table)
+                    offset += nr_answers
+                start_nr += len(counts)
+            self.variants[str(variant["variant"])] = questions
+#
+class SheetReader(object):
+    """ reads response sheets. It yields the marks of each sheet placed
+    on the position of each question on a list of canonical questions.
+    When orders are given, each sheet has a variant column, its questions
+    are numbered as on its variant, and its marks are aligned to the
+    canonical questions and answer ids """
+    def __init__(self, questions, csvseparator, orders=None):
+        self.questions = questions
+        self.positions = dict((question_nr, position) for position, question_nr in enumerate(questions))
+        self.csvseparator = csvseparator
+        self.orders = orders
+        self.nr_sheets = 0
+        self.ignored = set()    # (file, question nr) of the columns already warned of
+
+    def read(self, filename):
+        """ generator of (nlin, student, marks) of each sheet on filename,
+        where marks is the sequence of marks of each canonical question,
+        empty when not answered """
+        with open(filename, "rb") as f:
+            reader = csv.reader(f, delimiter=self.csvseparator)
+            header = next(reader, [])
+            if not header:
+                show_error_and_exit("file: %s -> missing header."%filename, 3)
+            width = len(header)
+            padding = [ "" ] * width
+            if self.orders == None:
+                getter, tables = self._compose_columns(filename, header, None)
+            else:
+                variant_column = self._variant_column(filename, header)
+                variant_columns = {}
+            for nlin, row in enumerate(reader, 2):
+                if not row:
+                    continue
+                if len(row) != width:
+                    row = (row + padding)[:width]
+                row.append("")      # the column of the questions not on header
+                if self.orders != None:
+                    variant = row[variant_column]
+                    columns = variant_columns.get(variant)
+                    if columns == None:
+                        columns = variant_columns[variant] = self._compose_columns(filename, header, variant, nlin)
+                    getter, tables = columns
+                marks = getter(row)
+                if tables != None:
+                    marks = map(str.translate, marks, tables)
+                self.nr_sheets += 1
+                yield nlin, row[0], marks
+
+    def _variant_column(self, filename, header):
+        """ returns the column of the variant on header """
+        if _VARIANT_HEADER not in header[1:]:
+            show_error_and_exit("file: %s -> missing %s column."%(filename, _VARIANT_HEADER), 3)
+        return header.index(_VARIANT_HEADER, 1)
+
+    def _compose_columns(self, filename, header, variant, nlin=1):
+        """ returns a function that takes from a row of header the marks
+        of each canonical question, and the answer ids table of each
+        one on variant (None when there are no variants).
+        Rows are expected to have an extra empty column at the end, that
+        is taken for the canonical questions not on header """
+        if variant == None:
+            variant_questions = None
+        else:
+            variant_questions = self.orders.variants.get(variant)
+            if variant_questions == None:
+                show_error_and_exit("file: %s [line: %s] -> unknown variant %s."%(filename, nlin, variant), 3)
+        columns = [ len(header) ] * len(self.questions)
+        tables = None if variant == None else [ None ] * len(self.questions)
+        for column, question_nr in enumerate(header):
+            if column == 0 or (variant != None and question_nr == _VARIANT_HEADER):
+                continue
+            table = None
+            if variant_questions != None:
+                question_nr, table = variant_questions.get(question_nr, (None, None))
+                if question_nr == None:
+                    show_error_and_exit("file: %s [line: %s] -> question %s is not on variant %s."%(
+                        filename, nlin, header[column], variant), 3)
+            position = self.positions.get(question_nr)
+            if position == None:
+                self._ignore_column(filename, header[column], question_nr, variant)
+                continue
+            columns[position] = column
+            if tables != None:
+                tables[position] = table
+        if len(columns) == 1:
+            return (lambda row: (row[columns[0]],)), tables
+        return operator.itemgetter(*columns), tables
+
+    def _ignore_column(self, filename, column_nr, question_nr, variant):
+        """ warns (once per file) that the column of question_nr is
+        ignored: questions without answers are not on the answer key """
+        if (filename, question_nr) in self.ignored:
+            return
+        self.ignored.add((filename, question_nr))
+        if variant == None:
+            show_warning("file: %s -> question %s is not on the answer key (a question without answers?): "
+                    "its column is ignored."%(filename, question_nr))
+        else:
+            show_warning("file: %s -> question %s of the key (question %s of variant %s) has no answers: "
+                    "its column is ignored."%(filename, question_nr, column_nr, variant))
+#
+class Grader(object):
+    def __init__(self, options):
+        self.options = options
+        self.key = AnswerKey.from_file(options.answerkey, options.csvseparator)
+        self.scorers = [ QuestionScorer(weights) for weights in self.key.weights ]
+        orders = VariantOrders.from_file(options.orders) if options.orders else None
+        self.reader = SheetReader(self.key.questions, options.csvseparator, orders)
+
+    def run(self):
+        """ grades every response sheet file, writes the scores and
+        shows the throughput """
+        char = self.options.csvseparator
+        start = time.time()
+        with open(self.options.outputfile, "w") as f:
+            headers = [ _STUDENT_HEADER, _TOTAL_HEADER ] + self.key.questions
+            f.write(char.join('"%s"'%header for header in headers))
+            f.write("\n")
+            for filename in self.options.files:
+                for student, scores in self._grade_file(filename):
+                    f.write('"%s"%s%s%s'%(student, char, sum(scores), char))
+                    f.write(char.join(str(score) for score in scores))
+                    f.write("\n")
+        show_throughput("graded", self.reader.nr_sheets, time.time() - start)
+
+    def _grade_file(self, filename):
+        """ generator of the student and the score of each question of
+        the key of each sheet on filename """
+        scorers = self.scorers
+        for nlin, student, marks in self.reader.read(filename):
+            scores = [ scorer.score(m) for scorer, m in zip(scorers, marks) ]
+            if None in scores:
+                show_error_and_exit("file: %s [line: %s] -> unknown answer marked on question %s."%(
+                    filename, nlin, self.key.questions[scores.index(None)]), 3)
+            yield student, scores
+#
+class Aligner(object):
+    """ writes the response sheets of the variants of an exam as sheets
+    of the canonical exam, so they can be graded against its key """
+    def __init__(self, options):
+        self.options = options
+        orders = VariantOrders.from_file(options.orders)
+        self.reader = SheetReader(orders.questions, options.csvseparator, orders)
+
+    def run(self):
+        char = self.options.csvseparator
+        start = time.time()
+        with open(self.options.outputfile, "w") as f:
+            headers = [ _STUDENT_HEADER ] + self.reader.questions
+            f.write(char.join('"%s"'%header for header in headers))
+            f.write("\n")
+            for filename in self.options.files:
+                for nlin, student, marks in self.reader.read(filename):
+                    f.write(char.join('"%s"'%value for value in [ student ] + list(marks)))
+                    f.write("\n")
+        show_throughput("aligned", self.reader.nr_sheets, time.time() - start)
+#
+class ItemAnalysis(object):
+    """ computes the statistics of each question and answer of an exam
+    from the response sheets of its students:
+        - difficulty: mean score of the question over its max score
+        - discrimination: point-biserial correlation between the score
+          of the question and the score on the rest of the exam
+        - frequency of each answer (i.e. distractors) and its correlation
+          with the total score
+    Sheets are read once, in chunks. For each question it only keeps,
+    for each distinct marks cell, the number of students that marked it
+    and the sum of their totals: every statistic is reduced from them """
+    def __init__(self, options):
+        self.options = options
+        self.key = AnswerKey.from_file(options.answerkey, options.csvseparator)
+        self.scorers = [ QuestionScorer(weights) for weights in self.key.weights ]
+        orders = VariantOrders.from_file(options.orders) if options.orders else None
+        self.reader = SheetReader(self.key.questions, options.csvseparator, orders)
+        self.groups = [ {} for question in self.key.questions ]    # { marks: [ nr students, sum of totals ] }
+        self.nr_students = 0
+        self.sum_totals = 0.0
+        self.sum_squared_totals = 0.0
+
+    def run(self):
+        start = time.time()
+        for filename in self.options.files:
+            self._accumulate_file(filename)
+        self._export_questions()
+        if self.options.answersreport:
+            self._export_answers()
+        show_throughput("analyzed", self.reader.nr_sheets, time.time() - start)
+
+    def _accumulate_file(self, filename):
+        """ accumulates the sheets of filename, in chunks """
+        chunk = []
+        for sheet in self.reader.read(filename):
+            chunk.append(sheet)
+            if len(chunk) == _ANALYSIS_CHUNK_SIZE:
+                self._accumulate_chunk(filename, chunk)
+                chunk = []
+        self._accumulate_chunk(filename, chunk)
+
+    def _accumulate_chunk(self, filename, chunk):
+        """ accumulates the sheets of chunk on the groups of each
+        question. The chunk is transposed to a column of marks per
+        question, so every step is a pass over a whole column """
+        if not chunk:
+            return
+        nlins, students, rows = zip(*chunk)
+        columns = zip(*rows)
+        totals = [ 0.0 ] * len(chunk)
+        for position, column in enumerate(columns):
+            scores = self._score_column(filename, nlins, position, column)
+            totals = map(operator.add, totals, scores)
+        self.nr_students += len(chunk)
+        self.sum_totals += sum(totals)
+        self.sum_squared_totals += sum(map(operator.mul, totals, totals))
+        for group, column in zip(self.groups, columns):
+            totals_by_marks = dict((m, []) for m in set(column))
+            for marks, total in zip(column, totals):
+                totals_by_marks[marks].append(total)
+            for m, marks_totals in totals_by_marks.items():
+                acc = group.get(m)
+                if acc == None:
+                    acc = group[m] = [ 0, 0.0 ]
+                acc[0] += len(marks_totals)
+                acc[1] += sum(marks_totals)
+
+    def _score_column(self, filename, nlins, position, column):
+        """ returns the scores of the marks of column on the question at
+        position, or quits when any of them marks an unknown answer """
+        scorer = self.scorers[position]
+        scores = map(scorer.scores.get, column)
+        if None in scores:
+            for m in set(column):
+                if scorer.score(m) == None:
+                    show_error_and_exit("file: %s [line: %s] -> unknown answer marked on question %s."%(
+                        filename, nlins[column.index(m)], self.key.questions[position]), 3)
+            scores = map(scorer.scores.get, column)
+        return scores
+
+    def _export_questions(self):
+        """ writes a row per question with its source, number of
+        students, blank ratio, mean score, difficulty and discrimination """
+        char = self.options.csvseparator
+        n = self.nr_students
+        sum_t, sum_tt = self.sum_totals, self.sum_squared_totals
+        with open(self.options.outputfile, "w") as f:
+            f.write(char.join(_ANALYSIS_QUESTION_HEADER))
+            f.write("\n")
+            for position, question_nr in enumerate(self.key.questions):
+                scorer = self.scorers[position]
+                group = self.groups[position]
+                sum_x = sum_xx = sum_xt = 0.0
+                for m, (count, sum_t_marks) in group.items():
+                    x = scorer.score(m)
+                    sum_x += x * count
+                    sum_xx += x * x * count
+                    sum_xt += x * sum_t_marks
+                max_score = sum(w for w in scorer.weights.values() if w > 0)
+                mean = sum_x / n if n else None
+                difficulty = mean / max_score if n and max_score else None
+                discrimination = correlation(n, sum_x, sum_t - sum_x, sum_xx,
+                        sum_tt - 2 * sum_xt + sum_xx, sum_xt - sum_xx)
+                blank = group.get("", (0, 0.0))[0] / float(n) if n else None
+                filename, line = self.key.sources[position]
+                f.write(char.join((question_nr, '"%s"'%filename, line, str(n),
+                    format_statistic(blank), format_statistic(mean),
+                    format_statistic(difficulty), format_statistic(discrimination))))
+                f.write("\n")
+
+    def _export_answers(self):
+        """ writes a row per answer with its weight, the ratio of
+        students that marked it and its correlation with the total """
+        char = self.options.csvseparator
+        n = self.nr_students
+        sum_t, sum_tt = self.sum_totals, self.sum_squared_totals
+        with open(self.options.answersreport, "w") as f:
+            f.write(char.join(_ANALYSIS_ANSWER_HEADER))
+            f.write("\n")
+            for position, question_nr in enumerate(self.key.questions):
+                marked = dict((answer_id, [ 0, 0.0 ]) for answer_id in self.key.answer_ids[position])
+                for m, (count, sum_t_marks) in self.groups[position].items():
+                    for answer_id in parse_marks(m):
+                        marked[answer_id][0] += count
+                        marked[answer_id][1] += sum_t_marks
+                filename, line = self.key.sources[position]
+                for answer_id in self.key.answer_ids[position]:
+                    count, sum_t_marks = marked[answer_id]
+                    frequency = count / float(n) if n else None
+                    discrimination = correlation(n, count, sum_t, count, sum_tt, sum_t_marks)
+                    f.write(char.join((question_nr, '"%s"'%answer_id, '"%s"'%filename, line,
+                        str(self.key.weights[position][answer_id]),
+                        format_statistic(frequency), format_statistic(discrimination))))
+                    f.write("\n")
+#
+def compose_argparse():
+    """ composes and returns an ArgumentParser """
+    p = argparse.ArgumentParser(description = "Quiz grader", version="1.0")
+    subparsers = p.add_subparsers(dest="command")
+
+    g = subparsers.add_parser("grade", help=u"Grade response sheets against an answer key")
+    g.add_argument('files', metavar='sheetfiles', nargs='+', help="response sheet csv files")
+    g.add_argument("-k", "--answerKey", action="store",
+            help=u"Set the answer key: the evaluation information (.eval.csv or .eval.long.csv) generated by shufflequiz.py",
+            dest="answerkey")
+    g.add_argument("-O", "--orders", action="store",
+            help=u"Set the orders of the variants (.orders.json generated by shufflequiz.py): sheets are then of any variant, with a %s column, and the key is the one of the unshuffled exam"%_VARIANT_HEADER,
+            dest="orders")
+    add_common_arguments(g)
+
+    a = subparsers.add_parser("align", help=u"Align response sheets of variants to the unshuffled exam")
+    a.add_argument('files', metavar='sheetfiles', nargs='+', help="response sheet csv files, with a %s column"%_VARIANT_HEADER)
+    a.add_argument("-O", "--orders", action="store",
+            help=u"Set the orders of the variants (.orders.json generated by shufflequiz.py)",
+            dest="orders")
+    add_common_arguments(a)
+
+    n = subparsers.add_parser("analyze", help=u"Compute the difficulty and discrimination of each question and the frequency of each answer")
+    n.add_argument('files', metavar='sheetfiles', nargs='+', help="response sheet csv files")
+    n.add_argument("-k", "--answerKey", action="store",
+            help=u"Set the answer key: the evaluation information generated by shufflequiz.py. The long format (.eval.long.csv) adds the file and line of each question to the report",
+            dest="answerkey")
+    n.add_argument("-O", "--orders", action="store",
+            help=u"Set the orders of the variants (.orders.json generated by shufflequiz.py), as for grade",
+            dest="orders")
+    n.add_argument("-A", "--answersReport", action="store",
+            help=u"Set the filename of the report per answer (default none)",
+            dest="answersreport")
+    add_common_arguments(n)
+
+    return p
+#
+def add_common_arguments(p):
+    """ adds to p the output and csv arguments shared by every command """
+    p.add_argument("-o", "--outputFilename", action="store",
+            help="Set the output filename", dest="outputfile")
+    p.add_argument("-r", "--rewriteOutput", action="store_true",
+            help="Do not ask when the output file already exists",
+            dest="overwrite")
+    p.add_argument("-c", "--csvSeparator", action="store",
+            help=u"Set the separator of the csv files (default ',')",
+            dest="csvseparator", default=',')
+#
+def exit_if_option_errors(options):
+    """ filters option errors and exits if there are any """
+    if not options.outputfile:
+        show_error_and_exit("Output filename must be set")
+    if options.command in ("grade", "analyze") and not options.answerkey:
+        show_error_and_exit("Answer key must be set")
+    if options.command == "align" and not options.orders:
+        show_error_and_exit("Orders must be set")
+    if len(options.csvseparator) != 1:
+        show_error_and_exit("Csv separator must be a single character")
+#
+def get_options():
+    """ returns the call arguments as an argparse """
+    p = compose_argparse()
+    options = p.parse_args()
+    exit_if_option_errors(options)
+    exit_if_inputfiles_do_not_exist([ f for f in (getattr(options, "answerkey", None), options.orders) if f ]
+            + options.files)
+    if not options.overwrite:
+        exit_if_outputfiles_already_exist([ f for f in (options.outputfile, getattr(options, "answersreport", None)) if f ])
+    return options
+#
+def show_error_and_exit(msg, exit_code=1):
+    """ shows an error missage and exists with exit_code """
+    print >> sys.stderr, "%s: error: %s"%(sys.argv[0], msg)
+    sys.exit(exit_code)
+#
+def show_warning(msg):
+    """ shows a warning message """
+    print >> sys.stderr, "%s: warning: %s"%(sys.argv[0], msg)
+#
+def existing_files(filenames):
+    """ returns the list of existing files """
+    return [ f for f in filenames if os.path.isfile(f)]
+#
+def missing_files(filenames):
+    """ returns the list of missing files """
+    return [ f for f in filenames if not os.path.isfile(f)]
+#
+def exit_if_outputfiles_already_exist(filenames):
+    """ check if any of the filenames already exists.
+    In this case, it issues an error and finishes execution """
+    existing = existing_files(filenames)
+    if existing <> []:
+        show_error_and_exit("Output file %s already exists. Remove it or use --rewriteOutput option"%existing[0], 2);
+#
+def exit_if_inputfiles_do_not_exist(filenames):
+    """ check if any of the filenames doesn't exists """
+    missing = missing_files(filenames)
+    if missing <> [] :
+        show_error_and_exit("Input file %s doesn't exist"%missing[0], 2);
+#
+def parse_marks(marks):
+    """ returns the answer ids marked on marks (e.g. "ac"), each one
+    once """
+    answer_ids = []
+    for answer_id in marks.lower():
+        if not answer_id.isspace() and answer_id not in answer_ids:
+            answer_ids.append(answer_id)
+    return answer_ids
+#
+def compose_answer_table(order):
+    """ returns the translation table of answer ids on a variant to the
+    canonical ones, given the order of the shuffled answers (indexes on
+    the canonical answers, as on QuizOrder.answers). Answers after them
+    (i.e. final answers) keep their ids """
+    source = ""
+    target = ""
+    for nr, i in enumerate(order):
+        source += compose_answer_id(nr + 1) + compose_answer_id(nr + 1).upper()
+        target += compose_answer_id(i + 1) * 2
+    for letter in string.ascii_lowercase[len(order):]:
+        source += letter + letter.upper()
+        target += letter * 2
+    return string.maketrans(source, target)
+#
+def compose_answer_id(nr):
+    """ returns an answer id from nr """
+    return chr(ord("a")+nr-1)
+#
+def show_throughput(action, nr_sheets, elapsed):
+    """ shows on stderr the number of sheets per second """
+    print >> sys.stderr, "%s %s sheets in %.3f s (%.0f sheets/s)"%(action, nr_sheets,
+            elapsed, nr_sheets / elapsed if elapsed else 0)
+#
+def correlation(n, sum_x, sum_y, sum_xx, sum_yy, sum_xy):
+    """ returns the pearson correlation of n pairs (x, y) from their sums,
+    or None when it is undefined (e.g. x or y are constant) """
+    variance = (n * sum_xx - sum_x * sum_x) * (n * sum_yy - sum_y * sum_y)
+    if variance <= 0:
+        return None
+    return (n * sum_xy - sum_x * sum_y) / math.sqrt(variance)
+#
+def format_statistic(value):
+    """ returns value formatted for a report, empty when undefined """
+    return "" if value == None else "%.4f"%value
+#
+def parse_weight(filename, nlin, weight):
+    """ returns weight as a float, or quits when it is not a number """
+    try:
+        return float(weight)
+    except ValueError:
+        show_error_and_exit("file: %s [line: %s] -> bad weight %s."%(filename, nlin, weight), 3)
+#
+def main():
+    options = get_options()
+    if options.command == "grade":
+        Grader(options).run()
+    elif options.command == "align":
+        Aligner(options).run()
+    elif options.command == "analyze":
+        ItemAnalysis(options).run()
+#
+if __name__=="__main__":
+    sys.exit(main())
@@ -111,13 +111,33 @@ import argparse
 import re
 import datetime
 import logging
+import glob
+import time
+import multiprocessing
+import mmap
+import quizcache
+import quizmanifest
+import quizerrors
+import quizprofile
 #
 _MARKUP_MARK = "markup"
 _QUESTION_MARK = "pregunta"
 _DESCRIPTION_MARK = "enunciat"
 _ANSWER_MARK = "resposta"
+_VERSION = "1.0"
+_PARSER_VERSION = 1                # changes whenever cached parsings are no longer valid
+#
+_LINE_COMMENT = "comment"          # kinds of line as tagged by LineClassifier
+_LINE_MARKUP = "markup"
+_LINE_QUESTION = "question"
+_LINE_DESCRIPTION = "description"
+_LINE_ANSWER = "answer"
+_LINE_TEXT = "text"
+#
+_ANSWER_CORRECT = 1                # bits of Answer.flags
+_ANSWER_FINAL = 2
 
-_XML_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+_XML_HEADER_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
 
 <!-- 
      This file has been generated automaticaly using %s
@@ -132,9 +152,11 @@ _XML_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
           <text>$course$/Preguntes guais</text>
       </category>
   </question>
-%s
+"""     # it requires (programname, fromfiles, ondate)
+
+_XML_FOOTER = """
 </quiz>
-"""     # it requires some parameters
+"""
 
 _XML_QUESTION_TEMPLATE = """
     <question type="multichoice">
@@ -163,6 +185,7 @@ _XML_ANSWER_TEMPLATE = """
 _XML_QUIZ_SEPARATION = "\n\n\n"     # TODO: consider adding a comment of the quiz filename
 _XML_QUESTION_SEPARATION = "\n\n\n"
 _XML_ANSWER_SEPARATION = "\n"
+_XML_WRITE_BUFFER = 1 << 16     # bytes buffered by the streaming writer
 
 
 #
@@ -197,47 +220,104 @@ def setLoggingConfig():
     loggingLevel = logging.INFO
     logging.basicConfig(filename=loggingFile,level=loggingLevel, format="%(asctime)s %(levelname)s: %(message)s")
 #
-class Answer:
+class LineClassifier:
+    """ tags each line of a quiz file with its kind (comment, markup, question,
+    description, answer or text) in a single pass.
+    The marks of the vocabulary (e.g. pregunta, enunciat, resposta) are
+    set on construction, so their prefixes are built just once. """
+    def __init__(self, question_mark=_QUESTION_MARK,
+            description_mark=_DESCRIPTION_MARK, answer_mark=_ANSWER_MARK, markup_mark=_MARKUP_MARK):
+        self.marks = {      # ".. «mark»:" -> kind
+            ".. %s:"%question_mark: _LINE_QUESTION,
+            ".. %s:"%description_mark: _LINE_DESCRIPTION,
+            ".. %s:"%answer_mark: _LINE_ANSWER,
+            ".. %s:"%markup_mark: _LINE_MARKUP,
+        }
+
+    @classmethod
+    def from_options(cls, options):
+        """ returns a classifier with the vocabulary set in options """
+        return cls(question_mark=options.questionmark,
+                description_mark=options.descriptionmark,
+                answer_mark=options.answermark)
+
+    def classify(self, lin):
+        """ returns the kind of lin.
+            Lines not starting with ".." are rejected as text right away.
+            Otherwise, the prefix up to the first colon is looked up
+            on the marks of the vocabulary. """
+        if not lin.startswith(".."):
+            return _LINE_TEXT
+        if lin.startswith(".. #") or lin.startswith(".. /"):
+            return _LINE_COMMENT
+        colon = lin.find(":")
+        if colon < 0:
+            return _LINE_TEXT
+        return self.marks.get(lin[:colon + 1], _LINE_TEXT)
+#
+class Answer(object):
+    __slots__ = ("flags", "text", "text_fragments")
+
     def __init__(self, is_correct, is_final):
-        self.is_correct = is_correct
-        self.is_final = is_final
+        self.flags = (_ANSWER_CORRECT if is_correct else 0) | (_ANSWER_FINAL if is_final else 0)
         self.text = ""
+        self.text_fragments = []    # joined into text on postprocess()
+
+    @property
+    def is_correct(self):
+        return self.flags & _ANSWER_CORRECT <> 0
+
+    @property
+    def is_final(self):
+        return self.flags & _ANSWER_FINAL <> 0
 
     def add_description(self, text):
-        self.text += text
+        self.text_fragments.append(text)
         return self
 
     def is_complete(self):
         """ true if it has an unempty text """
-        return self.text <> ""
+        return len(self.text_fragments) > 0 or self.text <> ""
 
     def postprocess(self):
-        """ cleans up the answer text by:
+        """ joins the answer text fragments and cleans it up by:
             a) removing start and end whitespaces
             b) adding a new line at the begining when it starts with a
             comment or rst directive (btw: a comment matches "^\s*\.\..*" )
+            Once joined, the fragments are released and the text is
+            interned, since the same answers (e.g. "None of the above")
+            are repeated all along the banks.
         """
+        if self.text_fragments:
+            self.text = "".join(self.text_fragments)
+            self.text_fragments = ()
         self.text = self.text.strip()
         if re.match("^\s*\.\..*", self.text):
             self.text = os.linesep * 2 + self.text
+        self.text = intern(self.text)
         return self
 
     def __repr__(self):
         return '{ "is_correct":%s, "is_final":%s, "text":"%s" }'%(self.is_correct, self.is_final, self.text)
 
-class Question:
-    def __init__(self, options):
-        self.options = options
+class Question(object):
+    __slots__ = ("title", "descr", "title_fragments", "descr_fragments",
+            "answers", "final_answers", "current_answer",
+            "nr_correct_answers", "nr_incorrect_answers")
+
+    def __init__(self):
         self.reset()
 
     def appendToTitle(self, title):
-        cleantitle = title.strip()
-        if cleantitle <> "":
-            self.title += " " + cleantitle
+        """ appends each unempty line of title """
+        for line in title.splitlines():
+            cleantitle = line.strip()
+            if cleantitle <> "":
+                self.title_fragments.append(cleantitle)
         return self
 
     def add_description(self, descr):
-        self.descr += descr
+        self.descr_fragments.append(descr)
         return self
 
     def add_answer(self, answer):
@@ -255,11 +335,11 @@ class Question:
 
     def has_proper_title(self):
         """ true if it has proper title """
-        return self.title <> ""
+        return len(self.title_fragments) > 0 or self.title <> ""
 
     def has_proper_description(self):
         """ true if it has proper description """
-        return self.descr <> ""
+        return len(self.descr_fragments) > 0 or self.descr <> ""
 
     def has_finished_current_answer(self):
         """ true if current answer is complete """
@@ -274,6 +354,8 @@ class Question:
         """ sets all properties to initial values """
         self.title = ""
         self.descr = ""
+        self.title_fragments = []   # joined into title on postprocess()
+        self.descr_fragments = []   # joined into descr on postprocess()
         self.answers = []
         self.final_answers = []
         self.current_answer = None
@@ -282,10 +364,16 @@ class Question:
         return self
 
     def postprocess(self):
-        """ cleans up the text info by removing start and end whitespaces
+        """ joins the text fragments and cleans them up by removing start and end whitespaces
             and shuffles answers if required. """
-        self.title = self.title.strip()
+        if self.title_fragments:
+            self.title = " ".join(self.title_fragments)
+            self.title_fragments = ()
+        if self.descr_fragments:
+            self.descr = "".join(self.descr_fragments)
+            self.descr_fragments = ()
         self.descr = self.descr.strip()
+        self.current_answer = None
         self._postprocess_answers()
         return self
 
@@ -293,14 +381,37 @@ class Question:
         for answer in self.answers:
             answer.postprocess()
 
+    def to_record(self):
+        """ returns the contents of this question, as scanned, in a
+        plain tuple (title, descr, ((answer flags, answer text),...)).
+        It is not available once the question has been postprocessed """
+        answers = tuple((answer.flags, "".join(answer.text_fragments))
+                for answer in self.answers + self.final_answers)
+        return (" ".join(self.title_fragments), "".join(self.descr_fragments), answers)
+
+    @classmethod
+    def from_record(cls, record):
+        """ returns a question with the contents of record, as
+        returned by to_record() """
+        title, descr, answers = record
+        question = cls()
+        question.title_fragments.append(title)
+        question.descr_fragments.append(descr)
+        for flags, text in answers:
+            answer = Answer(flags & _ANSWER_CORRECT, flags & _ANSWER_FINAL)
+            question.add_answer(answer.add_description(text))
+        return question
+
     def clone(self):
         """ returns a clon of this question.
             It does not clone answers (not required for 
             current usage). It should be done however if
             once cloned, answers could be modified. """
-        new_question = Question(self.options)
+        new_question = Question()
         new_question.title = self.title
         new_question.descr = self.descr
+        new_question.title_fragments = self.title_fragments
+        new_question.descr_fragments = self.descr_fragments
         new_question.answers = self.answers
         new_question.final_answers = self.final_answers
         new_question.nr_correct_answers = self.nr_correct_answers
@@ -334,18 +445,16 @@ class Question:
     def _xml_composeanswers(self):
         """ composes the evaluation information of the answer list in gift format."""
         xmlanswers = []
-        for answer in self.answers:
-            answer_weight = self._compute_answer_weight_for_gift(answer.is_correct)
+        for answer, weight in zip(self.answers, self.compute_weights()):
+            answer_weight = format_gift_weight(weight)
             xmlanswer = _XML_ANSWER_TEMPLATE%(answer_weight, answer.text)
             xmlanswers.append(xmlanswer)
         return _XML_ANSWER_SEPARATION.join(xmlanswers)
 
-    def _compute_answer_weight_for_gift(self, is_correct):
-        """ returns the weight of an answer deppending on whether is_correct or not.
-        The result is a string with the format expected by Moodle's Gift """
-        nr = self._compute_answer_class(is_correct)
-        weight = _MAP_GIFT_WEIGHTS.get(nr, "%0.3f"%self._compute_answer_weight_fulldecimal(is_correct))
-        return weight
+    def compute_weights(self):
+        """ returns the list of weights of the answers """
+        return [ self._compute_answer_weight_fulldecimal(answer.is_correct)
+                for answer in self.answers ]
 
     def __repr__(self):
         answers = ",".join([ repr(r) for r in self.answers ])
@@ -357,6 +466,9 @@ class Quiz:
         self.options = options
         self.markup = None
         self.questions = [] if questions == None else questions
+        self._finished_questions = []   # pending to be yielded by the scanner
+        self.cached = False             # true when questions come from the cache
+        self.classifier = LineClassifier.from_options(options)
 
     def run(self):
         self._scan_quiz_file()
@@ -366,14 +478,43 @@ class Quiz:
         """ performs cleaning up on questions """
         for q in self.questions:
             q.postprocess()
+        return self
 
     def nr_questions(self):
         """ returns the number of questions in this quiz """
         return len(self.questions)
 
+    def iter_questions(self):
+        """ generator of the postprocessed questions of this quiz.
+            When the quiz has been run, they are the already scanned
+            ones. Otherwise, they are scanned from the file one at a
+            time as soon as each one is finished, so memory doesn't
+            depend on the size of the file. """
+        if self.questions:
+            for question in self.questions:
+                yield question
+        else:
+            for question in self._questions_from_file():
+                yield question.postprocess()
+            self._check_complete_quiz()
+
     def toXML(self):
         """ extracts evaluation information of this quiz in Moodle XML format"""
-        return _XML_QUESTION_SEPARATION.join(question.toXML() for question in self.questions)
+        return _XML_QUESTION_SEPARATION.join(question.toXML() for question in self.iter_questions())
+
+    def writeXML(self, f):
+        """ writes this quiz in Moodle XML format to file f, one question
+        at a time as it is rendered. Same contents as toXML().
+        Returns the number of questions and answers written """
+        separation = ""
+        nr_questions = nr_answers = 0
+        for question in self.iter_questions():
+            f.write(separation)
+            f.write(question.toXML())
+            separation = _XML_QUESTION_SEPARATION
+            nr_questions += 1
+            nr_answers += question.get_nr_answers()
+        return nr_questions, nr_answers
     
     def _check_complete_quiz(self):
         """ checks whether the contents of the file contains everything required """
@@ -386,104 +527,183 @@ class Quiz:
     def _set_markup(self, lin, nlin):
         """ sets the markup if it hasn't been set before. Otherwise it quits """
         if self.markup:
-            show_scan_error_and_exit(self.filename, nlin, "unexpected redeclaration of markup")
+            raise quizerrors.QuizScanError(self.filename, nlin, "unexpected redeclaration of markup")
         markup = lin[len(_MARKUP_MARK)+5:].strip().lower()
         if markup in ('md', 'markdown'):
             self.markup = 'md'
         else:
             self.markup = markup
 
-    def _scan_question(self, lin, nlin, question):
-        """ scans line lin on state="question" 
-            Returns new state and question, or quits on error """
-        if is_a_question(lin):
+    def _scan_question(self, kind, lin, nlin, question):
+        """ scans line lin of kind on state="question" 
+            Returns new state and question, or raises QuizScanError """
+        if kind == _LINE_QUESTION:
             state = "title"
             question.reset()
-        elif is_a_description(lin) or is_an_answer(lin):
-            show_scan_error_and_exit(self.filename, nlin, "expected question but another mark found")
+        elif kind == _LINE_DESCRIPTION or kind == _LINE_ANSWER:
+            raise quizerrors.QuizScanError(self.filename, nlin, "expected question but another mark found")
         else:
             state = "question"
         return state
 
-    def _scan_title(self, lin, nlin, question):
-        """ scans line on state="title"
-            updates question and returns a new state, or quits on error """
+    def _scan_title(self, kind, lin, nlin, question):
+        """ scans line of kind on state="title"
+            updates question and returns a new state, or raises QuizScanError """
         state = "title"
-        if is_a_question(lin):
-            show_scan_error_and_exit(self.filename, nlin, "unexpected start of question")
-        elif is_a_description(lin):   # title is done
+        if kind == _LINE_QUESTION:
+            raise quizerrors.QuizScanError(self.filename, nlin, "unexpected start of question")
+        elif kind == _LINE_DESCRIPTION:   # title is done
             if question.has_proper_title():
                 state = "description"
             else:
-                show_scan_error_and_exit(self.filename, nlin, "question title unset")
-        elif is_an_answer(lin):
-            show_scan_error_and_exit(self.filename, nlin, "unexpected start of answer")
-        elif not is_a_comment(lin):
+                raise quizerrors.QuizScanError(self.filename, nlin, "question title unset")
+        elif kind == _LINE_ANSWER:
+            raise quizerrors.QuizScanError(self.filename, nlin, "unexpected start of answer")
+        elif kind == _LINE_TEXT:
             question.appendToTitle(lin)
         return state
 
     def _process_current_answer(self, lin, nlin, question):
         """ processes lin as an answer.
-            Updates question or quits on badformed question """
-        answer_header = process_answer_mark(lin)
+            Updates question or raises QuizScanError on badformed question """
+        answer_header = process_answer_flags(lin)
         if answer_header == None:
-            show_scan_error_and_exit(self.filename, nlin, "badformed answer header")
+            raise quizerrors.QuizScanError(self.filename, nlin, "badformed answer header")
         else:
             is_correct, is_final = answer_header
             partial_answer = Answer(is_correct, is_final)
             question.add_answer(partial_answer)
 
-    def _scan_description(self, lin, nlin, question):
-        """ scans line on state="description"
-            updates question and returns a new state, or quits on error """
+    def _scan_description(self, kind, lin, nlin, question):
+        """ scans line of kind on state="description"
+            updates question and returns a new state, or raises QuizScanError """
         state = "description"
-        if is_an_answer(lin):      # description is over
+        if kind == _LINE_ANSWER:      # description is over
             if question.has_proper_description():
                 self._process_current_answer(lin, nlin, question)
                 state = "answer"
             else:
-                show_scan_error_and_exit(self.filename, nlin, "question description unset")
-        elif is_a_question(lin):    # previous question had no responses (it is ok)
+                raise quizerrors.QuizScanError(self.filename, nlin, "question description unset")
+        elif kind == _LINE_QUESTION:    # previous question had no responses (it is ok)
             if question.has_proper_description():
-                self.questions.append(question.clone())
+                self._finished_questions.append(question.clone())
                 state = "title"
                 question.reset()
             else:
-                show_scan_error_and_exit(self.filename, nlin, "question description unset")
-        elif is_a_description(lin):    # badformed: more than one description mark
-                show_scan_error_and_exit(self.filename, nlin, "too many description marks")
-        elif not is_a_comment(lin):
+                raise quizerrors.QuizScanError(self.filename, nlin, "question description unset")
+        elif kind == _LINE_DESCRIPTION:    # badformed: more than one description mark
+                raise quizerrors.QuizScanError(self.filename, nlin, "too many description marks")
+        elif kind == _LINE_TEXT:
             question.add_description(lin)
         return state
 
-    def _scan_answer(self, lin, nlin, question):
-        """ scans line on state="description"
-            updates question and returns a new state, or quits on error """
+    def _scan_answer(self, kind, lin, nlin, question):
+        """ scans line of kind on state="answer"
+            updates question and returns a new state, or raises QuizScanError """
         state = "answer"
-        if is_a_question(lin):  # end of answers, new question
+        if kind == _LINE_QUESTION:  # end of answers, new question
             if question.has_finished_current_answer():
-                self.questions.append(question.clone())
+                self._finished_questions.append(question.clone())
                 question.reset()
                 state = "title"
             else:
-                show_scan_error_and_exit(self.filename, nlin, "unfinished answer")
-        elif is_an_answer(lin):     # it is a new answer
+                raise quizerrors.QuizScanError(self.filename, nlin, "unfinished answer")
+        elif kind == _LINE_ANSWER:     # it is a new answer
             if question.get_nr_answers() >= self.options.maxanswers:
                 logging.error("Quiz._scan_answer(lin:%s, nlin:%s, question) \n\tquestion.get_nr_answers():%s\n\toptions.maxanswers:%s"%(lin, nlin, question.get_nr_answers(), self.options.maxanswers))
-                show_scan_error_and_exit(self.filename, nlin, "exceded max nr of answers per question")
+                raise quizerrors.QuizScanError(self.filename, nlin, "exceded max nr of answers per question")
             elif question.has_finished_current_answer():
                 self._process_current_answer(lin, nlin, question)
             else:
-                show_scan_error_and_exit(self.filename, nlin, "unfinished answer")
-        elif is_a_description(lin):
-            show_scan_error_and_exit(self.filename, nlin, "unexpected description mark")
-        elif not is_a_comment(lin):
+                raise quizerrors.QuizScanError(self.filename, nlin, "unfinished answer")
+        elif kind == _LINE_DESCRIPTION:
+            raise quizerrors.QuizScanError(self.filename, nlin, "unexpected description mark")
+        elif kind == _LINE_TEXT:
             question.current_answer.add_description(lin)
         return state
 
     def _scan_quiz_file(self):
         """ interprets quiz filename and place corresponding questions on
-        self.questions.
+        self.questions. """
+        self.questions.extend(self._questions_from_file())
+
+    def _questions_from_file(self):
+        """ generator of the (not yet postprocessed) questions of the
+        file. They come from the cache when the file has been already
+        parsed. Otherwise they are scanned and stored on the cache. """
+        cache = self.options.cache
+        if cache == None:
+            for question in self._scan_questions():
+                yield question
+            return
+        key = cache.compose_key(self.filename, *self._cache_params())
+        records = cache.load(key)
+        if records != None:
+            self.cached = True
+            for record in records:
+                if isinstance(record, dict):    # trailer
+                    self._set_cache_trailer(record)
+                else:
+                    yield Question.from_record(record)
+            return
+        writer = cache.writer(key)
+        try:
+            for question in self._scan_questions():
+                writer.write(question.to_record())
+                yield question
+            writer.write(self._get_cache_trailer())
+            writer.commit()
+        finally:
+            writer.abort()
+
+    def _cache_params(self):
+        """ returns whatever affects the parsing of the file """
+        options = self.options
+        return ("quiz2moodlexml", _PARSER_VERSION, options.questionmark,
+                options.descriptionmark, options.answermark,
+                options.maxanswers)
+
+    def _get_cache_trailer(self):
+        """ returns the attributes of this quiz, other than questions,
+        to be cached """
+        return { "markup": self.markup }
+
+    def _set_cache_trailer(self, trailer):
+        """ sets the attributes cached by _get_cache_trailer() """
+        self.markup = trailer["markup"]
+
+    def _iter_lines(self, f):
+        """ returns an iterator on (kind, lin, nlin) of the lines of
+            file f. Unless disabled, it scans the memory map of f (see
+            iter_mapped_lines()), so the text lines are not split one by
+            one. Files that can't be mapped (e.g. empty) are read line
+            by line """
+        classify = self.classifier.classify
+        if self.options.usemmap:
+            try:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, EnvironmentError):
+                buf = None
+            if buf != None:
+                return iter_mapped_lines(buf, classify)
+        return iter_file_lines(f, classify)
+
+    def scan_lines(self, lines):
+        """ generator of the (not yet postprocessed) questions scanned
+        from lines (e.g. an open file, a stream or a list of lines)
+        instead of the file of this quiz """
+        return self._scan_classified_lines(iter_file_lines(lines, self.classifier.classify))
+
+    def _scan_questions(self):
+        """ generator of the questions scanned from the file of this quiz """
+        with open(self.filename) as f:
+            for question in self._scan_classified_lines(self._iter_lines(f)):
+                yield question
+
+    def _scan_classified_lines(self, lines):
+        """ interprets lines, an iterator on (kind, lin, nlin), and yields
+        each question as soon as it is finished (i.e. its last answer
+        ends).
         It works as an state machine with the following states:
 
             - question:     waiting to get a question mark
@@ -492,29 +712,34 @@ class Quiz:
             - answer:       waiting to get the text of an answer
         """
         state = "question"
-        nlin = 0            # line number under process
-        question = Question(self.options)
+        question = Question()
+        finished = self._finished_questions
+        self.markup = None
 
-        with open(self.filename) as f:
-            for lin in f:
-                nlin += 1
-                if is_a_comment(lin):
-                    pass
-                elif is_markup_mark(lin):
-                    self._set_markup(lin, nlin)
-                elif state == "question":
-                    state = self._scan_question(lin, nlin, question)
-                elif state == "title":
-                    state = self._scan_title(lin, nlin, question)
-                elif state == "description":
-                    state = self._scan_description(lin, nlin, question)
-                elif state == "answer":
-                    state = self._scan_answer(lin, nlin, question)
-            # check last question
-            if question.is_complete():
-                self.questions.append(question) # it is not required to clone
-            else:
-                show_scan_error_and_exit(self.filename, nlin, "end of file reached leaving unfinished question")
+        lin, nlin = "", 0     # the last line, once the loop is over
+        for kind, lin, nlin in lines:
+            if kind == _LINE_COMMENT:
+                pass
+            elif kind == _LINE_MARKUP:
+                self._set_markup(lin, nlin)
+            elif state == "question":
+                state = self._scan_question(kind, lin, nlin, question)
+            elif state == "title":
+                state = self._scan_title(kind, lin, nlin, question)
+            elif state == "description":
+                state = self._scan_description(kind, lin, nlin, question)
+            elif state == "answer":
+                state = self._scan_answer(kind, lin, nlin, question)
+            if finished:
+                for finished_question in finished:
+                    yield finished_question
+                del finished[:]
+        # check last question
+        if question.is_complete():
+            yield question # it is not required to clone
+        else:
+            last_line = nlin + lin.count("\n") - lin.endswith("\n")   # the last item may span several lines
+            raise quizerrors.QuizScanError(self.filename, last_line, "end of file reached leaving unfinished question")
 #
 class QuizSet:
     def __init__(self, options):
@@ -522,40 +747,229 @@ class QuizSet:
         self.quizes = []
 
     def run(self):
-        for quizfile in self.options.files:
-            self._process(quizfile)
-        self._postprocess()
+        profiler = self.options.profiler
+        with profiler.phase("scan") as counts:
+            if self.options.jobs > 1:
+                self._process_in_pool()
+            else:
+                for quizfile in self.options.files:
+                    self._process(quizfile)
+        if profiler.enabled:
+            counts["files"] = len(self.options.files)
+            counts["lines"] = quizprofile.count_lines(self.options.files)
+        if self.options.jobs <= 1:      # otherwise, the workers postprocessed them
+            with profiler.phase("postprocess"):
+                self._postprocess()
 
     def export(self):
-        """ generates output """
-        self._export_xml()
+        """ generates output, when not up to date. Unless quizes were
+        scanned on a pool, they are scanned while the xml is written """
+        profiler = self.options.profiler
+        if self._is_outdated("xml"):
+            with profiler.phase("xml") as counts:
+                nr_questions, nr_answers = self._export_xml()
+            if profiler.enabled:
+                counts["questions"] = nr_questions
+                counts["answers"] = nr_answers
+                counts["bytes"] = os.path.getsize(self.options.outputfilenames["xml"])
+        self._close_cache()
+        self.close_build()
+
+    def close_build(self):
+        """ records the built output on the build manifest and reports
+        whether it was skipped or rebuilt """
+        manifest = self.options.manifest
+        if manifest != None:
+            manifest.save()
+            manifest.report()
+
+    def _is_outdated(self, kind):
+        """ true when the output of kind must be (re)built """
+        manifest = self.options.manifest
+        return manifest == None or manifest.outdated(self.options.outputfilenames[kind])
+
+    def _close_cache(self):
+        """ keeps the cache in size and shows its stats if required """
+        cache = self.options.cache
+        if cache != None:
+            cache.evict()
+            if self.options.cachestats:
+                print >> sys.stderr, cache.stats()
 
     def _export_xml(self):
-        xmlquestions = _XML_QUIZ_SEPARATION.join(quiz.toXML() for quiz in self.quizes)
-
+        """ streams the xml contents to the output file.
+            Contents are written to a temporary file first, that is only
+            renamed to the output file once complete, so a scan error
+            in the middle does not leave a truncated output.
+            Returns the number of questions and answers written """
+        filename = self.options.outputfilenames["xml"]
+        tmpfilename = "%s.tmp"%filename
+        try:
+            with open(tmpfilename, "w", _XML_WRITE_BUFFER) as f:
+                written = self._write_xml(f)
+        except BaseException:   # including QuizScanError
+            os.remove(tmpfilename)
+            raise
+        os.rename(tmpfilename, filename)
+        return written
+
+    def _write_xml(self, f):
+        """ writes header, each question as it is rendered, and footer
+        to file f. Returns the number of questions and answers written """
         programname = sys.argv[0]
         fromfiles = ", ".join(self.options.files)
         ondate = datetime.datetime.now().isoformat()
-        xmlcontents = _XML_TEMPLATE%(programname, fromfiles, ondate, xmlquestions)
-        with open(self.options.outputfilenames["xml"], "w") as f:
-            f.write(xmlcontents)
+        f.write(_XML_HEADER_TEMPLATE%(programname, fromfiles, ondate))
+        separation = ""
+        nr_questions = nr_answers = 0
+        for quiz in self.quizes:
+            f.write(separation)
+            quiz_questions, quiz_answers = quiz.writeXML(f)
+            nr_questions += quiz_questions
+            nr_answers += quiz_answers
+            separation = _XML_QUIZ_SEPARATION
+        f.write(_XML_FOOTER)
+        return nr_questions, nr_answers
 
     def _process(self, filename):
-        """ processes the corresponding quiz """
+        """ processes the corresponding quiz.
+            Since questions are never reordered, the quiz is not run:
+            its questions are streamed from the file on export """
         quiz = Quiz(filename, self.options)
-        quiz.run()
         self.quizes.append(quiz)
 
+    def _process_in_pool(self):
+        """ processes the quizes on a pool of options.jobs processes,
+            keeping the order of the files.
+            Unlike _process(), quizes are run (and postprocessed) by the
+            workers, so their questions are kept instead of streamed.
+            On scan errors, it raises the error of the first one """
+        pool = multiprocessing.Pool(self.options.jobs)
+        try:
+            results = pool.map(scan_quiz_file, [ (filename, self.options) for filename in self.options.files ])
+        finally:
+            pool.close()
+            pool.join()
+        for filename, questions, cached, error in results:
+            if error is not None:
+                raise error
+            if self.options.cache != None:
+                self.options.cache.count(cached)
+            self.quizes.append(Quiz(filename, self.options, questions))
+
     def _postprocess(self):
         """ performs clean up """
         for quiz in self.quizes:
             quiz.postprocess()
 #
+class QuizWatcher(object):
+    """ keeps the quizes of a quiz set scanned and re-exports its xml
+        whenever any of their files changes, until interrupted.
+        The input files are expanded again on each check, so .quiz
+        files added to (or removed from) a watched directory or glob
+        pattern are picked up. Files are polled by their size and
+        modification time. Only the changed (or added) ones are scanned
+        again: the quizes of the rest are kept. A missing file is
+        scanned again once recreated.
+        While any file is badformed or missing, its error is shown and
+        the xml is left as it was """
+    def __init__(self, quiz_set, interval):
+        self.quiz_set = quiz_set
+        self.interval = interval
+        self.states = {}        # [ size, mtime ] of each file when last scanned
+        self.quizes = {}        # quiz of each file when last scanned (None when badformed)
+
+    def run(self):
+        files = self.quiz_set.options.files
+        self._rebuild(files, files, initial=True)
+        print >> sys.stderr, "watching %s files (Ctrl-C to quit)"%len(files)
+        try:
+            while True:
+                time.sleep(self.interval)
+                files = self._expand_inputs()
+                changed = [ filename for filename in files
+                        if filename not in self.states
+                        or quizmanifest.file_state(filename) != self.states[filename] ]
+                if changed or files != self.quiz_set.options.files:
+                    self._rebuild(files, changed)
+        except KeyboardInterrupt:
+            pass
+
+    def _expand_inputs(self):
+        """ returns the input files as expanded now. Only .quiz files
+        are taken from the matches of glob patterns """
+        options = self.quiz_set.options
+        return [ filename for filename in expand_input_files(options.inputs)
+                if filename.endswith(".quiz") or filename in options.inputs ]
+
+    def _rebuild(self, files, changed, initial=False):
+        """ scans again the changed files and, when all the quizes of
+        files are wellformed, exports the xml of files and reports the
+        latency from the last edit of the changed files to the written
+        output (just the time to build it on the initial build) """
+        options = self.quiz_set.options
+        start = time.time()
+        edited = None
+        for filename in set(self.states) - set(files):  # no longer an input
+            del self.states[filename]
+            del self.quizes[filename]
+        for filename in changed:
+            state = self.states[filename] = quizmanifest.file_state(filename)
+            if state != None:
+                edited = max(edited, state[1])
+            self.quizes[filename] = self._scan(filename)
+        options.files = files
+        if options.manifest != None:
+            options.manifest.inputs = files
+        quizes = [ self.quizes[filename] for filename in files ]
+        if None in quizes:
+            return
+        self.quiz_set.quizes = quizes
+        self.quiz_set._export_xml()
+        if options.manifest != None:
+            options.manifest.check(options.outputfilenames.values(), rebuild_all=True)
+            options.manifest.save()
+        end = time.time()
+        if initial:
+            print >> sys.stderr, "built %s: %s files scanned in %.3f s"%(
+                    options.outputfilenames["xml"], len(changed), end - start)
+        else:
+            print >> sys.stderr, "rebuilt %s: %s changed files scanned in %.3f s, %.3f s after the last edit"%(
+                    options.outputfilenames["xml"], len(changed), end - start, end - (edited or start))
+
+    def _scan(self, filename):
+        """ returns the quiz of filename, run and postprocessed, or None
+        when it is badformed or can't be read """
+        quiz = Quiz(filename, self.quiz_set.options)
+        try:
+            quiz.run()
+        except quizerrors.QuizError as e:
+            show_error(str(e))
+            return None
+        except IOError as e:
+            print >> sys.stderr, "file: %s -> %s"%(filename, e.strerror)
+            return None
+        return quiz.postprocess()
+#
+def scan_quiz_file(args):
+    """ runs and postprocesses the quiz of filename with options.
+        It is meant to be run on a worker of QuizSet._process_in_pool().
+        Returns (filename, questions, cached, error), where error is the
+        QuizError raised, or None """
+    filename, options = args
+    quiz = Quiz(filename, options)
+    try:
+        quiz.run()
+        quiz.postprocess()
+    except quizerrors.QuizError as e:
+        return filename, None, quiz.cached, e
+    return filename, quiz.questions, quiz.cached, None
+#
 def compose_argparse():
     """ composes and returns an ArgumentParser """
-    p = argparse.ArgumentParser(description = "Quiz to Moodle XML format converter", version="1.0")
+    p = argparse.ArgumentParser(description = "Quiz to Moodle XML format converter", version=_VERSION)
 
-    p.add_argument('files', metavar='quizfiles', nargs='+', help="quiz files file paths with .quiz extension")
+    p.add_argument('files', metavar='quizfiles', nargs='+', help="quiz files file paths with .quiz extension, directories containing them or glob patterns")
 
     # output options
     p.add_argument("-o", "--outputFilename", action="store",
@@ -563,6 +977,16 @@ def compose_argparse():
     p.add_argument("-r", "--rewriteOutput", action="store_true",
             help="Do not ask when any output file already exists",
             dest="overwrite")
+    p.add_argument("-B", "--rebuildAll", action="store_true",
+            help=u"Rebuild the output, even when up to date according to the build manifest",
+            dest="rebuildall")
+    p.add_argument("-w", "--watch", action="store_true",
+            help=u"Keep running and rebuild the output whenever any quiz file changes (or is added to a directory or glob pattern), scanning again just the changed ones",
+            dest="watch")
+    p.add_argument("--watchInterval", action="store",
+            type=float,
+            help=u"Set the seconds between checks for changes of the quiz files on --watch (default 0.5)",
+            dest="watchinterval", default=0.5)
 
     # other options
     p.add_argument("-M", "--maxAnswersPerQuestion", action="store",
@@ -572,6 +996,51 @@ def compose_argparse():
     p.add_argument("-F", "--fixAvalAnswerNr", action="store_true", 
             help=u"Do fix the number of answers to the maxAnswersPerQuestion on the avaluation output",
             dest="fixavalanswernr")
+    p.add_argument("-j", "--jobs", action="store",
+            type=int,
+            help=u"Set the number of processes to parse the quiz files (default 1, 0 for as many as cpus)",
+            dest="jobs", default=1)
+
+    # cache options
+    p.add_argument("--noCache", "--no-cache", action="store_false",
+            help=u"Do not use the cache of parsed quiz files",
+            dest="usecache", default=True)
+    p.add_argument("--noMmap", action="store_false",
+            help=u"Do not scan the quiz files on a memory map, but line by line",
+            dest="usemmap", default=True)
+    p.add_argument("--cacheDir", action="store",
+            help=u"Set the directory of the cache of parsed quiz files (default %s)"%quizcache.default_cache_directory(),
+            dest="cachedir", default=None)
+    p.add_argument("--cacheSize", action="store",
+            type=int,
+            help=u"Set the maximum size in MB of the cache of parsed quiz files (default 256)",
+            dest="cachesize", default=256)
+    p.add_argument("--cacheStats", action="store_true",
+            help=u"Show the hits and misses of the cache of parsed quiz files",
+            dest="cachestats")
+
+    # profile options
+    p.add_argument("--profile", action="store_true",
+            help=u"Show the wall and cpu time, peak memory and counts (files, lines, questions, answers, bytes) of each phase",
+            dest="profile")
+    p.add_argument("--profileJson", action="store",
+            help=u"Write the measures of each phase to this json file (implies --profile)",
+            dest="profilejson", default=None)
+    p.add_argument("--cProfile", action="store",
+            help=u"Run under cProfile, dumping its stats to this file and showing the hottest functions",
+            dest="cprofile", default=None)
+    p.set_defaults(profiler=quizprofile.PhaseProfile(enabled=False))   # enabled by get_options()
+
+    # vocabulary options
+    p.add_argument("--questionMark", action="store",
+            help=u"Set the mark that starts a question (default '%s')"%_QUESTION_MARK,
+            dest="questionmark", default=_QUESTION_MARK)
+    p.add_argument("--descriptionMark", action="store",
+            help=u"Set the mark that starts a description (default '%s')"%_DESCRIPTION_MARK,
+            dest="descriptionmark", default=_DESCRIPTION_MARK)
+    p.add_argument("--answerMark", action="store",
+            help=u"Set the mark that starts an answer (default '%s')"%_ANSWER_MARK,
+            dest="answermark", default=_ANSWER_MARK)
 
     return p
 #
@@ -581,6 +1050,14 @@ def exit_if_option_errors(options):
         show_error_and_exit("Output filename must be set")
     if options.maxanswers < 2:
         show_error_and_exit("Maximum number of answers must be at least 2")
+    if options.jobs < 0:
+        show_error_and_exit("Number of jobs can't be negative")
+    if options.cachesize < 0:
+        show_error_and_exit("Cache size can't be negative")
+    if options.watchinterval <= 0:
+        show_error_and_exit("Watch interval must be positive")
+    if options.files == []:
+        show_error_and_exit("No input quiz files found")
     for fn in options.files:
         if not fn.endswith(".quiz"):
             show_error_and_exit("Input files must have .quiz extension")
@@ -588,44 +1065,126 @@ def exit_if_option_errors(options):
 def expand_options(options):
     """ some options implie others (not in this version) This function just cascades
     them """
-    pass
+    if options.jobs == 0:
+        options.jobs = multiprocessing.cpu_count()
 #
 def compose_output_filenames_and_exit_if_no_overwrite(options):
     """ composes output filenames and check whether they already exist
     and overwrite option hasn't been set.
     If everything is ok, it adds outputfilenames to options """
     filenames = compose_output_filenames(options.outputfile)
+    manifestfilename = filenames.pop("manifest")
+    compose_manifest(options, manifestfilename, filenames.values())
     if not options.overwrite:
-        exit_if_outputfiles_already_exist(filenames.values())
+        exit_if_outputfiles_already_exist([ f for f in filenames.values() if options.manifest.outdated(f) ])
     options.outputfilenames = filenames
 #
 def get_options():
     """ returns the call arguments as an argparse """
     p = compose_argparse()
     options = p.parse_args()
-    exit_if_option_errors(options)
-    exit_if_inputfiles_do_not_exist(options.files)
-    compose_output_filenames_and_exit_if_no_overwrite(options)
-    expand_options(options)
+    options.profiler = quizprofile.PhaseProfile(options.profile or options.profilejson != None)
+    with options.profiler.phase("setup") as counts:
+        options.inputs = options.files      # as given, expanded again on --watch
+        options.files = expand_input_files(options.files)
+        exit_if_option_errors(options)
+        exit_if_inputfiles_do_not_exist(options.files)
+        compose_output_filenames_and_exit_if_no_overwrite(options)
+        expand_options(options)
+        compose_cache(options)
+        counts["files"] = len(options.files)
     return options
 #
+def compose_manifest(options, filename, outputfilenames):
+    """ adds to options the build manifest of outputfilenames, already
+    checked for the ones up to date (none when rebuilding all) """
+    params = [ "quiz2moodlexml", _VERSION, _PARSER_VERSION ] + [ getattr(options, name) for name in
+            ("maxanswers", "fixavalanswernr", "questionmark", "descriptionmark", "answermark") ]
+    options.manifest = quizmanifest.BuildManifest(filename, params, options.files)
+    options.manifest.check(outputfilenames, options.rebuildall)
+#
+def compose_cache(options):
+    """ adds to options the cache of parsed quiz files, or None when
+    it must not be used """
+    if options.usecache:
+        options.cache = quizcache.QuizCache(options.cachedir, options.cachesize << 20)
+    else:
+        options.cache = None
+#
 def compose_output_filenames(filename):
     """ composes and returns the output filenames from filename.
-        It returns a dict with { "xml":"«filename».xml" }
+        It returns a dict with { "xml":"«filename».xml",
+        "manifest":"«filename».manifest.json" }
     """
     basename, ext = os.path.splitext(filename)
     filenames = { 
-            "xml": "%s.xml"%basename
+            "xml": "%s.xml"%basename,
+            "manifest": "%s.manifest.json"%basename
             }
     return filenames
 #
-def show_scan_error_and_exit(filename, line, msg):
-    """ shows an error in scanning the file, then quits """
-    show_error_and_exit("file: %s [line: %s] -> %s."%(filename, line, msg), 3)
+def expand_input_files(filenames):
+    """ returns filenames with each directory replaced by the .quiz
+    files it contains (recursively) and each glob pattern replaced by
+    the files it matches. Both expansions sorted by name """
+    expanded = []
+    for name in filenames:
+        if os.path.isdir(name):
+            found = []
+            for dirpath, dirnames, files in os.walk(name):
+                found += [ os.path.join(dirpath, f) for f in files if f.endswith(".quiz") ]
+            expanded += sorted(found)
+        elif glob.has_magic(name):
+            expanded += sorted(glob.glob(name))
+        else:
+            expanded.append(name)
+    return expanded
+#
+def iter_file_lines(f, classify):
+    """ generator of (kind, lin, nlin) of each line of file f """
+    nlin = 0
+    for lin in f:
+        nlin += 1
+        yield classify(lin), lin, nlin
+#
+def iter_mapped_lines(buf, classify):
+    """ generator of (kind, lin, nlin) of the lines of the mapped file
+        buf, as iter_file_lines(), except that consecutive text lines
+        come as a single block, sliced at once, with the number of its
+        first line.
+        Only the lines starting with ".." can be marks, so they are
+        found by searching buf for "\\n.." and just them are classified """
+    size = len(buf)
+    block_start = 0     # start of the pending block of text lines
+    nlin = 1            # number of the line at block_start
+    find = buf.find
+    try:
+        candidate = 0 if buf[:2] == ".." else find("\n..") + 1 or -1
+        while candidate >= 0:
+            end = find("\n", candidate) + 1 or size
+            lin = buf[candidate:end]
+            kind = classify(lin)
+            if kind <> _LINE_TEXT:
+                if block_start < candidate:
+                    block = buf[block_start:candidate]
+                    yield _LINE_TEXT, block, nlin
+                    nlin += block.count("\n")
+                yield kind, lin, nlin
+                nlin += 1
+                block_start = end
+            candidate = find("\n..", end - 1) + 1 or -1
+        if block_start < size:
+            yield _LINE_TEXT, buf[block_start:size], nlin
+    finally:
+        buf.close()
+#
+def show_error(msg):
+    """ shows an error missage """
+    print >> sys.stderr, "%s: error: %s"%(sys.argv[0], msg)
 #
 def show_error_and_exit(msg, exit_code=1):
     """ shows an error missage and exists with exit_code """
-    print >> sys.stderr, "%s: error: %s"%(sys.argv[0], msg)
+    show_error(msg)
     sys.exit(exit_code)
 
 def existing_files(filenames):
@@ -649,59 +1208,58 @@ def exit_if_inputfiles_do_not_exist(filenames):
     if missing <> [] :
         show_error_and_exit("Input file %s doesn't exist"%missing[0], 2);
 #
-def is_a_comment(lin):
-    """ true if lin is a comment """
-    return lin.startswith(".. #") or lin.startswith(".. /")
-
-def is_markup_mark(lin):
-    """ true if lin is the start of the markup type declaration """
-    return lin.startswith(".. %s:"%_MARKUP_MARK)
-
-def is_a_question(lin):
-    """ true if lin is the start of a question """
-    return lin.startswith(".. %s:"%_QUESTION_MARK)
-#
-def is_a_description(lin):
-    """ true if lin is the start of a question """
-    return lin.startswith(".. %s:"%_DESCRIPTION_MARK)
-#
-def is_an_answer(lin):
-    """ true if lin is the start of a answer """
-    return lin.startswith(".. %s:"%_ANSWER_MARK)
-#
 def compose_underline(text, char="-"):
     """ composes an underline for text with char """
     return char * len(text.decode("utf-8"))
 #
+def format_gift_weight(weight):
+    """ returns weight with the format expected by Moodle's Gift.
+    weight is 1/n (or -1/n) for the n answers of its class """
+    nr = int(round(1.0 / weight))
+    return _MAP_GIFT_WEIGHTS.get(nr, "%0.3f"%weight)
+#
 def compose_answer_id(nr):
     """ returns an answer id from nr """
     return chr(ord("a")+nr-1)
 #
-def process_answer_mark(lin):
-    """ it lin is an answer, it returns whether it is 
-    marked as correct and/or final. It returns None if
-    lin is not an answer or is not well formed """
+def process_answer_flags(lin):
+    """ returns whether the answer mark at lin is marked as
+    correct and/or final, or None when it is not well formed.
+    lin is expected to be already known as an answer """
     res = None
-    if is_an_answer(lin):
-        line = lin.rstrip()
-        if line.endswith('f'):
-            final = True
-            value = line[-2:-1]
-        else:
-            final = False
-            value = line[-1:]
-
-        if value in ('+', '-'):
-            correct = (value == '+')
-            res = (correct, final)
+    line = lin.rstrip()
+    if line.endswith('f'):
+        final = True
+        value = line[-2:-1]
+    else:
+        final = False
+        value = line[-1:]
+
+    if value in ('+', '-'):
+        correct = (value == '+')
+        res = (correct, final)
     return res
 #
+def build(options):
+    """ generates the xml when it is not up to date """
+    quiz_set = QuizSet(options)
+    if options.manifest.all_up_to_date():
+        quiz_set.close_build()
+    else:
+        quiz_set.run()
+        quiz_set.export()
+#
 def main():
     setLoggingConfig()
-    options = get_options()
-    quiz_set = QuizSet(options)
-    quiz_set.run()
-    quiz_set.export()
+    try:
+        options = get_options()
+        if options.watch:     # it is never profiled
+            QuizWatcher(QuizSet(options), options.watchinterval).run()
+            return
+        quizprofile.call_profiled(lambda: build(options), options.cprofile)
+        options.profiler.report("quiz2moodlexml", options.profilejson)
+    except quizerrors.QuizError as e:
+        show_error_and_exit(str(e), e.exit_code)
 #
 if __name__=="__main__":
     sys.exit(main())
@@ -0,0 +1,163 @@
+# encoding: utf-8
+#
+# File:     quizbank.py
+# Descr:    Bank of parsed questions on a SQLite file, so exams can be
+#           composed from a selection of them without scanning any
+#           quiz file
+
+# The bank keeps a row per imported quiz file (its name, the digest of
+# its contents and the parameters it was parsed with) and a row per
+# question: its source file and line, its title and description, its
+# answers and how many of them there are (also correct and final), and
+# the digest of its contents.
+#
+# Questions are kept as they were scanned (i.e. as the records of
+# Question.to_record(), not yet postprocessed) with their answers in
+# the order of the file, so they can be rebuilt with any settings.
+# Answers are pickled, one blob per question.
+#
+# Questions are selected by the name of their source file (exact, glob
+# pattern or directory), a LIKE pattern on their title and their number
+# of answers. Source files and numbers of answers are indexed.
+
+import sqlite3
+import cPickle as pickle
+import hashlib
+#
+_BANK_FORMAT = 1           # kept as the user_version of the database
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    digest TEXT NOT NULL,
+    params TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS questions (
+    id INTEGER PRIMARY KEY,
+    file INTEGER NOT NULL REFERENCES files(id),
+    line INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    descr TEXT NOT NULL,
+    answers BLOB NOT NULL,
+    nr_answers INTEGER NOT NULL,
+    nr_correct INTEGER NOT NULL,
+    nr_final INTEGER NOT NULL,
+    digest TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS questions_file ON questions(file, line);
+CREATE INDEX IF NOT EXISTS questions_nr_answers ON questions(nr_answers, file, line);
+CREATE INDEX IF NOT EXISTS questions_digest ON questions(digest);
+"""
+#
+class QuestionBankError(Exception):
+    """ the file is not a question bank (or not of this format) """
+    pass
+#
+class QuestionBank(object):
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.text_factory = str     # texts are kept as read from the files
+        self._create_schema()
+
+    def file_is_imported(self, filename, digest, params):
+        """ true when filename is already on the bank with the same
+        contents (digest) parsed with the same params """
+        row = self.connection.execute("SELECT digest, params FROM files WHERE name = ?",
+                (filename,)).fetchone()
+        return row == (digest, repr(params))
+
+    def import_file(self, filename, digest, params, records, correct_flag, final_flag):
+        """ replaces the questions of filename on the bank by the ones of
+        records (as returned by Question.to_record()), parsed with params
+        from contents of digest. Answer flags are tested with
+        correct_flag and final_flag. Returns the number of questions """
+        connection = self.connection
+        with connection:        # a transaction: on errors, the previous questions remain
+            row = connection.execute("SELECT id FROM files WHERE name = ?", (filename,)).fetchone()
+            if row == None:
+                file_id = connection.execute("INSERT INTO files (name, digest, params) VALUES (?, ?, ?)",
+                        (filename, digest, repr(params))).lastrowid
+            else:
+                file_id = row[0]
+                connection.execute("DELETE FROM questions WHERE file = ?", (file_id,))
+                connection.execute("UPDATE files SET digest = ?, params = ? WHERE id = ?",
+                        (digest, repr(params), file_id))
+            rows = (compose_question_row(file_id, record, correct_flag, final_flag) for record in records)
+            cursor = connection.executemany("INSERT INTO questions (file, line, title, descr, answers,"
+                    " nr_answers, nr_correct, nr_final, digest) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            return cursor.rowcount
+
+    def find_files(self, patterns):
+        """ returns (id, name) of the files on the bank matching
+        patterns, in order: each pattern matches the file of that name,
+        the files it matches as a glob pattern and the files below it as
+        a directory, sorted by name. Each file is returned just once """
+        found = []
+        seen = set()
+        for pattern in patterns:
+            directory = pattern.rstrip("/") + "/*"
+            rows = self.connection.execute("SELECT id, name FROM files WHERE name = ?"
+                    " OR name GLOB ? OR name GLOB ? ORDER BY name", (pattern, pattern, directory))
+            for file_id, name in rows:
+                if file_id not in seen:
+                    seen.add(file_id)
+                    found.append((file_id, name))
+        return found
+
+    def iter_records(self, file_id, title=None, nr_answers=None):
+        """ generator of the records (as returned by
+        Question.to_record()) of the questions of file_id, in the order
+        of the file, whose title is LIKE title and have nr_answers,
+        when set """
+        query = "SELECT title, descr, answers, line FROM questions WHERE file = ?"
+        params = [ file_id ]
+        if title != None:
+            query += " AND title LIKE ?"
+            params.append(title)
+        if nr_answers != None:
+            query += " AND nr_answers = ?"
+            params.append(nr_answers)
+        query += " ORDER BY line"
+        for title, descr, answers, line in self.connection.execute(query, params):
+            yield title, descr, pickle.loads(str(answers)), line
+
+    def digest(self):
+        """ returns a digest of the contents of the bank, computed from
+        the digest and parsing params of each imported file, so it is
+        cheap even on big banks """
+        digest = hashlib.sha1()
+        for row in self.connection.execute("SELECT name, digest, params FROM files ORDER BY name"):
+            digest.update(repr(row))
+        return digest.hexdigest()
+
+    def nr_questions(self):
+        """ returns the number of questions on the bank """
+        return self.connection.execute("SELECT COUNT(*) FROM questions").fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+    def _create_schema(self):
+        """ creates the tables and indexes of the bank, unless they
+        already exist. Raises QuestionBankError on files of another format """
+        try:
+            version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+            if version == 0:
+                self.connection.executescript(_SCHEMA)
+                self.connection.execute("PRAGMA user_version = %s"%_BANK_FORMAT)
+            elif version != _BANK_FORMAT:
+                raise QuestionBankError("%s is a question bank of another format"%self.path)
+        except sqlite3.DatabaseError as e:
+            raise QuestionBankError("%s is not a question bank (%s)"%(self.path, e))
+#
+def compose_question_row(file_id, record, correct_flag, final_flag):
+    """ returns the row of the question of file_id with the contents of
+    record (as returned by Question.to_record()) """
+    title, descr, answers, line = record
+    nr_correct = sum(1 for flags, text in answers if flags & correct_flag)
+    nr_final = sum(1 for flags, text in answers if flags & final_flag)
+    blob = pickle.dumps(answers, pickle.HIGHEST_PROTOCOL)
+    digest = hashlib.sha1(pickle.dumps((title, descr, answers), pickle.HIGHEST_PROTOCOL)).hexdigest()
+    return (file_id, line, title, descr, sqlite3.Binary(blob), len(answers),
+            nr_correct, nr_final, digest)
@@ -0,0 +1,949 @@
+#! /usr/bin/python
+# encoding: utf-8
+#
+# File:     quizbench.py
+# Descr:    Reproducible benchmark suite of the phases of shufflequiz.py
+#           and quiz2moodlexml.py on synthetic quiz files
+
+# Synthetic quizes
+# ----------------
+
+# The generate command writes a synthetic quiz file. Its contents only
+# depend on its parameters (and the generator seed), so the same file
+# is generated on any machine:
+#
+#   . -n questions, each with a title and a description of -d lines
+#     of pseudo random words
+#   . -a answers per question, one of them correct
+#   . a final answer (e.g. "None of the above") on a ratio of the
+#     questions (--finalRatio)
+#   . a comment line before a ratio of the lines (--commentDensity)
+#
+#   Example:
+
+#       quizbench.py generate -n 10000 -a 5 -d 8 -o bank.quiz
+
+# Running the suite
+# -----------------
+
+# The run command generates a synthetic quiz of each size of -n (with
+# the same parameters as generate), and measures each phase of both
+# tools on it:
+#
+#   . shufflequiz: scan, postprocess, shuffle (the orders of a variant),
+#     and the rendering of each output: exam (toRST), revision, eval
+#     (toEval), evallong, evalnpy and evalgift (toEvalGift)
+#   . quiz2moodlexml: scan, postprocess and xml (toXML)
+#
+# Outputs are written to the null device. Each tool runs on a new
+# process (--repeat times), so the memory of a phase does not depend
+# on the phases before. Each phase keeps its best wall and cpu seconds
+# and the highest peak and current resident size of the process once
+# it is over (see quizprofile.py).
+#
+# Results are shown as a table and, with -o, written as json, with the
+# parameters of the suite, the environment, and the number of lines,
+# size and digest of each synthetic quiz.
+#
+#   Example:
+
+#       quizbench.py run -n 1000,10000,100000 -o baseline.json
+
+# Comparing
+# ---------
+
+# The compare command compares the results of a run with a baseline (a
+# run on the same synthetic quizes) and flags the phases that got
+# slower (wall seconds) or bigger (peak memory) beyond a threshold. It
+# quits with exit code 1 when there is any regression, so it can be
+# used on scripts. Results of different synthetic quizes can't be
+# compared.
+#
+#   Example:
+
+#       quizbench.py compare baseline.json current.json
+#       quizbench.py run -o current.json --baseline baseline.json
+
+# Micro benchmarks
+# ----------------
+
+# The micro command generates a synthetic quiz of -n questions (with the
+# same parameters as generate) and reports, before/after for the paths
+# that replaced something:
+#
+#   . classify: lines/s of the is_a_* predicates and of LineClassifier
+#   . scan: lines/s of the Quiz of shufflequiz.py and quiz2moodlexml.py
+#   . jobs: seconds to run -f copies of the quiz on 1 and on all cpus
+#   . cache: seconds to run the quiz with a cold and a warm cache
+#   . build: seconds of a full build and of an up to date one
+#   . bank: seconds to import the quiz and to select 10 questions
+#   . serve: seconds of -v exams by runs and by requests to quizserve
+#   . weights: seconds of -w variants of -q questions, per answer/matrix
+#   . description: seconds to accumulate -L lines, concatenated/fragments
+#   . bank memory: peak KB of -b questions as objects/compact (child)
+#   . streaming: peak KB of the xml of the quiz and of one 4 times bigger
+#   . memory map: MB/s of scanning -g MB by lines and on its memory map
+#
+#   Example:
+
+#       quizbench.py micro -n 20000 -g 100
+
+import sys, os
+import argparse
+import itertools
+import json
+import hashlib
+import multiprocessing
+import platform
+import random
+import resource
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+import urllib2
+import shufflequiz
+import quiz2moodlexml
+import quizprofile
+import quizserve
+#
+_RESULTS_FORMAT = 1
+_WORDS = ( "quiz", "answer", "question", "value", "function", "list", "loop",
+        "string", "number", "file", "class", "method", "object", "variable",
+        "index", "return", "error", "memory", "process", "result", "the", "a",
+        "of", "in", "is", "which", "when", "with", "and", "not", "each", "every",
+        "first", "last", "correct", "wrong", "true", "false", "code", "line" )
+_FINAL_ANSWERS = ( "None of the above.", "All of the above.", "It depends." )
+_COMMENT_MARKS = ( ".. # ", ".. // " )
+_SHUFFLEQUIZ_OUTPUTS = ( ("exam", "write_exam"), ("revision", "write_revision"),
+        ("eval", "write_eval"), ("evallong", "write_eval_long"),
+        ("evalnpy", "write_eval_npy"), ("evalgift", "write_gift") )
+_PHASES = [ "shufflequiz.%s"%phase for phase in ("scan", "postprocess", "shuffle") ] + [
+        "shufflequiz.%s"%name for name, method in _SHUFFLEQUIZ_OUTPUTS ] + [
+        "quiz2moodlexml.%s"%phase for phase in ("scan", "postprocess", "xml") ]     # in the order they run
+_TIME_METRICS = ( "seconds", "cpu_seconds" )
+_MEMORY_METRICS = ( "peak_kb", "rss_kb" )
+#
+class SyntheticQuiz(object):
+    """ generator of the lines of a synthetic quiz file, that only
+    depend on its parameters """
+    def __init__(self, nr_questions, nr_answers=4, descr_lines=5,
+            comment_density=0.1, final_ratio=0.2, seed=1):
+        self.nr_questions = nr_questions
+        self.nr_answers = nr_answers
+        self.descr_lines = descr_lines
+        self.comment_density = comment_density
+        self.final_ratio = final_ratio
+        self.seed = seed
+
+    def iter_lines(self):
+        """ generator of the lines of the quiz """
+        rng = random.Random(self.seed)
+        yield ".. markup: md\n"
+        for nr in xrange(self.nr_questions):
+            lines = [ ".. pregunta:\n", "Question %s: %s\n"%(nr, compose_sentence(rng, 3, 8)),
+                    ".. enunciat:\n" ]
+            lines += [ "%s\n"%compose_sentence(rng, 6, 14) for d in xrange(self.descr_lines) ]
+            final = rng.random() < self.final_ratio
+            nr_shuffled = self.nr_answers - 1 if final else self.nr_answers
+            correct = rng.randrange(nr_shuffled) if nr_shuffled > 0 else None
+            for a in xrange(nr_shuffled):
+                lines.append(".. resposta: %s\n"%("+" if a == correct else "-"))
+                lines.append("%s\n"%compose_sentence(rng, 2, 8))
+            if final:
+                lines.append(".. resposta: -f\n")
+                lines.append("%s\n"%rng.choice(_FINAL_ANSWERS))
+            for lin in lines:
+                if rng.random() < self.comment_density:
+                    yield "%s%s\n"%(rng.choice(_COMMENT_MARKS), compose_sentence(rng, 2, 6))
+                yield lin
+
+    def write(self, filename):
+        """ writes the quiz to filename. Returns its number of lines,
+        size in bytes and sha1 digest """
+        digest = hashlib.sha1()
+        nr_lines = size = 0
+        with open(filename, "w") as f:
+            for lin in self.iter_lines():
+                f.write(lin)
+                digest.update(lin)
+                nr_lines += 1
+                size += len(lin)
+        return nr_lines, size, digest.hexdigest()
+
+    def to_dict(self):
+        """ returns the parameters of the quiz """
+        return { "questions": self.nr_questions, "answers": self.nr_answers,
+                "descr_lines": self.descr_lines, "comment_density": self.comment_density,
+                "final_ratio": self.final_ratio, "seed": self.seed }
+#
+class BenchmarkSuite(object):
+    """ runs each phase of both tools on a synthetic quiz of each size """
+    def __init__(self, options):
+        self.options = options
+
+    def run(self):
+        """ returns the results of the suite """
+        options = self.options
+        results = {
+            "format": _RESULTS_FORMAT,
+            "suite": { "sizes": options.sizes, "repeat": options.repeat },
+            "environment": { "python": platform.python_version(), "platform": platform.platform(),
+                    "cpus": multiprocessing.cpu_count() },
+            "scenarios": [],
+        }
+        for size in options.sizes:
+            quiz = compose_synthetic_quiz(options, size)
+            fd, filename = tempfile.mkstemp(suffix=".quiz")
+            os.close(fd)
+            try:
+                nr_lines, nr_bytes, digest = quiz.write(filename)
+                scenario = { "quiz": quiz.to_dict(), "lines": nr_lines, "bytes": nr_bytes,
+                        "digest": digest, "phases": {} }
+                for tool in ("shufflequiz", "quiz2moodlexml"):
+                    for name, measures in self._measure(tool, filename).items():
+                        scenario["phases"]["%s.%s"%(tool, name)] = measures
+            finally:
+                os.remove(filename)
+            results["scenarios"].append(scenario)
+            print >> sys.stderr, "measured: %s questions (%s lines)"%(size, nr_lines)
+        return results
+
+    def _measure(self, tool, filename):
+        """ returns the measures of each phase of tool on filename, the
+        best of options.repeat runs on a child process each """
+        best = {}
+        for run in range(self.options.repeat):
+            queue = multiprocessing.Queue()
+            child = multiprocessing.Process(target=_run_tool, args=(tool, filename, queue))
+            child.start()
+            phases = queue.get()
+            child.join()
+            for name, measures in phases.items():
+                best[name] = merge_measures(best.get(name), measures)
+        return best
+#
+def _run_tool(tool, filename, queue):
+    """ runs the phases of tool on filename on this (child) process and
+    puts on queue the measures of each one """
+    profile = quizprofile.PhaseProfile()
+    with open(os.devnull, "w") as devnull:
+        if tool == "shufflequiz":
+            run_shufflequiz(filename, profile, devnull)
+        else:
+            run_quiz2moodlexml(filename, profile, devnull)
+    queue.put(profile.to_dict())
+#
+def run_shufflequiz(filename, profile, f):
+    """ runs each phase of shufflequiz.py on filename, shuffling
+    questions and answers, with its outputs written to f """
+    options = shufflequiz.compose_argparse().parse_args([ "-o", "bench", "-q", "-a", "-S", "1",
+            "--noCache", filename ])
+    shufflequiz.expand_options(options)
+    shufflequiz.compose_cache(options)
+    quiz_set = shufflequiz.QuizSet(options)
+    with profile.phase("scan"):
+        for quizfile in options.files:
+            quiz_set._process(quizfile)
+    with profile.phase("postprocess"):
+        quiz_set._postprocess()
+    with profile.phase("shuffle"):
+        quiz_set.orders = quiz_set.compose_orders(options.seed)
+    for name, method in _SHUFFLEQUIZ_OUTPUTS:
+        with profile.phase(name):
+            getattr(quiz_set, method)(f)
+#
+def run_quiz2moodlexml(filename, profile, f):
+    """ runs each phase of quiz2moodlexml.py on filename, with its xml
+    written to f """
+    options = quiz2moodlexml.compose_argparse().parse_args([ "-o", "bench", "--noCache", filename ])
+    quiz2moodlexml.compose_cache(options)
+    quiz_set = quiz2moodlexml.QuizSet(options)
+    with profile.phase("scan"):
+        for quizfile in options.files:
+            quiz = quiz2moodlexml.Quiz(quizfile, options)
+            quiz.run()
+            quiz_set.quizes.append(quiz)
+    with profile.phase("postprocess"):
+        quiz_set._postprocess()
+    with profile.phase("xml"):
+        quiz_set._write_xml(f)
+#
+def compare_results(baseline, current, options):
+    """ returns the rows (scenario, phase, metric, baseline, current,
+    change, flag) of the comparison of current with baseline, where
+    flag is "REGRESSION", "improved" or "". Raises ValueError when they
+    are not comparable """
+    if baseline.get("format") != _RESULTS_FORMAT or current.get("format") != _RESULTS_FORMAT:
+        raise ValueError("unknown format of results")
+    baseline_scenarios = dict((scenario["digest"], scenario) for scenario in baseline["scenarios"])
+    rows = []
+    for scenario in current["scenarios"]:
+        previous = baseline_scenarios.get(scenario["digest"])
+        if previous == None:
+            raise ValueError("the baseline has no run on the synthetic quiz of %s questions"%scenario["quiz"]["questions"])
+        questions = scenario["quiz"]["questions"]
+        for phase in sorted(scenario["phases"], key=phase_order):
+            if phase not in previous["phases"]:
+                continue
+            for metric, threshold, minimum in (("seconds", options.threshold, options.minseconds),
+                    ("peak_kb", options.memorythreshold, options.minkb)):
+                before = previous["phases"][phase][metric]
+                after = scenario["phases"][phase][metric]
+                if before == None or after == None:
+                    continue
+                change = (after - before) / float(before) if before else 0.0
+                flag = ""
+                if abs(after - before) >= minimum:
+                    if change > threshold:
+                        flag = "REGRESSION"
+                    elif change < -threshold:
+                        flag = "improved"
+                rows.append((questions, phase, metric, before, after, change, flag))
+    return rows
+#
+def show_results(results):
+    """ shows the measures of each phase of results """
+    print("%10s  %-28s %12s %12s %12s %12s"%("questions", "phase", "seconds", "cpu seconds", "peak KB", "rss KB"))
+    for scenario in results["scenarios"]:
+        for phase in sorted(scenario["phases"], key=phase_order):
+            measures = scenario["phases"][phase]
+            print("%10s  %-28s %12.4f %12.4f %12s %12s"%(scenario["quiz"]["questions"], phase,
+                measures["seconds"], measures["cpu_seconds"], measures["peak_kb"], measures["rss_kb"]))
+#
+def show_comparison(rows):
+    """ shows the rows of a comparison. Returns the number of
+    regressions """
+    print("%10s  %-28s %-8s %12s %12s %9s"%("questions", "phase", "metric", "baseline", "current", "change"))
+    for questions, phase, metric, before, after, change, flag in rows:
+        print("%10s  %-28s %-8s %12s %12s %+8.1f%% %s"%(questions, phase, metric,
+            format_measure(before), format_measure(after), change * 100, flag))
+    regressions = sum(1 for row in rows if row[-1] == "REGRESSION")
+    print("%s regressions"%regressions)
+    return regressions
+#
+def phase_order(phase):
+    """ returns the key to sort phase in the order phases run """
+    return _PHASES.index(phase) if phase in _PHASES else len(_PHASES), phase
+#
+def format_measure(value):
+    """ returns value as shown on comparisons """
+    return "%.4f"%value if isinstance(value, float) else str(value)
+#
+def merge_measures(best, measures):
+    """ returns the best of the measures of two runs of a phase: the
+    least time and the most memory """
+    if best == None:
+        return measures
+    merged = {}
+    for metric in _TIME_METRICS:
+        merged[metric] = min(best[metric], measures[metric])
+    for metric in _MEMORY_METRICS:
+        merged[metric] = max(best[metric], measures[metric])
+    return merged
+#
+def compose_sentence(rng, min_words, max_words):
+    """ returns a sentence of pseudo random words of rng """
+    return " ".join(rng.choice(_WORDS) for i in xrange(rng.randint(min_words, max_words)))
+#
+def compose_synthetic_quiz(options, nr_questions):
+    """ returns the synthetic quiz of options with nr_questions """
+    return SyntheticQuiz(nr_questions, options.answers, options.descriptionlines,
+            options.commentdensity, options.finalratio, options.seed)
+#
+def load_results(filename):
+    """ returns the results of filename """
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except (IOError, ValueError) as e:
+        show_error_and_exit("Can't read results from %s (%s)"%(filename, e), 2)
+#
+def compare_and_exit_on_regressions(baseline_filename, current, options):
+    """ shows the comparison of the results current with the ones on
+    baseline_filename, and quits with exit code 1 on regressions """
+    try:
+        rows = compare_results(load_results(baseline_filename), current, options)
+    except ValueError as e:
+        show_error_and_exit("Results can't be compared: %s"%e, 2)
+    if show_comparison(rows) > 0:
+        sys.exit(1)
+#
+def is_a_comment(lin):
+    """ true if lin is a comment """
+    return lin.startswith(".. #") or lin.startswith(".. /")
+#
+def is_markup_mark(lin):
+    """ true if lin is the start of the markup type declaration """
+    return lin.startswith(".. %s:"%quiz2moodlexml._MARKUP_MARK)
+#
+def is_a_question(lin):
+    """ true if lin is the start of a question """
+    return lin.startswith(".. %s:"%quiz2moodlexml._QUESTION_MARK)
+#
+def is_a_description(lin):
+    """ true if lin is the start of a description """
+    return lin.startswith(".. %s:"%quiz2moodlexml._DESCRIPTION_MARK)
+#
+def is_an_answer(lin):
+    """ true if lin is the start of an answer """
+    return lin.startswith(".. %s:"%quiz2moodlexml._ANSWER_MARK)
+#
+def legacy_classify(lin):
+    """ classifies lin as the scanner did before LineClassifier, with
+    each of the predicates is_a_* applied in turn """
+    if is_a_comment(lin):
+        return "comment"
+    if is_markup_mark(lin):
+        return "markup"
+    if is_a_question(lin):
+        return "question"
+    if is_a_description(lin):
+        return "description"
+    if is_an_answer(lin):
+        return "answer"
+    return "text"
+#
+def best_time(function, repeat=3):
+    """ calls function repeat times and returns the best elapsed time
+    in seconds """
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        function()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+#
+def time_lines_per_second(function, nr_lines, repeat=3):
+    """ calls function repeat times and returns the best rate of
+    lines per second """
+    return nr_lines / max(best_time(function, repeat), 1e-9)
+#
+def bench_classification(lines):
+    """ returns the rates of legacy and single-dispatch classification """
+    classifier = quiz2moodlexml.LineClassifier()
+    def legacy():
+        for lin in lines:
+            legacy_classify(lin)
+    def single():
+        classify = classifier.classify
+        for lin in lines:
+            classify(lin)
+    return (time_lines_per_second(legacy, len(lines)),
+            time_lines_per_second(single, len(lines)))
+#
+def bench_scan(module, filename, nr_lines):
+    """ returns the rate of scanning filename with the Quiz of module """
+    options = module.compose_argparse().parse_args(["-o", "bench", "--noCache", filename])
+    module.compose_cache(options)
+    def scan():
+        quiz = module.Quiz(filename, options)
+        quiz.run()
+    return time_lines_per_second(scan, nr_lines)
+#
+def bench_mmap(options, megabytes):
+    """ returns the MB/s of streaming the questions of a synthetic quiz
+    of megabytes (with long descriptions, as generated banks) scanned
+    line by line and on its memory map, and whether both scans get the
+    same questions """
+    quiz = SyntheticQuiz(10000, options.answers, 20, options.commentdensity, options.finalratio, options.seed)
+    chunk = "".join(itertools.islice(quiz.iter_lines(), 1, None))     # but the markup
+    fd, filename = tempfile.mkstemp(suffix=".quiz")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(".. markup: md\n")
+            for i in range(max(1, (megabytes << 20) // len(chunk))):
+                f.write(chunk)
+        size = os.path.getsize(filename) / float(1 << 20)
+        def questions(usemmap):
+            arguments = [ "-o", "bench", "--noCache", filename ] + ([] if usemmap else [ "--noMmap" ])
+            options = quiz2moodlexml.compose_argparse().parse_args(arguments)
+            quiz2moodlexml.compose_cache(options)
+            return quiz2moodlexml.Quiz(filename, options)._questions_from_file()
+        rates = [ size / best_time(lambda: [ None for q in questions(usemmap) ], repeat=1)
+                for usemmap in (False, True) ]
+        identical = all(a.to_record() == b.to_record()
+                for a, b in itertools.izip_longest(questions(False), questions(True), fillvalue=quiz2moodlexml.Question()))
+    finally:
+        os.remove(filename)
+    return rates, identical
+#
+class LegacyDescription:
+    """ accumulates a description by concatenation, as Question did
+    before collecting fragments """
+    def __init__(self):
+        self.descr = ""
+
+    def add_description(self, descr):
+        self.descr += descr
+        return self
+#
+def bench_long_description(descr_lines):
+    """ returns the seconds to accumulate a description of descr_lines
+    by concatenation and by Question fragments """
+    lines = [ "    listing line %s of an embedded code example\n"%nr for nr in range(descr_lines) ]
+    def legacy():
+        descr = LegacyDescription()
+        for lin in lines:
+            descr.add_description(lin)
+        descr.descr.strip()
+    def fragments():
+        question = shufflequiz.Question(shufflequiz.QuestionSettings())
+        for lin in lines:
+            question.add_description(lin)
+        question.postprocess()
+    return best_time(legacy), best_time(fragments)
+#
+_BANK_ANSWERS = ( "None of the above", "All the above", "It depends",
+        "It was me!" )
+#
+class LegacyAnswer:
+    """ an answer kept as a plain object, as Answer was before """
+    def __init__(self, is_correct, is_final):
+        self.is_correct = is_correct
+        self.is_final = is_final
+        self.text = ""
+
+    def add_description(self, text):
+        self.text += text
+        return self
+
+    def postprocess(self):
+        self.text = self.text.strip()
+        return self
+#
+class LegacyQuestion:
+    """ a question kept as a plain object, as Question was before """
+    def __init__(self, options):
+        self.options = options
+        self.title = ""
+        self.descr = ""
+        self.answers = []
+        self.final_answers = []
+
+    def add_answer(self, answer):
+        self.answers.append(answer)
+        return self
+
+    def postprocess(self):
+        for answer in self.answers:
+            answer.postprocess()
+        return self
+#
+def build_bank(nr_questions, legacy):
+    """ builds and returns a bank of nr_questions questions with
+    repeated answer texts """
+    if legacy:
+        settings = argparse.Namespace(placefinals=True)
+        new_question = lambda: LegacyQuestion(settings)
+        new_answer = LegacyAnswer
+    else:
+        settings = shufflequiz.QuestionSettings()
+        new_question = lambda: shufflequiz.Question(settings)
+        new_answer = shufflequiz.Answer
+    bank = []
+    for nr in range(nr_questions):
+        question = new_question()
+        question.title = "Question %s"%nr
+        question.descr = "Description of question %s"%nr
+        for a, text in enumerate(_BANK_ANSWERS):
+            answer = new_answer(a == 0, a == 1)
+            answer.add_description("%s\n"%text)
+            question.add_answer(answer)
+        bank.append(question.postprocess())
+    return bank
+#
+def _report_bank_peak(nr_questions, legacy, queue):
+    """ builds a bank on this (child) process and puts on queue the
+    increase of its peak resident size in KB """
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    build_bank(nr_questions, legacy)     # its peak remains
+    queue.put(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before)
+#
+def bench_bank_memory(nr_questions):
+    """ returns the peak memory in KB of a legacy and a compact bank of
+    nr_questions """
+    peaks = []
+    for legacy in (True, False):
+        queue = multiprocessing.Queue()
+        child = multiprocessing.Process(target=_report_bank_peak,
+                args=(nr_questions, legacy, queue))
+        child.start()
+        peaks.append(queue.get())
+        child.join()
+    return peaks
+#
+def _report_stream_peak(filename, queue):
+    """ converts filename to Moodle XML on this (child) process and
+    puts on queue the increase of its peak resident size in KB """
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    options = quiz2moodlexml.compose_argparse().parse_args(["-o", filename, "--noCache", filename])
+    quiz2moodlexml.compose_cache(options)
+    options.outputfilenames = quiz2moodlexml.compose_output_filenames(filename)
+    options.manifest = None
+    quiz_set = quiz2moodlexml.QuizSet(options)
+    quiz_set.run()
+    quiz_set.export()
+    os.remove(options.outputfilenames["xml"])
+    queue.put(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before)
+#
+def bench_stream_memory(options, nr_questions):
+    """ returns the peak memory in KB of streaming quizzes of
+    nr_questions and 4 * nr_questions """
+    peaks = []
+    for factor in (1, 4):
+        fd, filename = tempfile.mkstemp(suffix=".quiz")
+        os.close(fd)
+        try:
+            compose_synthetic_quiz(options, nr_questions * factor).write(filename)
+            queue = multiprocessing.Queue()
+            child = multiprocessing.Process(target=_report_stream_peak,
+                    args=(filename, queue))
+            child.start()
+            peaks.append(queue.get())
+            child.join()
+        finally:
+            os.remove(filename)
+    return peaks
+#
+def bench_parallel(filename, nr_files):
+    """ returns the number of cpus and the seconds to run a QuizSet of
+    nr_files copies of filename with 1 job and with a job per cpu """
+    nr_cpus = multiprocessing.cpu_count()
+    options = shufflequiz.compose_argparse().parse_args(["-o", "bench", "--noCache"] + [filename] * nr_files)
+    shufflequiz.expand_options(options)
+    shufflequiz.compose_cache(options)
+    times = []
+    for jobs in (1, nr_cpus):
+        options.jobs = jobs
+        times.append(best_time(lambda: shufflequiz.QuizSet(options).run(), repeat=1))
+    return nr_cpus, times
+#
+def bench_cache(filename):
+    """ returns the seconds to run a QuizSet of filename with a cold
+    and with a warm cache """
+    cachedir = tempfile.mkdtemp()
+    try:
+        options = shufflequiz.compose_argparse().parse_args(["-o", "bench",
+            "--cacheDir", cachedir, filename])
+        shufflequiz.expand_options(options)
+        shufflequiz.compose_cache(options)
+        times = []
+        for run in ("cold", "warm"):
+            times.append(best_time(lambda: shufflequiz.QuizSet(options).run(), repeat=1))
+    finally:
+        shutil.rmtree(cachedir)
+    return times
+#
+def bench_incremental(filename):
+    """ returns the seconds of a run of shufflequiz.py on filename that
+    builds every output, and of a run that finds them up to date """
+    outputdir = tempfile.mkdtemp()
+    try:
+        command = [ sys.executable, shufflequiz.__file__.replace(".pyc", ".py"), "-S", "1", "-e",
+                "-o", os.path.join(outputdir, "bench.rst"), "--noCache", filename ]
+        times = []
+        with open(os.devnull, "w") as devnull:
+            for run in ("cold", "warm"):
+                times.append(best_time(lambda: subprocess.check_call(command, stderr=devnull), repeat=1))
+    finally:
+        shutil.rmtree(outputdir)
+    return times
+#
+def bench_bank(filename):
+    """ returns the seconds to import filename into a question bank
+    and to select 10 of its questions by title from the bank """
+    bankdir = tempfile.mkdtemp()
+    try:
+        bank = os.path.join(bankdir, "bench.db")
+        options = shufflequiz.compose_argparse().parse_args(["--importBank", bank, "--noCache", filename])
+        shufflequiz.expand_options(options)
+        shufflequiz.compose_cache(options)
+        with open(os.devnull, "w") as devnull:
+            stderr, sys.stderr = sys.stderr, devnull
+            try:
+                importing = best_time(lambda: shufflequiz.QuizSet(options).import_bank(), repeat=1)
+            finally:
+                sys.stderr = stderr
+        options = shufflequiz.compose_argparse().parse_args(["-o", "bench", "--bank", bank,
+            "--titlePattern", "Question 1_:%", "--noCache", "*"])
+        shufflequiz.expand_options(options)
+        selecting = best_time(lambda: shufflequiz.QuizSet(options).run())
+    finally:
+        shutil.rmtree(bankdir)
+    return importing, selecting
+#
+def bench_serve(filename, nr_variants):
+    """ returns the seconds to render the exams of nr_variants of
+    filename with a run of shufflequiz.py each and with a request each
+    to a warm quizserve.py, and the p50 and p99 latencies (ms) of the
+    server """
+    outputdir = tempfile.mkdtemp()
+    probe = socket.socket()
+    probe.bind(("127.0.0.1", 0))
+    port = probe.getsockname()[1]
+    probe.close()
+    url = "http://127.0.0.1:%s"%port
+    devnull = open(os.devnull, "w")
+    server = subprocess.Popen([ sys.executable, quizserve.__file__.replace(".pyc", ".py"), "-e",
+            "-S", "1", "-p", str(port), "bench=%s"%filename ], stderr=devnull)
+    try:
+        while True:     # until the bank is parsed
+            try:
+                urllib2.urlopen(url + "/banks").read()
+                break
+            except urllib2.URLError:
+                time.sleep(0.1)
+        def runs():
+            for nr in range(1, nr_variants + 1):    # variant nr is shuffled with seed 1 + nr
+                subprocess.check_call([ sys.executable, shufflequiz.__file__.replace(".pyc", ".py"),
+                    "-e", "-S", str(1 + nr), "-o", os.path.join(outputdir, "bench.rst"), "-r", "-B",
+                    "--noCache", filename ], stderr=devnull)
+        def requests():
+            for nr in range(1, nr_variants + 1):
+                urllib2.urlopen("%s/banks/bench/variants/%s/exam"%(url, nr)).read()
+        times = best_time(runs, repeat=1), best_time(requests, repeat=1)
+        stats = json.load(urllib2.urlopen(url + "/stats"))
+    finally:
+        server.terminate()
+        server.wait()
+        devnull.close()
+        shutil.rmtree(outputdir)
+    return times, stats["p50_ms"], stats["p99_ms"]
+#
+def bench_weights(options, nr_questions, nr_variants):
+    """ returns the seconds to compute the weights of nr_variants of a
+    quiz of nr_questions per answer and from the weight matrix """
+    fd, filename = tempfile.mkstemp(suffix=".quiz")
+    os.close(fd)
+    try:
+        compose_synthetic_quiz(options, nr_questions).write(filename)
+        options = shufflequiz.compose_argparse().parse_args(["-o", "bench", "-e", "--noCache", filename])
+        shufflequiz.expand_options(options)
+        shufflequiz.compose_cache(options)
+        quiz_set = shufflequiz.QuizSet(options)
+        quiz_set.run()
+    finally:
+        os.remove(filename)
+    variants = [ quiz_set.compose_orders(seed) for seed in range(nr_variants) ]
+    def per_answer():
+        for orders in variants:
+            for quiz, order in zip(quiz_set.quizes, orders):
+                for question, answer_order, weights in quiz.iter_in_order(order):
+                    [ question._compute_answer_weight_fulldecimal(answer.is_correct)
+                        for answer in question.answers_in_order(answer_order) ]
+    def matrix():
+        for orders in variants:
+            for quiz, order in zip(quiz_set.quizes, orders):
+                for question, answer_order, weights in quiz.iter_in_order(order):
+                    question.weights_in_order(answer_order, weights)
+    return best_time(per_answer, repeat=1), best_time(matrix, repeat=1)
+#
+def run_micro_benchmarks(options):
+    """ runs and shows each micro benchmark on synthetic quizes of
+    options """
+
+    quiz = compose_synthetic_quiz(options, options.questions)
+    lines = list(quiz.iter_lines())
+    fd, filename = tempfile.mkstemp(suffix=".quiz")
+    os.close(fd)
+    try:
+        quiz.write(filename)
+        legacy, single = bench_classification(lines)
+        print("lines: %s"%len(lines))
+        print("classify (before):     %12.0f lines/s"%legacy)
+        print("classify (after):      %12.0f lines/s"%single)
+        print("scan shufflequiz:      %12.0f lines/s"%bench_scan(shufflequiz, filename, len(lines)))
+        print("scan quiz2moodlexml:   %12.0f lines/s"%bench_scan(quiz2moodlexml, filename, len(lines)))
+        nr_cpus, (sequential, parallel) = bench_parallel(filename, options.nrfiles)
+        print("run of %s files:"%options.nrfiles)
+        print("1 job:                 %12.3f s"%sequential)
+        print("%2s jobs:               %12.3f s"%(nr_cpus, parallel))
+        cold, warm = bench_cache(filename)
+        print("cold cache:            %12.3f s"%cold)
+        print("warm cache:            %12.3f s"%warm)
+        cold, warm = bench_incremental(filename)
+        print("build (all outdated):  %12.3f s"%cold)
+        print("build (up to date):    %12.3f s"%warm)
+        importing, selecting = bench_bank(filename)
+        print("import into bank:      %12.3f s"%importing)
+        print("select from bank:      %12.3f s"%selecting)
+        (runs, requests), p50, p99 = bench_serve(filename, options.servevariants)
+        print("exams of %s variants:"%options.servevariants)
+        print("a run each:            %12.3f s"%runs)
+        print("a request each:        %12.3f s"%requests)
+        print("server latency p50:    %12.3f ms"%p50)
+        print("server latency p99:    %12.3f ms"%p99)
+    finally:
+        os.remove(filename)
+    per_answer, matrix = bench_weights(options, options.weightquestions, options.weightvariants)
+    print("weights of %s questions x %s variants:"%(options.weightquestions, options.weightvariants))
+    print("per answer (before):   %12.3f s"%per_answer)
+    print("weight matrix (after): %12.3f s"%matrix)
+    legacy, fragments = bench_long_description(options.longdescriptionlines)
+    print("description of %s lines:"%options.longdescriptionlines)
+    print("accumulate (before):   %12.6f s"%legacy)
+    print("accumulate (after):    %12.6f s"%fragments)
+    legacy, compact = bench_bank_memory(options.bankquestions)
+    print("bank of %s questions:"%options.bankquestions)
+    print("peak memory (before):  %12s KB"%legacy)
+    print("peak memory (after):   %12s KB"%compact)
+    single, quadruple = bench_stream_memory(options, options.questions)
+    print("streaming conversion to xml:")
+    print("peak memory (x1):      %12s KB"%single)
+    print("peak memory (x4):      %12s KB"%quadruple)
+    (lines, mapped), identical = bench_mmap(options, options.mmapmegabytes)
+    print("scan of %s MB:"%options.mmapmegabytes)
+    print("line by line:          %12.1f MB/s"%lines)
+    print("memory map:            %12.1f MB/s"%mapped)
+    print("same questions:        %12s"%identical)
+#
+def compose_argparse():
+    """ composes and returns an ArgumentParser """
+    p = argparse.ArgumentParser(description = "Benchmark suite of the quiz tools")
+    subparsers = p.add_subparsers(dest="command")
+
+    g = subparsers.add_parser("generate", help=u"Write a synthetic quiz file")
+    add_quiz_arguments(g)
+    g.add_argument("-n", "--questions", action="store", type=int,
+            help=u"Set the number of questions (default 1000)",
+            dest="questions", default=1000)
+    g.add_argument("-o", "--outputFilename", action="store", required=True,
+            help=u"Set the quiz file to write", dest="outputfile")
+
+    r = subparsers.add_parser("run", help=u"Measure each phase of the tools on synthetic quizes")
+    add_quiz_arguments(r)
+    r.add_argument("-n", "--questions", action="store",
+            help=u"Set the comma separated sizes (in questions) of the synthetic quizes (default 1000,10000,50000)",
+            dest="questions", default="1000,10000,50000")
+    r.add_argument("-R", "--repeat", action="store", type=int,
+            help=u"Set the number of runs of each tool on each quiz (default 3)",
+            dest="repeat", default=3)
+    r.add_argument("-o", "--outputFilename", action="store",
+            help=u"Write the results as json to this file", dest="outputfile")
+    r.add_argument("--baseline", action="store",
+            help=u"Compare the results with the ones of this file", dest="baseline")
+    add_comparison_arguments(r)
+
+    c = subparsers.add_parser("compare", help=u"Flag the regressions of some results against a baseline")
+    c.add_argument("baseline", help="json results of the baseline")
+    c.add_argument("current", help="json results to compare with the baseline")
+    add_comparison_arguments(c)
+
+    m = subparsers.add_parser("micro", help=u"Measure specific paths, most of them against what they replaced")
+    add_quiz_arguments(m)
+    m.add_argument("-n", "--questions", action="store", type=int,
+            help=u"Set the number of questions of the synthetic quiz (default 20000)",
+            dest="questions", default=20000)
+    m.add_argument("-L", "--longDescriptionLines", action="store", type=int,
+            help=u"Set the number of lines of the long description (default 10000)",
+            dest="longdescriptionlines", default=10000)
+    m.add_argument("-b", "--bankQuestions", action="store", type=int,
+            help=u"Set the number of questions of the memory report bank (default 200000)",
+            dest="bankquestions", default=200000)
+    m.add_argument("-f", "--nrFiles", action="store", type=int,
+            help=u"Set the number of quiz files of the parallel run (default 16)",
+            dest="nrfiles", default=16)
+    m.add_argument("-q", "--weightQuestions", action="store", type=int,
+            help=u"Set the number of questions of the weights benchmark (default 10000)",
+            dest="weightquestions", default=10000)
+    m.add_argument("-w", "--weightVariants", action="store", type=int,
+            help=u"Set the number of variants of the weights benchmark (default 100)",
+            dest="weightvariants", default=100)
+    m.add_argument("-g", "--mmapMegabytes", action="store", type=int,
+            help=u"Set the size in MB of the quiz of the memory map benchmark (default 500)",
+            dest="mmapmegabytes", default=500)
+    m.add_argument("-v", "--serveVariants", action="store", type=int,
+            help=u"Set the number of variants of the server benchmark (default 10)",
+            dest="servevariants", default=10)
+
+    return p
+#
+def add_quiz_arguments(p):
+    """ adds the arguments of the synthetic quizes to p """
+    p.add_argument("-a", "--answers", action="store", type=int,
+            help=u"Set the number of answers per question, final one included (default 4)",
+            dest="answers", default=4)
+    p.add_argument("-d", "--descriptionLines", action="store", type=int,
+            help=u"Set the number of lines of each description (default 5)",
+            dest="descriptionlines", default=5)
+    p.add_argument("--commentDensity", action="store", type=float,
+            help=u"Set the ratio of lines preceded by a comment (default 0.1)",
+            dest="commentdensity", default=0.1)
+    p.add_argument("--finalRatio", action="store", type=float,
+            help=u"Set the ratio of questions with a final answer (default 0.2)",
+            dest="finalratio", default=0.2)
+    p.add_argument("--seed", action="store", type=int,
+            help=u"Set the seed of the generator (default 1)",
+            dest="seed", default=1)
+#
+def add_comparison_arguments(p):
+    """ adds the arguments of the comparisons to p """
+    p.add_argument("-t", "--threshold", action="store", type=float,
+            help=u"Set the relative increase of seconds flagged as a regression (default 0.1)",
+            dest="threshold", default=0.1)
+    p.add_argument("--memoryThreshold", action="store", type=float,
+            help=u"Set the relative increase of peak memory flagged as a regression (default 0.1)",
+            dest="memorythreshold", default=0.1)
+    p.add_argument("--minSeconds", action="store", type=float,
+            help=u"Ignore changes of less seconds than this (default 0.02)",
+            dest="minseconds", default=0.02)
+    p.add_argument("--minKB", action="store", type=int,
+            help=u"Ignore changes of less peak memory (KB) than this (default 1024)",
+            dest="minkb", default=1024)
+#
+def exit_if_option_errors(options):
+    """ filters option errors and exits if there are any """
+    if options.command in ("generate", "run", "micro"):
+        if not 2 <= options.answers <= 10:
+            show_error_and_exit("Number of answers must be from 2 to 10")
+        if options.descriptionlines < 1:
+            show_error_and_exit("Description must have at least a line")
+        if not 0 <= options.commentdensity < 1 or not 0 <= options.finalratio <= 1:
+            show_error_and_exit("Ratios must be from 0 to 1")
+    if options.command == "run":
+        if options.repeat < 1:
+            show_error_and_exit("Number of runs must be at least 1")
+        if any(size < 1 for size in options.sizes):
+            show_error_and_exit("Sizes must be at least 1 question")
+#
+def get_options():
+    """ returns the call arguments as an argparse """
+    p = compose_argparse()
+    options = p.parse_args()
+    if options.command == "run":
+        try:
+            options.sizes = [ int(size) for size in options.questions.split(",") ]
+        except ValueError:
+            show_error_and_exit("Badformed sizes %s (expected comma separated numbers)"%options.questions)
+    exit_if_option_errors(options)
+    return options
+#
+def show_error_and_exit(msg, exit_code=1):
+    """ shows an error missage and exists with exit_code """
+    print >> sys.stderr, "%s: error: %s"%(sys.argv[0], msg)
+    sys.exit(exit_code)
+#
+def main():
+    options = get_options()
+    if options.command == "generate":
+        nr_lines, nr_bytes, digest = compose_synthetic_quiz(options, options.questions).write(options.outputfile)
+        print >> sys.stderr, "generated %s: %s questions, %s lines, %s bytes"%(
+                options.outputfile, options.questions, nr_lines, nr_bytes)
+    elif options.command == "run":
+        results = BenchmarkSuite(options).run()
+        show_results(results)
+        if options.outputfile:
+            with open(options.outputfile, "w") as f:
+                json.dump(results, f, indent=1, sort_keys=True)
+        if options.baseline:
+            compare_and_exit_on_regressions(options.baseline, results, options)
+    elif options.command == "compare":
+        compare_and_exit_on_regressions(options.baseline, load_results(options.current), options)
+    elif options.command == "micro":
+        run_micro_benchmarks(options)
+#
+if __name__=="__main__":
+    sys.exit(main())
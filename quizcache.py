@@ -0,0 +1,206 @@
+# encoding: utf-8
+#
+# File:     quizcache.py
+# Descr:    On disk cache of parsed quiz files shared by shufflequiz.py
+#           and quiz2moodlexml.py
+
+# Each entry keeps the records of the questions of a quiz file as they
+# were scanned. Entries are keyed by the contents of the file and by
+# whatever the tool considers that affects its parsing (e.g. its
+# parser version and vocabulary), so a changed file or parser simply
+# misses.
+#
+# Records are plain python values (tuples, strings, ints) pickled one
+# after the other, so they can be read and written one question at a
+# time, without holding the whole quiz in memory.
+#
+# Each entry ends with a footer with the number of records and the
+# crc32 of their pickles. An entry is only loaded when its footer is
+# there and matches (it is checked before any record is used), so a
+# truncated or damaged entry (e.g. of a crash while writing it) is a
+# miss: it is removed and the quiz file scanned again.
+#
+# The size of the cache is bounded: evict() removes the least recently
+# used entries until the cache fits.
+
+import os
+import threading
+import struct
+import zlib
+import cPickle as pickle
+import hashlib
+#
+_ENTRY_EXTENSION = ".entry"
+_TMP_EXTENSION = ".tmp"
+_HASH_BLOCK_SIZE = 1 << 20
+_DEFAULT_MAX_SIZE = 256 * (1 << 20)
+_FOOTER = struct.Struct("<8sQI")    # magic, number of records, crc32 of their pickles
+_FOOTER_MAGIC = "QZENTRY1"
+_CRC_MASK = 0xffffffff
+#
+class QuizCache(object):
+    def __init__(self, directory=None, max_size=_DEFAULT_MAX_SIZE):
+        self.directory = default_cache_directory() if directory == None else directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def compose_key(self, filename, *params):
+        """ returns the key of the entry of filename when parsed with
+        params """
+        key = hashlib.sha1(repr(params))
+        key.update(hash_file_contents(filename))
+        return key.hexdigest()
+
+    def load(self, key):
+        """ returns an iterator on the records of the entry of key, or
+        None when there is no such entry or it is not complete (then it
+        is removed). It counts the hit or miss """
+        path = self._entry_path(key)
+        try:
+            f = open(path, "rb")
+        except IOError:
+            self.misses += 1
+            return None
+        nr_records = check_entry(f)
+        if nr_records == None:
+            f.close()
+            remove_if_exists(path)
+            self.misses += 1
+            return None
+        self.hits += 1
+        os.utime(path, None)    # it is now the most recently used
+        return self._read_records(f, nr_records)
+
+    def writer(self, key):
+        """ returns a writer for the entry of key """
+        return QuizCacheWriter(self._entry_path(key))
+
+    def count(self, hit):
+        """ counts a hit or a miss done by another process """
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def evict(self):
+        """ removes the least recently used entries until the cache
+        fits its max size """
+        entries = []
+        total_size = 0
+        for name in os.listdir(self.directory) if os.path.isdir(self.directory) else []:
+            if name.endswith(_ENTRY_EXTENSION):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+                total_size += stat.st_size
+        entries.sort()
+        for mtime, size, name in entries:
+            if total_size <= self.max_size:
+                break
+            remove_if_exists(os.path.join(self.directory, name))
+            total_size -= size
+
+    def stats(self):
+        """ returns a description of the hits and misses """
+        return "cache: %s hits, %s misses"%(self.hits, self.misses)
+
+    def _entry_path(self, key):
+        """ returns the path of the entry of key """
+        return os.path.join(self.directory, key + _ENTRY_EXTENSION)
+
+    def _read_records(self, f, nr_records):
+        """ generator of the nr_records records of f, an entry already
+        checked by check_entry() """
+        with f:
+            unpickler = pickle.Unpickler(f)
+            for i in xrange(nr_records):
+                yield unpickler.load()
+#
+class QuizCacheWriter(object):
+    """ writes the records of an entry on a temporary file, that becomes
+    the entry only when committed. The temporary file is named after the
+    process and thread, so writers of the same entry on several threads
+    (e.g. of quizlib.py) never share it """
+    def __init__(self, path):
+        self.path = path
+        self.tmppath = "%s.%s.%s%s"%(path, os.getpid(), threading.current_thread().ident, _TMP_EXTENSION)
+        self.f = None
+        self.nr_records = 0
+        self.crc = 0
+
+    def write(self, record):
+        if self.f == None:
+            directory = os.path.dirname(self.path)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            self.f = open(self.tmppath, "wb")
+        data = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)   # records are independent
+        self.f.write(data)
+        self.crc = zlib.crc32(data, self.crc)
+        self.nr_records += 1
+        return self
+
+    def commit(self):
+        """ makes the written records the entry, once they are on disk
+        with their footer """
+        if self.f != None:
+            self.f.write(_FOOTER.pack(_FOOTER_MAGIC, self.nr_records, self.crc & _CRC_MASK))
+            self.f.flush()
+            os.fsync(self.f.fileno())
+            self.f.close()
+            self.f = None
+            os.rename(self.tmppath, self.path)
+
+    def abort(self):
+        """ discards the written records, if not already committed """
+        if self.f != None:
+            self.f.close()
+            self.f = None
+            remove_if_exists(self.tmppath)
+#
+def check_entry(f):
+    """ returns the number of records of the entry of file f, when its
+    footer is there and matches its records, or None otherwise. f is
+    left at its start """
+    f.seek(0, os.SEEK_END)
+    size = f.tell() - _FOOTER.size
+    if size < 0:
+        return None
+    f.seek(size)
+    magic, nr_records, crc = _FOOTER.unpack(f.read(_FOOTER.size))
+    if magic != _FOOTER_MAGIC:
+        return None
+    f.seek(0)
+    digest = 0
+    while size > 0:
+        block = f.read(min(size, _HASH_BLOCK_SIZE))
+        if not block:
+            return None
+        digest = zlib.crc32(block, digest)
+        size -= len(block)
+    if digest & _CRC_MASK != crc:
+        return None
+    f.seek(0)
+    return nr_records
+#
+def default_cache_directory():
+    """ returns the default directory of the cache """
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "shufflequiz")
+#
+def hash_file_contents(filename):
+    """ returns the sha1 digest of the contents of filename """
+    digest = hashlib.sha1()
+    with open(filename, "rb") as f:
+        block = f.read(_HASH_BLOCK_SIZE)
+        while block:
+            digest.update(block)
+            block = f.read(_HASH_BLOCK_SIZE)
+    return digest.digest()
+#
+def remove_if_exists(path):
+    """ removes path, if it still exists """
+    try:
+        os.remove(path)
+    except OSError:
+        pass
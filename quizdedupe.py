@@ -0,0 +1,176 @@
+# encoding: utf-8
+#
+# File:     quizdedupe.py
+# Descr:    Detection of exact and near duplicate questions amongst the
+#           questions of one or more quiz files
+
+# Questions are compared by their normalized contents: title,
+# description and the set of their answers (i.e. regardless of the
+# order of the answers), lowercased and split into words.
+#
+# Exact duplicates have the same normalized contents.
+#
+# Near duplicates are found with MinHash and LSH: each question is
+# fingerprinted by a signature of _SIGNATURE_SIZE minimum hashes of its
+# shingles (sequences of _SHINGLE_WORDS words of the title and
+# description, and of each answer), with one permutation hashing (the
+# hash of each shingle sets the minimum of just one bin, so every
+# shingle is hashed once). The fraction of equal minimums estimates the
+# similarity (Jaccard) of two questions.
+#
+# Signatures are split into _BANDS bands. Questions with the same band
+# are candidates and, when similar enough, they join the same cluster.
+# Each band is hashed on its own, one band after the other, and each
+# question is only compared with the first question of each of its
+# buckets, so finding the clusters takes O(questions * bands) time.
+# Signatures are kept on a compact array.
+
+import re
+import zlib
+import hashlib
+from array import array
+#
+_SHINGLE_WORDS = 3
+_SIGNATURE_SIZE = 64        # bins, set by the highest _BIN_BITS bits of a hash
+_BIN_BITS = 6
+_BANDS = 16                 # of _SIGNATURE_SIZE / _BANDS minimums each
+_HASH_MASK = 0xffffffff
+_VALUE_MASK = _HASH_MASK >> _BIN_BITS
+_EMPTY_BIN = _HASH_MASK     # greater than any minimum of a bin
+_DEFAULT_THRESHOLD = 0.7
+_DENSIFICATION_ORDER = range(_SIGNATURE_SIZE - 1, -1, -1) * 2    # backwards, twice around
+#
+_WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+#
+class DuplicateFinder(object):
+    """ fingerprints questions as they are added, and finds the clusters
+    of the exact and near duplicate ones. Questions are referred by the
+    order they were added """
+    def __init__(self, threshold=_DEFAULT_THRESHOLD):
+        self.threshold = threshold
+        self.filenames = []                 # source files, in order
+        self._file_indexes = {}             # filename -> index on filenames
+        self.files = array("I")             # index on filenames of each question
+        self.lines = array("I")             # line of each question on its file
+        self.signatures = array("I")        # _SIGNATURE_SIZE minimums per question
+        self.exact = array("I")             # first question with the same contents of each question
+        self._digests = {}                  # digest of the contents -> first question
+
+    def add(self, filename, line, title, descr, answers):
+        """ fingerprints the question at line of filename with title,
+        descr and answers (their texts). Returns its index """
+        index = len(self.lines)
+        if filename not in self._file_indexes:
+            self._file_indexes[filename] = len(self.filenames)
+            self.filenames.append(filename)
+        self.files.append(self._file_indexes[filename])
+        self.lines.append(line)
+        statement = normalize_words(title) + normalize_words(descr)
+        answer_words = sorted(normalize_words(answer) for answer in answers)
+        digest = hashlib.sha1(repr((statement, answer_words))).digest()
+        self.exact.append(self._digests.setdefault(digest, index))
+        shingles = compose_shingles(statement)
+        for words in answer_words:
+            shingles += compose_shingles(words)
+        self.signatures.extend(compose_signature(shingles))
+        return index
+
+    def nr_questions(self):
+        """ returns the number of questions added """
+        return len(self.lines)
+
+    def position(self, index):
+        """ returns (filename, line) of question index """
+        return self.filenames[self.files[index]], self.lines[index]
+
+    def is_exact_duplicate(self, index, other):
+        """ true when questions index and other have the same contents """
+        return self.exact[index] == self.exact[other]
+
+    def similarity(self, index, other):
+        """ returns the estimated similarity of questions index and other,
+        from 0 (nothing in common) to 1 """
+        if self.is_exact_duplicate(index, other):
+            return 1.0
+        signatures = self.signatures
+        a = index * _SIGNATURE_SIZE
+        b = other * _SIGNATURE_SIZE
+        equal = sum(1 for i in xrange(_SIGNATURE_SIZE) if signatures[a + i] == signatures[b + i])
+        return float(equal) / _SIGNATURE_SIZE
+
+    def clusters(self):
+        """ returns the clusters of duplicate questions: a list of lists
+        of indexes, in the order they were added, each cluster starting
+        by its first question """
+        nr_questions = self.nr_questions()
+        parents = array("I", xrange(nr_questions))
+        def find(index):
+            while parents[index] != index:
+                parents[index] = parents[parents[index]]
+                index = parents[index]
+            return index
+        def join(index, other):
+            index, other = find(index), find(other)
+            if index != other:
+                parents[max(index, other)] = min(index, other)
+        for index in xrange(nr_questions):
+            if self.exact[index] != index:
+                join(index, self.exact[index])
+        rows = _SIGNATURE_SIZE // _BANDS
+        signatures = self.signatures
+        threshold = self.threshold
+        for band in xrange(_BANDS):
+            buckets = {}
+            start = band * rows
+            for index in xrange(nr_questions):
+                if self.exact[index] != index:
+                    continue    # already joined to its exact duplicate
+                offset = index * _SIGNATURE_SIZE + start
+                first = buckets.setdefault(hash(tuple(signatures[offset:offset + rows])), index)
+                if first != index and find(first) != find(index) and self.similarity(first, index) >= threshold:
+                    join(first, index)
+        members = {}
+        for index in xrange(nr_questions):
+            root = find(index)
+            if root != index:
+                members.setdefault(root, [ root ]).append(index)
+        return [ members[key] for key in sorted(members) ]
+#
+def normalize_words(text):
+    """ returns the words of text, lowercased, as a tuple """
+    return tuple(_WORD_PATTERN.findall(text.decode("utf-8", "replace").lower()))
+#
+def compose_shingles(words):
+    """ returns the hashes of the shingles of words: each sequence of
+    _SHINGLE_WORDS words, or all of them when there are fewer """
+    if len(words) <= _SHINGLE_WORDS:
+        return [ hash_shingle(words) ] if words else []
+    return [ hash_shingle(shingle) for shingle in zip(*[ words[i:] for i in range(_SHINGLE_WORDS) ]) ]
+#
+def hash_shingle(words):
+    """ returns the hash of the shingle words. Unlike hash(), it is the
+    same on every run (even with hash randomization, python -R), so are
+    the duplicates found """
+    return zlib.crc32(u" ".join(words).encode("utf-8")) & _HASH_MASK
+#
+def compose_signature(shingles):
+    """ returns the signature of the hashes of shingles: the minimum of
+    each bin, with the bin set by the highest bits of each hash. Empty
+    bins take the minimum of the next bin that is not, so similar
+    questions still share them """
+    signature = [ _EMPTY_BIN ] * _SIGNATURE_SIZE
+    shift = 32 - _BIN_BITS
+    for shingle in shingles:
+        shingle = (shingle * 0x9e3779b1) & _HASH_MASK     # spreads the bits of the hash
+        nbin = shingle >> shift
+        value = shingle & _VALUE_MASK
+        if value < signature[nbin]:
+            signature[nbin] = value
+    if shingles:
+        following = _EMPTY_BIN
+        for nbin in _DENSIFICATION_ORDER:
+            if signature[nbin] == _EMPTY_BIN:
+                signature[nbin] = following
+            else:
+                following = signature[nbin]
+    return signature
@@ -0,0 +1,33 @@
+# encoding: utf-8
+#
+# File:     quizerrors.py
+# Descr:    Errors raised while processing quizes, shared by
+#           shufflequiz.py, quiz2moodlexml.py and quizlib.py
+
+# The tools don't quit where an error is found: they raise a QuizError
+# that their main() shows before quitting with its exit code, so the
+# same code can be run in process (see quizlib.py).
+#
+# Errors keep their arguments on args, so they can be pickled back from
+# the workers of a pool.
+
+#
+class QuizError(Exception):
+    """ an error on the quizes or on what is asked of them. The tools
+    show msg and quit with exit_code """
+    def __init__(self, msg, exit_code=1):
+        Exception.__init__(self, msg, exit_code)
+        self.msg = msg
+        self.exit_code = exit_code
+
+    def __str__(self):
+        return self.msg
+#
+class QuizScanError(QuizError):
+    """ a badformed quiz: reason found at line of filename """
+    def __init__(self, filename, line, reason):
+        QuizError.__init__(self, "file: %s [line: %s] -> %s."%(filename, line, reason), 3)
+        self.args = (filename, line, reason)
+        self.filename = filename
+        self.line = line
+        self.reason = reason
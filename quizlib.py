@@ -0,0 +1,227 @@
+# encoding: utf-8
+#
+# File:     quizlib.py
+# Descr:    In process API of shufflequiz.py and quiz2moodlexml.py, so
+#           other programs (e.g. a server) can parse quizes once and
+#           render them many times, with no subprocess nor temporary file
+
+# Usage:
+#
+#   import quizlib, quizerrors
+#   bank = quizlib.QuizBank(quizlib.QuizConfig(shuffle_answers=True))
+#   try:
+#       bank.add_file("tema1.quiz")
+#       bank.add_string(text, "tema2.quiz")
+#   except quizerrors.QuizScanError as e:
+#       print e.filename, e.line, e.reason
+#   exam = bank.render_exam(seed=7)                 # as a string
+#   with open("exam.eval.npy", "wb") as f:
+#       bank.render_eval(f, seed=7, format="npy")   # or to a writer
+#
+# Errors raise quizerrors.QuizError (QuizScanError on badformed quizes)
+# instead of quitting.
+#
+# Quizes are parsed and postprocessed once, when added. Each render
+# composes its own orders (the same ones the tools compose with that
+# seed) and never modifies the parsed quizes, so a bank can be rendered
+# from several threads at once, even while quizes are being added or
+# reloaded: each render takes the quizes as they were when it started
+# (quizes are never modified but replaced, on a new list).
+
+import argparse
+import copy
+import threading
+from cStringIO import StringIO
+import shufflequiz
+import quiz2moodlexml
+import quizerrors
+import quizprofile
+#
+_EVAL_WRITERS = { "wide": "write_eval", "long": "write_eval_long", "npy": "write_eval_npy" }
+#
+class QuizConfig(object):
+    """ the settings of the rendered quizes, as the options of the tools.
+    Raises QuizError on invalid settings """
+    def __init__(self, max_answers=10, place_finals=True,
+            shuffle_questions=False, shuffle_answers=False, shuffle_files=False,
+            fix_eval_answer_nr=False, start_nr=1, csv_separator=",",
+            question_mark=shufflequiz._QUESTION_MARK,
+            description_mark=shufflequiz._DESCRIPTION_MARK,
+            answer_mark=shufflequiz._ANSWER_MARK):
+        if max_answers < 2:
+            raise quizerrors.QuizError("Maximum number of answers must be at least 2")
+        self.max_answers = max_answers
+        self.place_finals = place_finals
+        self.shuffle_questions = shuffle_questions or shuffle_files
+        self.shuffle_answers = shuffle_answers
+        self.shuffle_files = shuffle_files
+        self.fix_eval_answer_nr = fix_eval_answer_nr
+        self.start_nr = start_nr
+        self.csv_separator = csv_separator
+        self.question_mark = question_mark
+        self.description_mark = description_mark
+        self.answer_mark = answer_mark
+
+    def to_options(self):
+        """ returns the options of the tools with these settings. Quizes
+        are neither cached nor built """
+        return argparse.Namespace(maxanswers=self.max_answers,
+                placefinals=self.place_finals,
+                shufflequestions=self.shuffle_questions,
+                shuffleanswers=self.shuffle_answers,
+                shufflefiles=self.shuffle_files,
+                fixavalanswernr=self.fix_eval_answer_nr,
+                startnr=self.start_nr,
+                csvseparator=self.csv_separator,
+                questionmark=self.question_mark,
+                descriptionmark=self.description_mark,
+                answermark=self.answer_mark,
+                files=[], seed=None, variants=0, jobs=1, bank=None,
+                cache=None, usemmap=True, manifest=None,
+                profiler=quizprofile.PhaseProfile(enabled=False))
+#
+class QuizBank(object):
+    """ the quizes parsed with a config, ready to be rendered """
+    def __init__(self, config=None):
+        self.config = QuizConfig() if config == None else config
+        self.options = self.config.to_options()
+        self._scan_options = copy.copy(self.options)
+        self._scan_options.placefinals = False  # records keep the order of the file
+        self._entries = []      # (name, quiz, xml_quiz) of each quiz, in order. Replaced, never modified
+        self._lock = threading.Lock()   # serializes the changes of _entries
+
+    def add_string(self, text, name="<string>"):
+        """ parses the quiz contents text, named name on errors and
+        outputs. Returns the number of its questions """
+        if isinstance(text, unicode):
+            text = text.encode("utf-8")
+        return self.add_stream(text.splitlines(True), name)
+
+    def add_stream(self, stream, name="<stream>"):
+        """ parses the quiz read from stream (a file or any iterator on
+        its lines), named name on errors and outputs. Returns the number
+        of its questions """
+        entry = self._parse(stream, name)
+        with self._lock:
+            self._entries = self._entries + [ entry ]
+        return entry[1].nr_questions()
+
+    def reload_stream(self, stream, name):
+        """ parses the quiz read from stream, replacing the quiz named
+        name (or adding it, when there is none). On errors, the previous
+        quiz remains. Returns the number of its questions """
+        entry = self._parse(stream, name)
+        with self._lock:
+            entries = list(self._entries)
+            names = [ entry_name for entry_name, quiz, xml_quiz in entries ]
+            if name in names:
+                entries[names.index(name)] = entry
+            else:
+                entries.append(entry)
+            self._entries = entries
+        return entry[1].nr_questions()
+
+    def remove(self, name):
+        """ removes the quiz named name, if any """
+        with self._lock:
+            self._entries = [ entry for entry in self._entries if entry[0] != name ]
+
+    def reload_string(self, text, name):
+        """ parses the quiz contents text, replacing the quiz named name
+        (see reload_stream()) """
+        if isinstance(text, unicode):
+            text = text.encode("utf-8")
+        return self.reload_stream(text.splitlines(True), name)
+
+    def add_file(self, filename):
+        """ parses the quiz file filename. Returns the number of its
+        questions """
+        with open(filename) as f:
+            return self.add_stream(f, filename)
+
+    def names(self):
+        """ returns the names of the quizes, in the order they were added """
+        return [ name for name, quiz, xml_quiz in self._entries ]
+
+    def nr_questions(self):
+        """ returns the number of questions of all the quizes """
+        return sum(quiz.nr_questions() for name, quiz, xml_quiz in self._entries)
+
+    def render_exam(self, writer=None, seed=None):
+        """ renders the exam, shuffled with seed (None for a random
+        one), to writer. Returns it as a string when no writer is set """
+        return self._render("write_exam", writer, seed)
+
+    def render_revision(self, writer=None, seed=None):
+        """ renders the exam with the weight of each answer (see
+        render_exam()) """
+        return self._render("write_revision", writer, seed)
+
+    def render_eval(self, writer=None, seed=None, format="wide"):
+        """ renders the evaluation information on format (wide, long or
+        npy) of the exam shuffled with seed (see render_exam()) """
+        if format not in _EVAL_WRITERS:
+            raise quizerrors.QuizError("Unknown evaluation format %s"%format)
+        return self._render(_EVAL_WRITERS[format], writer, seed)
+
+    def render_gift(self, writer=None, seed=None):
+        """ renders the evaluation information on gift format of the
+        exam shuffled with seed (see render_exam()) """
+        return self._render("write_gift", writer, seed)
+
+    def render_xml(self, writer=None):
+        """ renders the quizes on Moodle XML format to writer. Returns
+        it as a string when no writer is set. Questions keep their order """
+        entries = self._entries
+        options = copy.copy(self.options)
+        options.files = [ name for name, quiz, xml_quiz in entries ]
+        quiz_set = quiz2moodlexml.QuizSet(options)
+        quiz_set.quizes = [ xml_quiz for name, quiz, xml_quiz in entries ]
+        return render_to(quiz_set._write_xml, writer)
+
+    def compose_quiz_set(self, seed=None):
+        """ returns the QuizSet of the quizes added so far, with its
+        orders composed with seed. It shares the parsed quizes """
+        entries = self._entries
+        options = copy.copy(self.options)
+        options.files = [ name for name, quiz, xml_quiz in entries ]
+        options.seed = seed
+        quiz_set = shufflequiz.QuizSet(options)
+        quizes = [ quiz for name, quiz, xml_quiz in entries ]
+        if options.shufflefiles and quizes:
+            all_questions = [ question for quiz in quizes for question in quiz.questions ]
+            only_quiz = shufflequiz.Quiz("allfiles", options, all_questions)
+            only_quiz.compose_weights()     # questions are already postprocessed
+            quizes = [ only_quiz ]
+        quiz_set.quizes = quizes
+        quiz_set.orders = quiz_set.compose_orders(seed)
+        return quiz_set
+
+    def _parse(self, stream, name):
+        """ returns the entry (name, quiz, xml_quiz) of the quiz read from
+        stream, postprocessed both for the text outputs and for xml, so
+        renders never build nor postprocess questions """
+        scanner = shufflequiz.Quiz(name, self._scan_options)
+        records = [ question.to_record() for question in scanner.scan_lines(stream) ]
+        quiz = shufflequiz.Quiz(name, self.options)
+        quiz.questions = [ shufflequiz.Question.from_record(record, quiz.settings, name)
+                for record in records ]
+        quiz.postprocess()
+        xml_questions = [ quiz2moodlexml.Question.from_record(record[:3]) for record in records ]
+        xml_quiz = quiz2moodlexml.Quiz(name, self.options, xml_questions).postprocess()
+        return name, quiz, xml_quiz
+
+    def _render(self, method, writer, seed):
+        """ renders with method of the QuizSet with orders composed with
+        seed """
+        return render_to(getattr(self.compose_quiz_set(seed), method), writer)
+#
+def render_to(write, writer):
+    """ calls write(writer) or, when writer is None, write() to a
+    string buffer whose contents are returned """
+    if writer != None:
+        write(writer)
+        return None
+    f = StringIO()
+    write(f)
+    return f.getvalue()
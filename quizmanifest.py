@@ -0,0 +1,127 @@
+# encoding: utf-8
+#
+# File:     quizmanifest.py
+# Descr:    Build manifest of the outputs of shufflequiz.py and
+#           quiz2moodlexml.py, to rebuild only the outdated ones
+
+# The manifest is kept next to the outputs («name».manifest.json). It
+# records what the outputs were built from: the tool and its version,
+# the options that affect the outputs (including the seed), the
+# contents of each input file, and the size and modification time of
+# each output once built.
+#
+# An output is up to date when the tool, its options and the contents
+# of the inputs are the same as recorded, and the output itself is
+# still as it was built. Inputs are only hashed again when their size
+# or modification time changed, so checking a warm build just takes a
+# few stats.
+#
+# Outputs that are not reproducible (e.g. shuffled without a seed) are
+# never up to date.
+
+import sys, os
+import json
+import quizcache
+#
+_MANIFEST_FORMAT = 1
+#
+class BuildManifest(object):
+    def __init__(self, path, params, inputs, reproducible=True):
+        self.path = path
+        self.params = json.loads(json.dumps(params))    # tool, version and options, as plain values (e.g. tuples as lists)
+        self.inputs = inputs            # input filenames, in order
+        self.reproducible = reproducible
+        self.uptodate = set()           # outputs that won't be rebuilt
+        self._input_states = None       # [ filename, size, mtime, sha1 ] of each input
+        self._outputs = []              # outputs considered on the last check
+
+    def check(self, outputs, rebuild_all=False):
+        """ sets and returns the outputs that are up to date (none when
+        rebuild_all) """
+        self._outputs = sorted(outputs)
+        self.uptodate = set()
+        self._input_states = None
+        previous = None if rebuild_all else self._load()
+        if previous == None or not self.reproducible:
+            return self.uptodate
+        if previous.get("format") != _MANIFEST_FORMAT or previous.get("params") != self.params:
+            return self.uptodate
+        if not self._inputs_unchanged(previous.get("inputs", [])):
+            return self.uptodate
+        output_states = previous.get("outputs", {})
+        self.uptodate = set(f for f in self._outputs if output_states.get(f) == file_state(f))
+        return self.uptodate
+
+    def outdated(self, filename):
+        """ true when filename must be rebuilt """
+        return filename not in self.uptodate
+
+    def all_up_to_date(self):
+        """ true when every output of the last check is up to date """
+        return len(self.uptodate) == len(self._outputs)
+
+    def save(self):
+        """ records the current inputs and outputs """
+        contents = {
+            "format": _MANIFEST_FORMAT,
+            "params": self.params,
+            "reproducible": self.reproducible,
+            "inputs": self._compose_input_states(),
+            "outputs": dict((f, file_state(f)) for f in self._outputs if os.path.isfile(f)),
+        }
+        tmppath = "%s.%s.tmp"%(self.path, os.getpid())
+        with open(tmppath, "w") as f:
+            json.dump(contents, f, indent=1, sort_keys=True)
+        os.rename(tmppath, self.path)
+
+    def report(self):
+        """ shows on stderr the skipped and the rebuilt outputs """
+        for filename in self._outputs:
+            if filename in self.uptodate:
+                print >> sys.stderr, "skipped (up to date): %s"%filename
+            else:
+                print >> sys.stderr, "rebuilt: %s"%filename
+
+    def _load(self):
+        """ returns the contents of the manifest, or None when there is
+        no (valid) manifest """
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return None
+
+    def _inputs_unchanged(self, previous_states):
+        """ true when the inputs are the ones of previous_states, with
+        the same contents """
+        if [ state[0] for state in previous_states ] != self.inputs:
+            return False
+        states = []
+        for filename, size, mtime, digest in previous_states:
+            current = file_state(filename)
+            if current == None:
+                return False
+            if current != [ size, mtime ]:
+                digest_now = quizcache.hash_file_contents(filename).encode("hex")
+                if digest_now != digest:
+                    return False
+            states.append([ filename ] + current + [ digest ])
+        self._input_states = states
+        return True
+
+    def _compose_input_states(self):
+        """ returns the state of each input, hashing only the ones not
+        already checked """
+        if self._input_states == None:
+            self._input_states = [ [ filename ] + file_state(filename)
+                    + [ quizcache.hash_file_contents(filename).encode("hex") ]
+                    for filename in self.inputs ]
+        return self._input_states
+#
+def file_state(filename):
+    """ returns [ size, mtime ] of filename, or None when it is missing """
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return [ stat.st_size, stat.st_mtime ]
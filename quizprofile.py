@@ -0,0 +1,136 @@
+# encoding: utf-8
+#
+# File:     quizprofile.py
+# Descr:    Time and memory of each phase of a run of shufflequiz.py or
+#           quiz2moodlexml.py (e.g. scan, postprocess, each output)
+
+# Each phase records its wall and cpu seconds and the memory of the
+# process once it is over: the peak resident size so far and the
+# current resident size. Python 2 has no tracemalloc, so the peak is
+# the one of the whole process as getrusage reports it: it never
+# decreases, and the phase that raised it is the one whose peak is
+# greater than the one of the phase before. Cpu seconds include the
+# ones of the child processes (e.g. of a pool) waited for on the phase,
+# but the peak is the one of this process alone.
+#
+# Each phase also gets the counts of what it processed (e.g. files,
+# lines, questions, answers or bytes written), set by the tools.
+#
+# A disabled profile measures nothing, so the tools always run their
+# phases on a profile at a negligible cost.
+#
+# The tools can also run under cProfile (see call_profiled()), to find
+# the hot functions of a slow phase.
+
+import sys, os
+import time
+import json
+import resource
+import cProfile
+import pstats
+from contextlib import contextmanager
+#
+_COUNT_BLOCK_SIZE = 1 << 20
+_HOT_FUNCTIONS = 20
+#
+class PhaseProfile(object):
+    """ the measures of each phase, in the order they ran. When not
+    enabled, phases are not measured """
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.phases = []        # (name, measures) of each finished phase
+        self.start = time.time()
+        self.start_cpu = cpu_seconds()
+
+    @contextmanager
+    def phase(self, name):
+        """ measures the body of the with statement as phase name. It
+        gets the dict of the counts of the phase, that can be set until
+        the measures are reported """
+        counts = {}
+        if not self.enabled:
+            yield counts
+            return
+        start = time.time()
+        start_cpu = cpu_seconds()
+        yield counts
+        self.phases.append((name, {
+            "seconds": time.time() - start,
+            "cpu_seconds": cpu_seconds() - start_cpu,
+            "peak_kb": peak_memory_kb(),
+            "rss_kb": current_memory_kb(),
+            "counts": counts,
+        }))
+
+    def to_dict(self):
+        """ returns the measures of each phase by name """
+        return dict(self.phases)
+
+    def total(self):
+        """ returns the measures of the whole run, so far """
+        return { "seconds": time.time() - self.start, "cpu_seconds": cpu_seconds() - self.start_cpu,
+                "peak_kb": peak_memory_kb(), "rss_kb": current_memory_kb() }
+
+    def report(self, tool, jsonfilename=None):
+        """ shows the measures of each phase on stderr and, when set,
+        writes them as json to jsonfilename. Nothing when not enabled """
+        if not self.enabled:
+            return
+        total = self.total()
+        print >> sys.stderr, "profile of %s:"%tool
+        print >> sys.stderr, "%-14s %10s %10s %10s  %s"%("phase", "wall s", "cpu s", "peak KB", "counts")
+        for name, measures in self.phases + [ ("total", total) ]:
+            counts = " ".join("%s=%s"%item for item in sorted(measures.get("counts", {}).items()))
+            print >> sys.stderr, "%-14s %10.4f %10.4f %10s  %s"%(name, measures["seconds"],
+                    measures["cpu_seconds"], measures["peak_kb"], counts)
+        if jsonfilename != None:
+            contents = { "tool": tool, "total": total,
+                    "phases": [ dict(measures, phase=name) for name, measures in self.phases ] }
+            with open(jsonfilename, "w") as f:
+                json.dump(contents, f, indent=1, sort_keys=True)
+#
+def call_profiled(function, filename=None):
+    """ calls function and returns its result. When filename is set, it
+    runs under cProfile: the stats are dumped to filename (see pstats)
+    and the _HOT_FUNCTIONS with the most internal time are shown on
+    stderr """
+    if filename == None:
+        return function()
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(function)
+    finally:
+        profiler.dump_stats(filename)
+        pstats.Stats(profiler, stream=sys.stderr).sort_stats("tottime").print_stats(_HOT_FUNCTIONS)
+#
+def count_lines(filenames):
+    """ returns the number of lines of the files of filenames """
+    nr_lines = 0
+    for filename in filenames:
+        with open(filename, "rb") as f:
+            last = "\n"
+            for block in iter(lambda: f.read(_COUNT_BLOCK_SIZE), ""):
+                nr_lines += block.count("\n")
+                last = block[-1]
+            nr_lines += last != "\n"     # unfinished last line
+    return nr_lines
+#
+def cpu_seconds():
+    """ returns the user and system cpu seconds of this process and its
+    waited for children """
+    times = os.times()
+    return times[0] + times[1] + times[2] + times[3]
+#
+def peak_memory_kb():
+    """ returns the peak resident size of this process in KB """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+#
+def current_memory_kb():
+    """ returns the resident size of this process in KB, or None when
+    it can't be known (no /proc) """
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+    except (IOError, IndexError, ValueError):
+        return None
+    return pages * resource.getpagesize() // 1024
@@ -0,0 +1,490 @@
+#! /usr/bin/python
+# encoding: utf-8
+#
+# File:     quizserve.py
+# Descr:    Local server that keeps banks of quiz files parsed in memory
+#           and renders their variants on request
+
+# Banks
+# -----
+
+# A bank is a named set of quiz files, given as NAME=PATH, where PATH is
+# a quiz file, a directory containing them or a glob pattern. The same
+# NAME can be given more than once to add more files to its bank.
+#
+#   Example:
+
+#       quizserve.py -e -S 1234 -j 4 tema1=tema1.quiz final=quizes/
+
+# The files are parsed once, when the server starts. On each request
+# to a bank, its files are checked again (at most once every
+# --checkInterval seconds): a file whose size or modification time
+# changed is read and hashed, and it is only parsed again when its
+# contents changed. While a file is badformed (or missing), its error
+# is shown and its previous contents are kept.
+
+# Requests
+# --------
+
+# The server answers HTTP GET requests, on a TCP port or on a Unix
+# socket (--socket):
+#
+#   /banks/«bank»/variants/«nr»/«output»
+#       renders variant nr (from 1) of the bank as output: exam,
+#       revision, eval, evallong, evalnpy, evalgift or xml. Variant nr
+#       is shuffled with seed + nr, so it is the same variant nr that
+#       shufflequiz.py --variants generates with the same seed and
+#       shuffle options. The xml is never shuffled.
+#
+#   /banks
+#       the banks, with their files and number of questions, and the
+#       seed, as json.
+#
+#   /stats
+#       the number of requests served, errors and reloaded files, and
+#       the latency percentiles (p50, p90, p99) in milliseconds, as
+#       json.
+#
+#   Example:
+
+#       curl http://localhost:8000/banks/final/variants/7/exam
+
+# Concurrency
+# -----------
+
+# Requests are served by a pool of --jobs worker processes, forked once
+# the banks are parsed, that accept connections on the same socket.
+# Each worker keeps its own copy of the banks (and reloads them on its
+# own). The statistics are shared by all of them, and shown on stderr
+# when the server quits.
+
+import sys, os
+import argparse
+import json
+import hashlib
+import math
+import multiprocessing
+import random
+import signal
+import socket
+import time
+import urllib
+import BaseHTTPServer
+import SocketServer
+import shufflequiz
+import quizmanifest
+import quizerrors
+import quizlib
+#
+_VERSION = "1.0"
+#
+_OUTPUTS = {    # output -> QuizBank render method, its arguments and content type
+    "exam": ("render_exam", {}, "text/x-rst; charset=utf-8"),
+    "revision": ("render_revision", {}, "text/x-rst; charset=utf-8"),
+    "eval": ("render_eval", { "format": "wide" }, "text/csv; charset=utf-8"),
+    "evallong": ("render_eval", { "format": "long" }, "text/csv; charset=utf-8"),
+    "evalnpy": ("render_eval", { "format": "npy" }, "application/octet-stream"),
+    "evalgift": ("render_gift", {}, "text/plain; charset=utf-8"),
+    "xml": ("render_xml", None, "application/xml; charset=utf-8"),
+}
+_JSON_CONTENT_TYPE = "application/json"
+_TEXT_CONTENT_TYPE = "text/plain; charset=utf-8"
+#
+_LATENCY_MIN = 1e-5         # seconds: upper bound of the first bucket
+_LATENCY_RATIO = 1.1        # between the bounds of consecutive buckets
+_LATENCY_BUCKETS = 200      # up to _LATENCY_MIN * _LATENCY_RATIO ** _LATENCY_BUCKETS (half an hour)
+_LATENCY_PERCENTILES = (50, 90, 99)
+_STATS_REQUESTS = 0         # counters on ServerStats, before the buckets
+_STATS_ERRORS = 1
+_STATS_RELOADS = 2
+_STATS_BUCKETS = 3
+#
+class HotBank(object):
+    """ a bank of quiz files kept parsed, reloading each file when its
+    contents change """
+    def __init__(self, name, filenames, config, check_interval):
+        self.name = name
+        self.filenames = filenames
+        self.bank = quizlib.QuizBank(config)
+        self.check_interval = check_interval
+        self.states = {}        # [ size, mtime ] of each file when last read
+        self.digests = {}       # digest of the contents of each file when last read
+        self.last_check = time.time()
+        for filename in filenames:
+            self._load(filename)
+
+    def refresh(self):
+        """ reloads the files whose contents changed, unless they were
+        checked less than check_interval seconds ago. Returns the number
+        of reloaded files """
+        now = time.time()
+        if now - self.last_check < self.check_interval:
+            return 0
+        self.last_check = now
+        reloaded = 0
+        for filename in self.filenames:
+            if quizmanifest.file_state(filename) == self.states.get(filename):
+                continue
+            try:
+                reloaded += self._load(filename)
+            except IOError as e:
+                shufflequiz.show_error("file: %s -> %s"%(filename, e.strerror))
+            except quizerrors.QuizError as e:
+                shufflequiz.show_error(str(e))
+        return reloaded
+
+    def to_dict(self):
+        """ returns the files and number of questions of this bank """
+        return { "files": self.bank.names(), "questions": self.bank.nr_questions() }
+
+    def _load(self, filename):
+        """ parses filename again when its contents changed since it was
+        last read. Returns 1 when parsed, 0 otherwise """
+        with open(filename) as f:
+            stat = os.fstat(f.fileno())
+            contents = f.read()
+        self.states[filename] = [ stat.st_size, stat.st_mtime ]
+        digest = hashlib.sha1(contents).digest()
+        if self.digests.get(filename) == digest:
+            return 0
+        self.digests[filename] = digest     # not parsed again while badformed
+        self.bank.reload_string(contents, filename)
+        return 1
+#
+class ServerStats(object):
+    """ counters of the requests served by every worker, and a histogram
+    of their latencies (log spaced buckets, so percentiles are estimated
+    within a _LATENCY_RATIO factor), on shared memory """
+    def __init__(self):
+        self.counters = multiprocessing.Array("L", _STATS_BUCKETS + _LATENCY_BUCKETS)
+
+    def record(self, seconds, error=False, reloads=0):
+        """ counts a request served in seconds """
+        bucket = latency_bucket(seconds)
+        with self.counters.get_lock():
+            counters = self.counters.get_obj()
+            counters[_STATS_REQUESTS] += 1
+            counters[_STATS_ERRORS] += int(error)
+            counters[_STATS_RELOADS] += reloads
+            counters[_STATS_BUCKETS + bucket] += 1
+
+    def to_dict(self):
+        """ returns the counters and the latency percentiles (ms) """
+        with self.counters.get_lock():
+            counters = self.counters[:]
+        histogram = counters[_STATS_BUCKETS:]
+        contents = {
+            "requests": counters[_STATS_REQUESTS],
+            "errors": counters[_STATS_ERRORS],
+            "reloads": counters[_STATS_RELOADS],
+        }
+        for percentile in _LATENCY_PERCENTILES:
+            contents["p%s_ms"%percentile] = round(latency_percentile(histogram, percentile) * 1000, 3)
+        return contents
+
+    def summary(self):
+        """ returns the statistics in a line """
+        contents = self.to_dict()
+        latencies = ", ".join("p%s %.3f ms"%(p, contents["p%s_ms"%p]) for p in _LATENCY_PERCENTILES)
+        return "served: %s requests (%s errors, %s reloaded files); latency: %s"%(
+                contents["requests"], contents["errors"], contents["reloads"], latencies)
+#
+class QuizServer(object):
+    """ answers the requests on the banks, rendering variant nr with
+    seed + nr """
+    def __init__(self, banks, seed, stats):
+        self.banks = banks      # name -> HotBank
+        self.seed = seed
+        self.stats = stats
+
+    def respond(self, path):
+        """ returns (status, content type, body) of the request of path """
+        parts = [ urllib.unquote(part) for part in path.split("?")[0].strip("/").split("/") ]
+        if parts == [ "banks" ]:
+            banks = dict((name, bank.to_dict()) for name, bank in self.banks.items())
+            return 200, _JSON_CONTENT_TYPE, json.dumps({ "seed": self.seed, "banks": banks })
+        if parts == [ "stats" ]:
+            return 200, _JSON_CONTENT_TYPE, json.dumps(self.stats.to_dict())
+        if len(parts) != 5 or parts[0] != "banks" or parts[2] != "variants":
+            return 404, _TEXT_CONTENT_TYPE, "Unknown request %s\n"%path
+        name, nr, output = parts[1], parts[3], parts[4]
+        if name not in self.banks:
+            return 404, _TEXT_CONTENT_TYPE, "Unknown bank %s\n"%name
+        if not nr.isdigit() or int(nr) < 1:
+            return 400, _TEXT_CONTENT_TYPE, "Variant must be a number from 1\n"
+        if output not in _OUTPUTS:
+            return 404, _TEXT_CONTENT_TYPE, "Unknown output %s (expected %s)\n"%(output, ", ".join(sorted(_OUTPUTS)))
+        method, arguments, content_type = _OUTPUTS[output]
+        bank = self.banks[name].bank
+        if arguments == None:       # not shuffled
+            return 200, content_type, getattr(bank, method)()
+        return 200, content_type, getattr(bank, method)(seed=self.seed + int(nr), **arguments)
+
+    def refresh(self, path):
+        """ refreshes the bank requested on path, if any. Returns the
+        number of reloaded files """
+        parts = path.split("?")[0].strip("/").split("/")
+        if len(parts) > 1 and parts[0] == "banks":
+            bank = self.banks.get(urllib.unquote(parts[1]))
+            if bank != None:
+                return bank.refresh()
+        return 0
+#
+class QuizRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    server_version = "quizserve/%s"%_VERSION
+    timeout = 30        # seconds a stalled client can hold a worker
+
+    def do_GET(self):
+        start = time.time()
+        quiz_server = self.server.quiz_server
+        status, reloads = 500, 0
+        try:
+            try:
+                reloads = quiz_server.refresh(self.path)
+                status, content_type, body = quiz_server.respond(self.path)
+            except quizerrors.QuizError as e:
+                status, content_type, body = 500, _TEXT_CONTENT_TYPE, "%s\n"%e
+            except Exception as e:      # a bug: answer it anyway, and keep serving
+                shufflequiz.show_error("%s -> %s: %s"%(self.path, type(e).__name__, e))
+                status, content_type, body = 500, _TEXT_CONTENT_TYPE, "Internal error: %s\n"%e
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:    # failed requests count on the stats too
+            quiz_server.stats.record(time.time() - start, status != 200, reloads)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            print >> sys.stderr, "%s - %s"%(self.path, format%args)
+#
+class TCPServer(BaseHTTPServer.HTTPServer):
+    allow_reuse_address = True
+#
+class UnixServer(SocketServer.UnixStreamServer):
+    pass
+#
+def compose_server(options, quiz_server):
+    """ returns the http server bound to options.socket or to
+    options.host and options.port, serving quiz_server """
+    try:
+        if options.socket != None:
+            if os.path.exists(options.socket):
+                os.remove(options.socket)
+            server = UnixServer(options.socket, QuizRequestHandler)
+            address = "unix:%s"%options.socket
+        else:
+            server = TCPServer((options.host, options.port), QuizRequestHandler)
+            address = "http://%s:%s"%server.server_address[:2]
+    except (socket.error, OSError) as e:
+        raise quizerrors.QuizError("Can't listen on %s (%s)"%(options.socket or options.port, e), 2)
+    server.quiz_server = quiz_server
+    server.verbose = options.verbose
+    server.address = address
+    return server
+#
+def serve(server, jobs):
+    """ serves requests until interrupted, on jobs worker processes.
+    With a single job, they are served by this process """
+    if jobs == 1:
+        _serve_in_worker(server)
+        return
+    server.socket.setblocking(False)    # workers compete on accept
+    workers = [ multiprocessing.Process(target=_serve_in_worker, args=(server,)) for i in range(jobs) ]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+            worker.join()
+#
+def _serve_in_worker(server):
+    """ serves requests on this worker until interrupted """
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+#
+def load_banks(options):
+    """ returns the HotBank of each bank of options.banks, by name """
+    files = {}
+    names = []
+    for spec in options.banks:
+        name, path = spec.split("=", 1)
+        if name not in files:
+            names.append(name)
+            files[name] = []
+        files[name] += shufflequiz.expand_input_files([ path ])
+    config = compose_config(options)
+    banks = {}
+    for name in names:
+        if files[name] == []:
+            raise quizerrors.QuizError("No quiz files found for bank %s"%name)
+        missing = shufflequiz.missing_files(files[name])
+        if missing:
+            raise quizerrors.QuizError("Input file %s doesn't exist"%missing[0], 2)
+        if any(not filename.endswith(".quiz") for filename in files[name]):
+            raise quizerrors.QuizError("Input files must have .quiz extension")
+        banks[name] = HotBank(name, files[name], config, options.checkinterval)
+    return banks
+#
+def compose_config(options):
+    """ returns the QuizConfig of the options """
+    return quizlib.QuizConfig(max_answers=options.maxanswers,
+            place_finals=options.placefinals,
+            shuffle_questions=options.shufflequestions or options.shuffleall,
+            shuffle_answers=options.shuffleanswers or options.shuffleall,
+            shuffle_files=options.shufflefiles or options.shuffleall,
+            fix_eval_answer_nr=options.fixavalanswernr,
+            start_nr=options.startnr,
+            csv_separator=options.csvseparator,
+            question_mark=options.questionmark,
+            description_mark=options.descriptionmark,
+            answer_mark=options.answermark)
+#
+def latency_bucket(seconds):
+    """ returns the bucket of the histogram of latencies of seconds """
+    if seconds <= _LATENCY_MIN:
+        return 0
+    bucket = int(math.ceil(math.log(seconds / _LATENCY_MIN) / math.log(_LATENCY_RATIO)))
+    return min(bucket, _LATENCY_BUCKETS - 1)
+#
+def latency_percentile(histogram, percentile):
+    """ returns the latency (upper bound of its bucket) at percentile of
+    histogram, or 0 when it is empty """
+    total = sum(histogram)
+    if total == 0:
+        return 0.0
+    rank = int(math.ceil(total * percentile / 100.0))
+    count = 0
+    for bucket, bucket_count in enumerate(histogram):
+        count += bucket_count
+        if count >= rank:
+            return _LATENCY_MIN * _LATENCY_RATIO ** bucket
+    return _LATENCY_MIN * _LATENCY_RATIO ** (len(histogram) - 1)
+#
+def compose_argparse():
+    """ composes and returns an ArgumentParser """
+    p = argparse.ArgumentParser(description = "Quiz rendering server", version=_VERSION)
+
+    p.add_argument('banks', metavar='NAME=PATH', nargs='+', help="banks of quiz files: NAME of the bank and a quiz file, a directory containing them or a glob pattern. A NAME can be given more than once")
+
+    # shuffle options
+    p.add_argument("-e", "--shuffleAll", action="store_true",
+            help=u"Do shuffle questions and answers (also amongst files)", dest="shuffleall")
+    p.add_argument("-q", "--shuffleQuestions", action="store_true",
+            help=u"Do shuffle questions", dest="shufflequestions")
+    p.add_argument("-a", "--shuffleAnswers", action="store_true",
+            help=u"Do shuffle answers", dest="shuffleanswers")
+    p.add_argument("-m", "--shuffleFiles", action="store_true",
+            help=u"Do shuffle questions amongst files", dest="shufflefiles")
+    p.add_argument("-f", "--noPlaceFinal", action="store_false",
+            help=u"Do not place final answers at the end", dest="placefinals", default=True)
+    p.add_argument("-S", "--seed", action="store",
+            type=int,
+            help=u"Set the seed of the variants: variant nr is shuffled with seed + nr (default random)",
+            dest="seed")
+
+    # server options
+    p.add_argument("-H", "--host", action="store",
+            help=u"Set the address to listen on (default 127.0.0.1)",
+            dest="host", default="127.0.0.1")
+    p.add_argument("-p", "--port", action="store",
+            type=int,
+            help=u"Set the TCP port to listen on (default 8000)",
+            dest="port", default=8000)
+    p.add_argument("--socket", action="store",
+            help=u"Listen on the Unix socket at this path instead of a TCP port",
+            dest="socket")
+    p.add_argument("-j", "--jobs", action="store",
+            type=int,
+            help=u"Set the number of worker processes (default 1, 0 for as many as cpus)",
+            dest="jobs", default=1)
+    p.add_argument("--checkInterval", action="store",
+            type=float,
+            help=u"Set the minimum seconds between checks for changes of the quiz files of a bank (default 1)",
+            dest="checkinterval", default=1.0)
+    p.add_argument("--verbose", action="store_true",
+            help=u"Show each request on stderr", dest="verbose")
+
+    # output options
+    p.add_argument("-s", "--startQuestionNumber", action="store",
+            type=int,
+            help=u"Set the number of the first question (default 1)",
+            dest="startnr", default=1)
+    p.add_argument("-M", "--maxAnswersPerQuestion", action="store",
+            type=int,
+            help=u"Set the maximum number of answers per question (default 10)",
+            dest="maxanswers", default=10)
+    p.add_argument("-F", "--fixAvalAnswerNr", action="store_true",
+            help=u"Fix the number of answers on the evaluation to the maximum", dest="fixavalanswernr")
+    p.add_argument("-c", "--csvSeparator", action="store",
+            help=u"Set the separator of the evaluation csv (default ',')",
+            dest="csvseparator", default=',')
+
+    # vocabulary options
+    p.add_argument("--questionMark", action="store",
+            help=u"Set the mark that starts a question (default '%s')"%shufflequiz._QUESTION_MARK,
+            dest="questionmark", default=shufflequiz._QUESTION_MARK)
+    p.add_argument("--descriptionMark", action="store",
+            help=u"Set the mark that starts a description (default '%s')"%shufflequiz._DESCRIPTION_MARK,
+            dest="descriptionmark", default=shufflequiz._DESCRIPTION_MARK)
+    p.add_argument("--answerMark", action="store",
+            help=u"Set the mark that starts an answer (default '%s')"%shufflequiz._ANSWER_MARK,
+            dest="answermark", default=shufflequiz._ANSWER_MARK)
+
+    return p
+#
+def exit_if_option_errors(options):
+    """ filters option errors and exits if there are any """
+    for spec in options.banks:
+        if "=" not in spec or spec.startswith("="):
+            shufflequiz.show_error_and_exit("Badformed bank %s (expected NAME=PATH)"%spec)
+    if options.jobs < 0:
+        shufflequiz.show_error_and_exit("Number of jobs can't be negative")
+    if options.checkinterval < 0:
+        shufflequiz.show_error_and_exit("Check interval can't be negative")
+    if options.maxanswers < 2:
+        shufflequiz.show_error_and_exit("Maximum number of answers must be at least 2")
+#
+def get_options():
+    """ returns the call arguments as an argparse """
+    p = compose_argparse()
+    options = p.parse_args()
+    exit_if_option_errors(options)
+    if options.seed == None:
+        options.seed = random.SystemRandom().getrandbits(31)
+    if options.jobs == 0:
+        options.jobs = multiprocessing.cpu_count()
+    return options
+#
+def main():
+    try:
+        options = get_options()
+        start = time.time()
+        banks = load_banks(options)
+        stats = ServerStats()
+        server = compose_server(options, QuizServer(banks, options.seed, stats))
+        print >> sys.stderr, "serving %s banks (%s questions, parsed in %.3f s) on %s with %s workers, seed %s (Ctrl-C to quit)"%(
+                len(banks), sum(bank.bank.nr_questions() for bank in banks.values()),
+                time.time() - start, server.address, options.jobs, options.seed)
+        signal.signal(signal.SIGTERM, signal.default_int_handler)    # quits as on Ctrl-C
+        try:
+            serve(server, options.jobs)
+        finally:
+            server.server_close()
+            if options.socket != None and os.path.exists(options.socket):
+                os.remove(options.socket)
+            print >> sys.stderr, stats.summary()
+    except quizerrors.QuizError as e:
+        shufflequiz.show_error_and_exit(str(e), e.exit_code)
+#
+if __name__=="__main__":
+    sys.exit(main())
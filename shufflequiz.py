@@ -91,10 +91,35 @@ import sys, os
 import random
 import argparse
 import re
+import copy
+import glob
+import fnmatch
+import json
+import struct
+from array import array
+import multiprocessing
+import mmap
+import quizcache
+import quizmanifest
+import quizerrors
+import quizbank
+import quizdedupe
+import quizprofile
 #
 _QUESTION_MARK = "pregunta"
 _DESCRIPTION_MARK = "enunciat"
 _ANSWER_MARK = "resposta"
+_VERSION = "1.0"
+_PARSER_VERSION = 2                # changes whenever cached parsings are no longer valid
+#
+_LINE_COMMENT = "comment"          # kinds of line as tagged by LineClassifier
+_LINE_QUESTION = "question"
+_LINE_DESCRIPTION = "description"
+_LINE_ANSWER = "answer"
+_LINE_TEXT = "text"
+#
+_ANSWER_CORRECT = 1                # bits of Answer.flags
+_ANSWER_FINAL = 2
 _RST_ANSWER_SEPARATION = "\n\n"
 _RST_DESCR_ANSWER_SEPARATION = "-"*4
 _RST_QUESTION_SEPARATION = "\n\n"
@@ -102,6 +127,11 @@ _RST_QUIZ_SEPARATION = "\n\n"
 _GIFT_QUESTION_SEPARATION = "\n\n\n"
 _GIFT_ANSWER_SEPARATION = "\n"
 #
+_EVAL_FORMATS = ("wide", "long", "npy")
+_EVAL_LONG_HEADER = ('"question"', '"answer"', '"weight"', '"correct"', '"final"', '"file"', '"line"')
+_EVAL_NPY_DESCR = "[('weight', '<f8'), ('correct', '|u1'), ('final', '|u1')]"
+_EVAL_NPY_RECORD = struct.Struct("<dBB")   # it follows _EVAL_NPY_DESCR
+#
 _GIFT_HEADER_TEMPLATE = "::Pregunta %s::[markdown]Indica quines respostes has marcat per la **pregunta %s**.{"
 _GIFT_ANSWER_TEMPLATE = "\t~%%%s%%He marcat la resposta %s)"
 #
@@ -131,51 +161,129 @@ _MAP_GIFT_WEIGHTS = { # weights from nr of answers of the same category
 }
 
 #
-class Answer:
+class LineClassifier:
+    """ tags each line of a quiz file with its kind (comment, question,
+    description, answer or text) in a single pass.
+    The marks of the vocabulary (e.g. pregunta, enunciat, resposta) are
+    set on construction, so their prefixes are built just once. """
+    def __init__(self, question_mark=_QUESTION_MARK,
+            description_mark=_DESCRIPTION_MARK, answer_mark=_ANSWER_MARK):
+        self.marks = {      # ".. «mark»:" -> kind
+            ".. %s:"%question_mark: _LINE_QUESTION,
+            ".. %s:"%description_mark: _LINE_DESCRIPTION,
+            ".. %s:"%answer_mark: _LINE_ANSWER,
+        }
+
+    @classmethod
+    def from_options(cls, options):
+        """ returns a classifier with the vocabulary set in options """
+        return cls(question_mark=options.questionmark,
+                description_mark=options.descriptionmark,
+                answer_mark=options.answermark)
+
+    def classify(self, lin):
+        """ returns the kind of lin.
+            Lines not starting with ".." are rejected as text right away.
+            Otherwise, the prefix up to the first colon is looked up
+            on the marks of the vocabulary. """
+        if not lin.startswith(".."):
+            return _LINE_TEXT
+        if lin.startswith(".. #") or lin.startswith(".. /"):
+            return _LINE_COMMENT
+        colon = lin.find(":")
+        if colon < 0:
+            return _LINE_TEXT
+        return self.marks.get(lin[:colon + 1], _LINE_TEXT)
+#
+class Answer(object):
+    __slots__ = ("flags", "text", "text_fragments")
+
     def __init__(self, is_correct, is_final):
-        self.is_correct = is_correct
-        self.is_final = is_final
+        self.flags = (_ANSWER_CORRECT if is_correct else 0) | (_ANSWER_FINAL if is_final else 0)
         self.text = ""
+        self.text_fragments = []    # joined into text on postprocess()
+
+    @property
+    def is_correct(self):
+        return self.flags & _ANSWER_CORRECT <> 0
+
+    @property
+    def is_final(self):
+        return self.flags & _ANSWER_FINAL <> 0
 
     def add_description(self, text):
-        self.text += text
+        self.text_fragments.append(text)
         return self
 
     def is_complete(self):
         """ true if it has an unempty text """
-        return self.text <> ""
+        return len(self.text_fragments) > 0 or self.text <> ""
 
     def postprocess(self):
-        """ cleans up the answer text by:
+        """ joins the answer text fragments and cleans it up by:
             a) removing start and end whitespaces
             b) adding a new line at the begining when it starts with a
             comment or rst directive (btw: a comment matches "^\s*\.\..*" )
+            Once joined, the fragments are released and the text is
+            interned, since the same answers (e.g. "None of the above")
+            are repeated all along the banks.
         """
+        if self.text_fragments:
+            self.text = "".join(self.text_fragments)
+            self.text_fragments = ()
         self.text = self.text.strip()
         if re.match("^\s*\.\..*", self.text):
             self.text = os.linesep * 2 + self.text
+        self.text = intern(self.text)
         return self
 
     def __repr__(self):
         return '{ "is_correct":%s, "is_final":%s, "text":"%s" }'%(self.is_correct, self.is_final, self.text)
 
-class Question:
-    def __init__(self, options):
-        self.options = options
+class QuestionSettings(object):
+    """ the few options a Question depends on. A single instance is
+    shared by all the questions of a quiz """
+    __slots__ = ("placefinals", "shuffleanswers", "fixavalanswernr", "maxanswers")
+
+    def __init__(self, placefinals=True, shuffleanswers=False,
+            fixavalanswernr=False, maxanswers=10):
+        self.placefinals = placefinals
+        self.shuffleanswers = shuffleanswers
+        self.fixavalanswernr = fixavalanswernr
+        self.maxanswers = maxanswers
+
+    @classmethod
+    def from_options(cls, options):
+        """ returns the settings set in options """
+        return cls(placefinals=options.placefinals,
+                shuffleanswers=options.shuffleanswers,
+                fixavalanswernr=options.fixavalanswernr,
+                maxanswers=options.maxanswers)
+#
+class Question(object):
+    __slots__ = ("settings", "title", "descr", "title_fragments",
+            "descr_fragments", "answers", "final_answers", "current_answer",
+            "nr_correct_answers", "nr_incorrect_answers", "filename", "line")
+
+    def __init__(self, settings, filename=""):
+        self.settings = settings
+        self.filename = filename    # source of the question
         self.reset()
 
     def appendToTitle(self, title):
-        cleantitle = title.strip()
-        if cleantitle <> "":
-            self.title += " " + cleantitle
+        """ appends each unempty line of title """
+        for line in title.splitlines():
+            cleantitle = line.strip()
+            if cleantitle <> "":
+                self.title_fragments.append(cleantitle)
         return self
 
     def add_description(self, descr):
-        self.descr += descr
+        self.descr_fragments.append(descr)
         return self
 
     def add_answer(self, answer):
-        if answer.is_final and self.options.placefinals:
+        if answer.is_final and self.settings.placefinals:
             self.final_answers.append(answer)
         else:
             self.answers.append(answer)
@@ -193,11 +301,11 @@ class Question:
 
     def has_proper_title(self):
         """ true if it has proper title """
-        return self.title <> ""
+        return len(self.title_fragments) > 0 or self.title <> ""
 
     def has_proper_description(self):
         """ true if it has proper description """
-        return self.descr <> ""
+        return len(self.descr_fragments) > 0 or self.descr <> ""
 
     def has_finished_current_answer(self):
         """ true if current answer is complete """
@@ -212,19 +320,28 @@ class Question:
         """ sets all properties to initial values """
         self.title = ""
         self.descr = ""
+        self.title_fragments = []   # joined into title on postprocess()
+        self.descr_fragments = []   # joined into descr on postprocess()
         self.answers = []
         self.final_answers = []
         self.current_answer = None
         self.nr_correct_answers = 0
         self.nr_incorrect_answers = 0
+        self.line = 0               # line of its question mark on filename
         return self
 
     def postprocess(self):
-        """ cleans up the text info by removing start and end whitespaces
-            and shuffles answers if required. """
-        self.title = self.title.strip()
+        """ joins the text fragments and cleans them up by removing start and end whitespaces.
+            Answers are not shuffled: each variant shows them in the
+            order composed by compose_answer_order() """
+        if self.title_fragments:
+            self.title = " ".join(self.title_fragments)
+            self.title_fragments = ()
+        if self.descr_fragments:
+            self.descr = "".join(self.descr_fragments)
+            self.descr_fragments = ()
         self.descr = self.descr.strip()
-        self._shuffle_answers()
+        self.current_answer = None
         self._postprocess_answers()
         return self
 
@@ -232,62 +349,121 @@ class Question:
         for answer in self.answers + self.final_answers:
             answer.postprocess()
 
-    def _shuffle_answers(self):
-        """ shuffles answers if required """
-        if self.options.shuffleanswers:
-            random.shuffle(self.answers)
+    def compose_answer_order(self, rng):
+        """ returns the order of the (non final) answers on a variant, as
+        a list of indexes on self.answers. They are shuffled with rng
+        if required. Final answers are pinned at the end """
+        order = range(len(self.answers))
+        if self.settings.shuffleanswers:
+            rng.shuffle(order)
+        return order
+
+    def answers_in_order(self, order=None):
+        """ returns the answers in order (indexes on self.answers as
+        composed by compose_answer_order()), or as they are when None.
+        Final answers are always at the end """
+        if order == None:
+            return self.answers + self.final_answers
+        answers = self.answers
+        return [ answers[i] for i in order ] + self.final_answers
+
+    def to_record(self):
+        """ returns the contents of this question, as scanned, in a
+        plain tuple (title, descr, ((answer flags, answer text),...), line).
+        It is not available once the question has been postprocessed """
+        answers = tuple((answer.flags, "".join(answer.text_fragments))
+                for answer in self.answers + self.final_answers)
+        return (" ".join(self.title_fragments), "".join(self.descr_fragments), answers, self.line)
+
+    @classmethod
+    def from_record(cls, record, settings, filename=""):
+        """ returns a question of filename with the contents of record,
+        as returned by to_record() """
+        title, descr, answers, line = record
+        question = cls(settings, filename)
+        question.line = line
+        question.title_fragments.append(title)
+        question.descr_fragments.append(descr)
+        for flags, text in answers:
+            answer = Answer(flags & _ANSWER_CORRECT, flags & _ANSWER_FINAL)
+            question.add_answer(answer.add_description(text))
+        return question
 
     def clone(self):
         """ returns a clon of this question.
             It does not clone answers (not required for 
             current usage). It should be done however if
             once cloned, answers could be modified. """
-        new_question = Question(self.options)
+        new_question = Question(self.settings, self.filename)
+        new_question.line = self.line
         new_question.title = self.title
         new_question.descr = self.descr
+        new_question.title_fragments = self.title_fragments
+        new_question.descr_fragments = self.descr_fragments
         new_question.answers = self.answers
         new_question.final_answers = self.final_answers
         new_question.nr_correct_answers = self.nr_correct_answers
         new_question.nr_incorrect_answers = self.nr_incorrect_answers
         return new_question
 
-    def toRST(self, nr, answers_weighted):
+    def compute_weights(self):
+        """ returns the list of weights of the answers as they are
+        (i.e. final answers at the end) """
+        return [ self._compute_answer_weight_fulldecimal(answer.is_correct)
+                for answer in self.answers + self.final_answers ]
+
+    def weights_in_order(self, order=None, weights=None):
+        """ returns the weights of the answers in order (see
+        answers_in_order()) taken from weights, as returned by
+        compute_weights() or a row of Quiz.weights. They are computed
+        when None """
+        if weights == None:
+            weights = self.compute_weights()
+        if order == None:
+            return list(weights)
+        return [ weights[i] for i in order ] + list(weights[len(self.answers):])
+
+    def toRST(self, nr, answers_weighted, order=None, weights=None):
         """ converts this question to rst format and numbers it with
             nr.
             If answers_weighted, it includes the corresponding
-            weight on each answer """
+            weight on each answer, taken from weights (see
+            weights_in_order()).
+            Answers are shown in order (see answers_in_order()) """
         title = self._rst_compose_title(nr)
         descr = self.descr
-        answers = self._rst_compose_answers(answers_weighted)
+        answers = self._rst_compose_answers(answers_weighted, order, weights)
         return "\n%s\n%s\n\n%s\n\n%s\n"%(title, descr,
                 _RST_DESCR_ANSWER_SEPARATION, answers)
 
-    def toEval(self, nr):
-        """ extracts evaluation information from this question.
+    def toEval(self, nr, order=None, weights=None):
+        """ extracts evaluation information from this question, with
+        answers in order (see answers_in_order()) and their weights
+        taken from weights (see weights_in_order()).
         Returns the list of headers (question_nr.answer_id) and the
         list of weights of each answer """
         all_headers = []
         all_weights = []
         start_nr = 1
-        for answer in self.answers + self.final_answers:
+        for weight in self.weights_in_order(order, weights):
             header = '"%s.%s"'%(nr, compose_answer_id(start_nr))
-            weight = self._compute_answer_weight_fulldecimal(answer.is_correct)
             start_nr += 1
             all_headers.append(header)
             all_weights.append(weight)
-        if self.options.fixavalanswernr:
-            for a in range(start_nr, self.options.maxanswers + 1 ):
+        if self.settings.fixavalanswernr:
+            for a in range(start_nr, self.settings.maxanswers + 1 ):
                 header = '"%s.%s"'%(nr, compose_answer_id(a))
                 weight = 0
                 all_headers.append(header)
                 all_weights.append(weight)
         return all_headers, all_weights
 
-    def toEvalGift(self, nr, title):
+    def toEvalGift(self, nr, title, order=None, weights=None):
         """ extracts evaluation information from this question in
-        gift format """
+        gift format, with answers in order (see answers_in_order()) and
+        their weights taken from weights (see weights_in_order()) """
         header = _GIFT_HEADER_TEMPLATE%(nr, title)
-        answers = self._evalgift_compose_answers()
+        answers = self._evalgift_compose_answers(order, weights)
         return "%s\n%s\n}\n%s"%(header, answers, _GIFT_QUESTION_SEPARATION)
 
     def _rst_compose_title(self, nr):
@@ -296,17 +472,18 @@ class Question:
         underline = compose_underline(title)
         return "%s\n%s\n"%(title, underline)
 
-    def _rst_compose_answers(self, answers_weighted):
+    def _rst_compose_answers(self, answers_weighted, order, weights):
         """ composes the answer list in rst format.
             In case answers_weighted then it will show the
             corresponding weights for each answer """
         rstanswers = []
         start_nr = 1
-        for answer in self.answers + self.final_answers:
+        answers = self.answers_in_order(order)
+        answer_weights = self.weights_in_order(order, weights) if answers_weighted else answers
+        for answer, answer_weight in zip(answers, answer_weights):
             answer_id = compose_answer_id(start_nr)
             answer_text = answer.text
             if answers_weighted:
-                answer_weight = self._compute_answer_weight_fulldecimal(answer.is_correct)
                 rst_weight = "[%.2f] "%answer_weight
                 rst_answer = "%s**%s)** %s"%(rst_weight, answer_id, answer_text)
             else:
@@ -328,178 +505,329 @@ class Question:
         as many as nr of its class. """
         return 1.0 / self._compute_answer_class(is_correct)
 
-    def _evalgift_compose_answers(self):
+    def _evalgift_compose_answers(self, order, weights):
         """ composes the evaluation information of the answer 
         list in gift format."""
         giftanswers = []
         start_nr = 1
-        for answer in self.answers + self.final_answers:
-            answer_weight = self._compute_answer_weight_for_gift(answer.is_correct)
+        for weight in self.weights_in_order(order, weights):
+            answer_weight = format_gift_weight(weight)
             answer_id = compose_answer_id(start_nr)
             gift_answer = _GIFT_ANSWER_TEMPLATE%(answer_weight, answer_id)
             giftanswers.append(gift_answer)
             start_nr += 1
         return _GIFT_ANSWER_SEPARATION.join(giftanswers)
 
-    def _compute_answer_weight_for_gift(self, is_correct):
-        """ returns the weight of an answer deppending on whether is_correct or not.
-        The result is a string with the format expected by Moodle's Gift """
-        nr = self._compute_answer_class(is_correct)
-        weight = _MAP_GIFT_WEIGHTS.get(nr, "%0.3f"%self._compute_answer_weight_fulldecimal(is_correct))
-        return weight
-
     def __repr__(self):
         answers = ",".join([ repr(r) for r in self.answers ])
         return '{ "title": "%s", "descr":"%s", "answers":[%s], "nr_correct":%s }'%(self.title, self.descr, answers, self.nr_correct_answers)
 #
+class QuizOrder(object):
+    """ the order of the questions of a quiz on a variant and the order
+    of the answers of each one, kept as compact arrays of indexes so the
+    quiz itself is never modified:
+        - questions: indexes on quiz.questions, as they appear
+        - answers: for each question as it appears, the indexes on its
+          (non final) answers, one question after the other """
+    __slots__ = ("questions", "answers")
+
+    def __init__(self, questions, answers):
+        self.questions = questions
+        self.answers = answers
+
+    def to_dict(self):
+        """ returns this order as a plain dict """
+        return { "questions": self.questions.tolist(), "answers": self.answers.tolist() }
+#
 class Quiz:
     def __init__(self, filename, options, questions=None):
         self.filename = filename
         self.options = options
         self.questions = [] if questions == None else questions
+        self._finished_questions = []   # pending to be yielded by the scanner
+        self.cached = False             # true when questions come from the cache
+        self.settings = QuestionSettings.from_options(options)
+        self.classifier = LineClassifier.from_options(options)
+        self.weights = None     # weight matrix, set on postprocess()
 
     def run(self):
         self._scan_quiz_file()
 
     def postprocess(self):
-        """ performs shuffling and cleaning up on questions """
-        self._shuffle_questions()
+        """ performs cleaning up on questions, and composes their
+        weight matrix """
         for q in self.questions:
             q.postprocess()
+        self.compose_weights()
+
+    def compose_weights(self):
+        """ composes the weight matrix of this quiz: an array with a row
+        of settings.maxanswers slots per question, holding the weights
+        of its answers as they are, and zero on the unused slots.
+        Weights don't depend on the order of the answers, so it is shared
+        by every variant, that just takes its rows in order """
+        slots = self.settings.maxanswers
+        weights = array("d", [ 0.0 ]) * (len(self.questions) * slots)
+        for row, question in enumerate(self.questions):
+            start = row * slots
+            question_weights = question.compute_weights()
+            weights[start:start + len(question_weights)] = array("d", question_weights)
+        self.weights = weights
+
+    def weight_row(self, i):
+        """ returns the weights of the answers of question i, taken from
+        the weight matrix, or None when it is not composed """
+        if self.weights == None:
+            return None
+        start = i * self.settings.maxanswers
+        return self.weights[start:start + self.questions[i].get_nr_answers()]
+
+    def compose_order(self, rng):
+        """ returns the QuizOrder of a variant of this quiz, with
+        questions and answers shuffled with rng when required """
+        questions = range(len(self.questions))
+        if self.options.shufflequestions:
+            rng.shuffle(questions)
+        answers = array("H")
+        for i in questions:
+            answers.extend(self.questions[i].compose_answer_order(rng))
+        return QuizOrder(array("I", questions), answers)
+
+    def iter_in_order(self, order=None):
+        """ generator of (question, answer order, weights) of this quiz
+        as they appear with order, or as they are when None.
+        weights is the row of the question on the weight matrix """
+        if order == None:
+            for i, question in enumerate(self.questions):
+                yield question, None, self.weight_row(i)
+            return
+        questions = self.questions
+        answers = order.answers
+        offset = 0
+        for i in order.questions:
+            question = questions[i]
+            nr_answers = len(question.answers)
+            yield question, answers[offset:offset + nr_answers], self.weight_row(i)
+            offset += nr_answers
+
+    def iter_questions(self):
+        """ generator of the questions of the file of this quiz, each
+            one postprocessed as soon as it is finished.
+            They are not kept on self.questions. """
+        for question in self._questions_from_file():
+            yield question.postprocess()
 
     def nr_questions(self):
         """ returns the number of questions in this quiz """
         return len(self.questions)
 
-    def toRST(self, start_nr, answers_weighted):
+    def toRST(self, start_nr, answers_weighted, order=None):
         """ converts quiz to rst format with questions numbered
-        from start_nr """
+        from start_nr, as they appear with order """
         rstquestions = []
-        for question in self.questions:
-            rstquestions.append(question.toRST(start_nr, answers_weighted))
+        for question, answer_order, weights in self.iter_in_order(order):
+            rstquestions.append(question.toRST(start_nr, answers_weighted, answer_order, weights))
             start_nr += 1
         return _RST_QUESTION_SEPARATION.join(rstquestions)
 
-    def toEval(self, start_nr):
-        """ extracts from this quiz the evaluation information.
+    def toEval(self, start_nr, order=None):
+        """ extracts from this quiz the evaluation information, with
+        questions as they appear with order.
         Returns two lists: first one with headers
         (question_nr.answer_id) and weight per answer """
         all_headers = []
         all_weights = []
-        for question in self.questions:
-            headers, weights = question.toEval(start_nr)
+        for question, answer_order, question_weights in self.iter_in_order(order):
+            headers, weights = question.toEval(start_nr, answer_order, question_weights)
             start_nr += 1
             all_headers += headers
             all_weights += weights
         return all_headers, all_weights
 
-    def toEvalGift(self, start_nr):
+    def toEvalGift(self, start_nr, order=None):
         """ extracts evaluation information of this quiz in gift
-        format"""
+        format, with questions as they appear with order """
         rstquestions = []
         question_length = len(str(len(self.questions)))
-        for question in self.questions:
+        for question, answer_order, weights in self.iter_in_order(order):
             nr = ("%s"%("%%%si"%question_length))%start_nr
             title = "%s. %s"%(start_nr, question.title)
-            rstquestions.append(question.toEvalGift(nr, title))
+            rstquestions.append(question.toEvalGift(nr, title, answer_order, weights))
             start_nr += 1
         return _GIFT_QUESTION_SEPARATION.join(rstquestions)
 
-    def _shuffle_questions(self):
-        """ shuffles questions if required """
-        if self.options.shufflequestions:
-            random.shuffle(self.questions)
-
-    def _scan_question(self, lin, nlin, question):
-        """ scans line lin on state="question" 
-            Returns new state and question, or quits on error """
-        if is_a_question(lin):
+    def _scan_question(self, kind, lin, nlin, question):
+        """ scans line lin of kind on state="question" 
+            Returns new state and question, or raises QuizScanError """
+        if kind == _LINE_QUESTION:
             state = "title"
             question.reset()
-        elif is_a_description(lin) or is_an_answer(lin):
-            show_scan_error_and_exit(self.filename, nlin, "expected question but another mark found")
+            question.line = nlin
+        elif kind == _LINE_DESCRIPTION or kind == _LINE_ANSWER:
+            raise quizerrors.QuizScanError(self.filename, nlin, "expected question but another mark found")
         else:
             state = "question"
         return state
 
-    def _scan_title(self, lin, nlin, question):
-        """ scans line on state="title"
-            updates question and returns a new state, or quits on error """
+    def _scan_title(self, kind, lin, nlin, question):
+        """ scans line of kind on state="title"
+            updates question and returns a new state, or raises QuizScanError """
         state = "title"
-        if is_a_question(lin):
-            show_scan_error_and_exit(self.filename, nlin, "unexpected start of question")
-        elif is_a_description(lin):   # title is done
+        if kind == _LINE_QUESTION:
+            raise quizerrors.QuizScanError(self.filename, nlin, "unexpected start of question")
+        elif kind == _LINE_DESCRIPTION:   # title is done
             if question.has_proper_title():
                 state = "description"
             else:
-                show_scan_error_and_exit(self.filename, nlin, "question title unset")
-        elif is_an_answer(lin):
-            show_scan_error_and_exit(self.filename, nlin, "unexpected start of answer")
-        elif not is_a_comment(lin):
+                raise quizerrors.QuizScanError(self.filename, nlin, "question title unset")
+        elif kind == _LINE_ANSWER:
+            raise quizerrors.QuizScanError(self.filename, nlin, "unexpected start of answer")
+        elif kind == _LINE_TEXT:
             question.appendToTitle(lin)
         return state
 
     def _process_current_answer(self, lin, nlin, question):
         """ processes lin as an answer.
-            Updates question or quits on badformed question """
-        answer_header = process_answer_mark(lin)
+            Updates question or raises QuizScanError on badformed question """
+        answer_header = process_answer_flags(lin)
         if answer_header == None:
-            show_scan_error_and_exit(self.filename, nlin, "badformed answer header")
+            raise quizerrors.QuizScanError(self.filename, nlin, "badformed answer header")
         else:
             is_correct, is_final = answer_header
             partial_answer = Answer(is_correct, is_final)
             question.add_answer(partial_answer)
 
-    def _scan_description(self, lin, nlin, question):
-        """ scans line on state="description"
-            updates question and returns a new state, or quits on error """
+    def _scan_description(self, kind, lin, nlin, question):
+        """ scans line of kind on state="description"
+            updates question and returns a new state, or raises QuizScanError """
         state = "description"
-        if is_an_answer(lin):      # description is over
+        if kind == _LINE_ANSWER:      # description is over
             if question.has_proper_description():
                 self._process_current_answer(lin, nlin, question)
                 state = "answer"
             else:
-                show_scan_error_and_exit(self.filename, nlin, "question description unset")
-        elif is_a_question(lin):    # previous question had no responses (it is ok)
+                raise quizerrors.QuizScanError(self.filename, nlin, "question description unset")
+        elif kind == _LINE_QUESTION:    # previous question had no responses (it is ok)
             if question.has_proper_description():
-                self.questions.append(question.clone())
+                self._finished_questions.append(question.clone())
                 state = "title"
                 question.reset()
+                question.line = nlin
             else:
-                show_scan_error_and_exit(self.filename, nlin, "question description unset")
-        elif is_a_description(lin):    # badformed: more than one description mark
-                show_scan_error_and_exit(self.filename, nlin, "too many description marks")
-        elif not is_a_comment(lin):
+                raise quizerrors.QuizScanError(self.filename, nlin, "question description unset")
+        elif kind == _LINE_DESCRIPTION:    # badformed: more than one description mark
+                raise quizerrors.QuizScanError(self.filename, nlin, "too many description marks")
+        elif kind == _LINE_TEXT:
             question.add_description(lin)
         return state
 
-    def _scan_answer(self, lin, nlin, question):
-        """ scans line on state="description"
-            updates question and returns a new state, or quits on error """
+    def _scan_answer(self, kind, lin, nlin, question):
+        """ scans line of kind on state="answer"
+            updates question and returns a new state, or raises QuizScanError """
         state = "answer"
-        if is_a_question(lin):  # end of answers, new question
+        if kind == _LINE_QUESTION:  # end of answers, new question
             if question.has_finished_current_answer():
-                self.questions.append(question.clone())
+                self._finished_questions.append(question.clone())
                 question.reset()
+                question.line = nlin
                 state = "title"
             else:
-                show_scan_error_and_exit(self.filename, nlin, "unfinished answer")
-        elif is_an_answer(lin):     # it is a new answer
+                raise quizerrors.QuizScanError(self.filename, nlin, "unfinished answer")
+        elif kind == _LINE_ANSWER:     # it is a new answer
             if question.get_nr_answers() >= self.options.maxanswers:
-                show_scan_error_and_exit(self.filename, nlin, "exceded max nr of answers per question")
+                raise quizerrors.QuizScanError(self.filename, nlin, "exceded max nr of answers per question")
             elif question.has_finished_current_answer():
                 self._process_current_answer(lin, nlin, question)
             else:
-                show_scan_error_and_exit(self.filename, nlin, "unfinished answer")
-        elif is_a_description(lin):
-            show_scan_error_and_exit(self.filename, nlin, "unexpected description mark")
-        elif not is_a_comment(lin):
+                raise quizerrors.QuizScanError(self.filename, nlin, "unfinished answer")
+        elif kind == _LINE_DESCRIPTION:
+            raise quizerrors.QuizScanError(self.filename, nlin, "unexpected description mark")
+        elif kind == _LINE_TEXT:
             question.current_answer.add_description(lin)
         return state
 
     def _scan_quiz_file(self):
         """ interprets quiz filename and place corresponding questions on
-        self.questions.
+        self.questions. """
+        self.questions.extend(self._questions_from_file())
+
+    def _questions_from_file(self):
+        """ generator of the (not yet postprocessed) questions of the
+        file. They come from the cache when the file has been already
+        parsed. Otherwise they are scanned and stored on the cache. """
+        cache = self.options.cache
+        if cache == None:
+            for question in self._scan_questions():
+                yield question
+            return
+        key = cache.compose_key(self.filename, *self._cache_params())
+        records = cache.load(key)
+        if records != None:
+            self.cached = True
+            for record in records:
+                if isinstance(record, dict):    # trailer
+                    self._set_cache_trailer(record)
+                else:
+                    yield Question.from_record(record, self.settings, self.filename)
+            return
+        writer = cache.writer(key)
+        try:
+            for question in self._scan_questions():
+                writer.write(question.to_record())
+                yield question
+            writer.write(self._get_cache_trailer())
+            writer.commit()
+        finally:
+            writer.abort()
+
+    def _cache_params(self):
+        """ returns whatever affects the parsing of the file """
+        options = self.options
+        return ("shufflequiz", _PARSER_VERSION, options.questionmark,
+                options.descriptionmark, options.answermark,
+                options.maxanswers, options.placefinals)
+
+    def _get_cache_trailer(self):
+        """ returns the attributes of this quiz, other than questions,
+        to be cached """
+        return { }
+
+    def _set_cache_trailer(self, trailer):
+        """ sets the attributes cached by _get_cache_trailer() """
+        pass
+
+    def _iter_lines(self, f):
+        """ returns an iterator on (kind, lin, nlin) of the lines of
+            file f. Unless disabled, it scans the memory map of f (see
+            iter_mapped_lines()), so the text lines are not split one by
+            one. Files that can't be mapped (e.g. empty) are read line
+            by line """
+        classify = self.classifier.classify
+        if self.options.usemmap:
+            try:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, EnvironmentError):
+                buf = None
+            if buf != None:
+                return iter_mapped_lines(buf, classify)
+        return iter_file_lines(f, classify)
+
+    def scan_lines(self, lines):
+        """ generator of the (not yet postprocessed) questions scanned
+        from lines (e.g. an open file, a stream or a list of lines)
+        instead of the file of this quiz """
+        return self._scan_classified_lines(iter_file_lines(lines, self.classifier.classify))
+
+    def _scan_questions(self):
+        """ generator of the questions scanned from the file of this quiz """
+        with open(self.filename) as f:
+            for question in self._scan_classified_lines(self._iter_lines(f)):
+                yield question
+
+    def _scan_classified_lines(self, lines):
+        """ interprets lines, an iterator on (kind, lin, nlin), and yields
+        each question as soon as it is finished (i.e. its last answer
+        ends).
         It works as an state machine with the following states:
 
             - question:     waiting to get a question mark
@@ -508,83 +836,333 @@ class Quiz:
             - answer:       waiting to get the text of an answer
         """
         state = "question"
-        nlin = 0            # line number under process
-        question = Question(self.options)
-
-        with open(self.filename) as f:
-            for lin in f:
-                nlin += 1
-                if is_a_comment(lin):
-                    pass
-                elif state == "question":
-                    state = self._scan_question(lin, nlin, question)
-                elif state == "title":
-                    state = self._scan_title(lin, nlin, question)
-                elif state == "description":
-                    state = self._scan_description(lin, nlin, question)
-                elif state == "answer":
-                    state = self._scan_answer(lin, nlin, question)
-            # check last question
-            if question.is_complete():
-                self.questions.append(question) # it is not required to clone
-            else:
-                show_scan_error_and_exit(self.filename, nlin, "end of file reached leaving unfinished question")
+        question = Question(self.settings, self.filename)
+        finished = self._finished_questions
+
+        lin, nlin = "", 0     # the last line, once the loop is over
+        for kind, lin, nlin in lines:
+            if kind == _LINE_COMMENT:
+                pass
+            elif state == "question":
+                state = self._scan_question(kind, lin, nlin, question)
+            elif state == "title":
+                state = self._scan_title(kind, lin, nlin, question)
+            elif state == "description":
+                state = self._scan_description(kind, lin, nlin, question)
+            elif state == "answer":
+                state = self._scan_answer(kind, lin, nlin, question)
+            if finished:
+                for finished_question in finished:
+                    yield finished_question
+                del finished[:]
+        # check last question
+        if question.is_complete():
+            yield question # it is not required to clone
+        else:
+            last_line = nlin + lin.count("\n") - lin.endswith("\n")   # the last item may span several lines
+            raise quizerrors.QuizScanError(self.filename, last_line, "end of file reached leaving unfinished question")
 #
 class QuizSet:
     def __init__(self, options):
         self.options = options
         self.quizes = []
+        self.orders = None      # QuizOrder of each quiz on the exported variant
 
     def run(self):
-        for quizfile in self.options.files:
-            self._process(quizfile)
-        self._postprocess()
+        profiler = self.options.profiler
+        with profiler.phase("scan") as counts:
+            if self.options.sample != None or self.options.filequotas or self.options.groupquotas:
+                self._process_selection()
+            elif self.options.bank != None:
+                self._process_bank()
+            elif self.options.jobs > 1:
+                self._process_in_pool()
+            else:
+                for quizfile in self.options.files:
+                    self._process(quizfile)
+        if profiler.enabled:
+            count_quizes(counts, self.quizes)
+            if self.options.bank == None:
+                counts["lines"] = quizprofile.count_lines(self.options.files)
+        if self.options.dropduplicates:
+            with profiler.phase("dedupe") as counts:
+                self._drop_duplicates()
+            if profiler.enabled:
+                count_quizes(counts, self.quizes)
+        with profiler.phase("postprocess"):
+            self._postprocess()
 
     def export(self):
-        """ generates output """
-        self._export_exam()
-        self._export_validation()
-        self._export_eval()
-        self._export_gift()
+        """ generates the outputs that are not up to date """
+        profiler = self.options.profiler
+        if self.options.variants:
+            with profiler.phase("variants") as counts:
+                self._export_variants()
+            if profiler.enabled:
+                counts["variants"] = self.options.variants
+                counts["bytes"] = sum(os.path.getsize(f) for filenames in self.options.variantfilenames
+                        for f in filenames.values() if os.path.exists(f))
+        else:
+            with profiler.phase("shuffle"):
+                self.orders = self.compose_orders(self.options.seed)
+            self._export_outputs()
+        self._close_cache()
+        self.close_build()
+
+    def import_bank(self):
+        """ imports the questions of the quiz files into the bank
+        options.importbank, as scanned, with their answers in the order
+        of the file. Files already imported with the same contents and
+        parsing options are skipped """
+        scan_options = copy.copy(self.options)
+        scan_options.placefinals = False    # they are placed when selected
+        bank = open_question_bank(self.options.importbank)
+        nr_files = nr_questions = 0
+        try:
+            for filename in self.options.files:
+                quiz = Quiz(filename, scan_options)
+                params = quiz._cache_params()
+                digest = quizcache.hash_file_contents(filename).encode("hex")
+                if not bank.file_is_imported(filename, digest, params):
+                    records = (question.to_record() for question in quiz._questions_from_file())
+                    nr_questions += bank.import_file(filename, digest, params, records,
+                            _ANSWER_CORRECT, _ANSWER_FINAL)
+                    nr_files += 1
+            print >> sys.stderr, "imported: %s questions of %s files (%s unchanged); bank: %s questions"%(
+                    nr_questions, nr_files, len(self.options.files) - nr_files, bank.nr_questions())
+        finally:
+            bank.close()
+        self._close_cache()
+
+    def report_duplicates(self):
+        """ writes to options.dedupereport a csv with a row per question
+        of each cluster of duplicate questions of the quiz files (or of
+        the selection of the bank): the cluster number, whether it is
+        the first question of the cluster, an exact duplicate or a near
+        one, its similarity to the first one, and its file and line """
+        finder = quizdedupe.DuplicateFinder(self.options.duplicatethreshold)
+        for quiz, question in self._iter_source_questions():
+            add_to_duplicate_finder(finder, question)
+        clusters = finder.clusters()
+        char = self.options.csvseparator
+        with open(self.options.dedupereport, "w") as f:
+            f.write(char.join(('"cluster"', '"kind"', '"similarity"', '"file"', '"line"')))
+            f.write("\n")
+            for nr, cluster in enumerate(clusters, 1):
+                first = cluster[0]
+                for index in cluster:
+                    if index == first:
+                        kind = "first"
+                    elif finder.is_exact_duplicate(first, index):
+                        kind = "exact"
+                    else:
+                        kind = "near"
+                    filename, line = finder.position(index)
+                    f.write(char.join((str(nr), '"%s"'%kind, "%.2f"%finder.similarity(first, index),
+                        '"%s"'%filename, str(line))))
+                    f.write("\n")
+        print >> sys.stderr, "duplicates: %s clusters with %s duplicates out of %s questions"%(
+                len(clusters), sum(len(cluster) - 1 for cluster in clusters), finder.nr_questions())
+        self._close_cache()
+
+    def close_build(self):
+        """ records the built outputs on the build manifest and reports
+        the skipped and rebuilt ones """
+        manifest = self.options.manifest
+        if manifest != None:
+            manifest.save()
+            manifest.report()
+
+    def compose_orders(self, seed):
+        """ returns the QuizOrder of each quiz for a variant shuffled
+        with seed (None for a random one) """
+        rng = random.Random(seed)
+        return [ quiz.compose_order(rng) for quiz in self.quizes ]
+
+    def _export_outputs(self):
+        """ generates exam, revision, evaluation (on each format) and
+        gift outputs, when outdated """
+        exports = [ ("exam", self._export_exam), ("revision", self._export_validation),
+                ("eval", self._export_eval), ("evallong", self._export_eval_long),
+                ("evalnpy", self._export_eval_npy), ("evalgift", self._export_gift) ]
+        profiler = self.options.profiler
+        for kind, export in exports:
+            if kind in self.options.outputfilenames and self._is_outdated(kind):
+                with profiler.phase(kind) as counts:
+                    export()
+                if profiler.enabled:
+                    counts["bytes"] = os.path.getsize(self.options.outputfilenames[kind])
+
+    def _is_outdated(self, kind):
+        """ true when the output of kind must be (re)built """
+        manifest = self.options.manifest
+        return manifest == None or manifest.outdated(self.options.outputfilenames[kind])
+
+    def _export_variants(self):
+        """ generates the outputs of each variant, on a pool of
+            options.jobs processes when more than one, a list of the
+            seed of each variant so it can be regenerated, and the
+            orders of all the variants """
+        tasks = [ (nr, seed, self.compose_orders(seed), filenames) for nr, (seed, filenames) in
+                enumerate(zip(self.options.variantseeds, self.options.variantfilenames), 1) ]
+        manifest = self.options.manifest
+        outdated = [ task for task in tasks if manifest == None
+                or any(manifest.outdated(f) for f in task[3].values()) ]
+        if self.options.jobs > 1:
+            pool = multiprocessing.Pool(self.options.jobs, initializer=_init_variant_worker,
+                    initargs=(self.quizes, self.options))
+            try:
+                pool.map(_export_variant_in_worker, [ (orders, filenames) for nr, seed, orders, filenames in outdated ])
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for nr, seed, orders, filenames in outdated:
+                export_variant(self.quizes, self.options, orders, filenames)
+        if self._is_outdated("variants"):
+            self._export_variant_seeds(tasks)
+        if self._is_outdated("orders"):
+            self._export_variant_orders(tasks)
+
+    def _export_variant_seeds(self, tasks):
+        """ writes a csv with the number, seed and exam file of each
+        variant """
+        char = self.options.csvseparator
+        with open(self.options.outputfilenames["variants"], "w") as f:
+            f.write(char.join(('"variant"', '"seed"', '"exam"')))
+            f.write("\n")
+            for nr, seed, orders, filenames in tasks:
+                f.write(char.join((str(nr), str(seed), '"%s"'%filenames["exam"])))
+                f.write("\n")
+
+    def _export_variant_orders(self, tasks):
+        """ writes a json with the question and answer orders of each
+        quiz on each variant. It is the answer key of the variants.
+        It keeps the number of shuffled (non final) answers of each
+        question of each quiz, so the answers of each question can be
+        found on the orders, and the start question number """
+        contents = {
+            "files": self.options.files,
+            "quizes": [ quiz.filename for quiz in self.quizes ],
+            "startnr": self.options.startnr,
+            "answercounts": [ [ len(question.answers) for question in quiz.questions ]
+                for quiz in self.quizes ],
+            "variants": [ { "variant": nr, "seed": seed, "orders": [ o.to_dict() for o in orders ] }
+                for nr, seed, orders, filenames in tasks ],
+        }
+        with open(self.options.outputfilenames["orders"], "w") as f:
+            json.dump(contents, f, separators=(",", ":"))
+
+    def _close_cache(self):
+        """ keeps the cache in size and shows its stats if required """
+        cache = self.options.cache
+        if cache != None:
+            cache.evict()
+            if self.options.cachestats:
+                print >> sys.stderr, cache.stats()
 
     def _export_exam(self):
         with open(self.options.outputfilenames["exam"], "w") as f:
-            start_nr = self.options.startnr
-            for quiz in self.quizes:
-                f.write(quiz.toRST(start_nr, answers_weighted=False))
-                f.write(_RST_QUIZ_SEPARATION)
-                start_nr += quiz.nr_questions()
+            self.write_exam(f)
 
     def _export_validation(self):
         with open(self.options.outputfilenames["revision"], "w") as f:
-            start_nr = self.options.startnr
-            for quiz in self.quizes:
-                f.write(quiz.toRST(start_nr, answers_weighted=True))
-                f.write(_RST_QUIZ_SEPARATION)
-                start_nr += quiz.nr_questions()
+            self.write_revision(f)
 
     def _export_eval(self):
-        all_headers = []
-        all_weights = []
-        start_nr = self.options.startnr
-        for quiz in self.quizes:
-            headers, weights = quiz.toEval(start_nr)
-            start_nr += quiz.nr_questions()
-            all_headers += headers
-            all_weights += weights
-        char = self.options.csvseparator
         with open(self.options.outputfilenames["eval"], "w") as f:
-            f.write(char.join(all_headers))
-            f.write("\n")
-            f.write(char.join(str(w) for w in all_weights))
-            f.write("\n")
+            self.write_eval(f)
+
+    def _export_eval_long(self):
+        with open(self.options.outputfilenames["evallong"], "w") as f:
+            self.write_eval_long(f)
+
+    def _export_eval_npy(self):
+        with open(self.options.outputfilenames["evalnpy"], "wb") as f:
+            self.write_eval_npy(f)
 
     def _export_gift(self):
         with open(self.options.outputfilenames["evalgift"], "w") as f:
+            self.write_gift(f)
+
+    def write_exam(self, f):
+        """ writes the exam to file f """
+        start_nr = self.options.startnr
+        for quiz, order in zip(self.quizes, self.orders):
+            f.write(quiz.toRST(start_nr, answers_weighted=False, order=order))
+            f.write(_RST_QUIZ_SEPARATION)
+            start_nr += quiz.nr_questions()
+
+    def write_revision(self, f):
+        """ writes the exam with the weight of each answer to file f """
+        start_nr = self.options.startnr
+        for quiz, order in zip(self.quizes, self.orders):
+            f.write(quiz.toRST(start_nr, answers_weighted=True, order=order))
+            f.write(_RST_QUIZ_SEPARATION)
+            start_nr += quiz.nr_questions()
+
+    def write_eval(self, f):
+        """ writes the evaluation information in wide format to file f:
+        a row with the headers of every answer and a row with their
+        weights. Each row is streamed question by question """
+        char = self.options.csvseparator
+        for row in (0, 1):      # headers and weights of toEval()
+            separation = ""
             start_nr = self.options.startnr
-            for quiz in self.quizes:
-                f.write(quiz.toEvalGift(start_nr))
-                start_nr += quiz.nr_questions()
+            for quiz, order in zip(self.quizes, self.orders):
+                for question, answer_order, weights in quiz.iter_in_order(order):
+                    values = question.toEval(start_nr, answer_order, weights)[row]
+                    if values:
+                        f.write(separation)
+                        f.write(char.join(str(v) for v in values))
+                        separation = char
+                    start_nr += 1
+            f.write("\n")
+
+    def write_eval_long(self, f):
+        """ writes the evaluation information in long format to file f:
+        a row per answer with its question number, answer id, weight,
+        whether it is correct and final, and the file and line of its
+        question """
+        char = self.options.csvseparator
+        f.write(char.join(_EVAL_LONG_HEADER))
+        f.write("\n")
+        start_nr = self.options.startnr
+        for quiz, order in zip(self.quizes, self.orders):
+            for question, answer_order, weights in quiz.iter_in_order(order):
+                answers = question.answers_in_order(answer_order)
+                answer_weights = question.weights_in_order(answer_order, weights)
+                for nr, (answer, weight) in enumerate(zip(answers, answer_weights), 1):
+                    f.write(char.join((str(start_nr), '"%s"'%compose_answer_id(nr), str(weight),
+                        str(int(answer.is_correct)), str(int(answer.is_final)),
+                        '"%s"'%question.filename, str(question.line))))
+                    f.write("\n")
+                start_nr += 1
+
+    def write_eval_npy(self, f):
+        """ writes the evaluation information as a numpy .npy file to
+        (binary) file f, that can be memory-mapped. It holds an array of
+        (weight, correct, final) records with a row per question and a
+        column per answer slot (maxanswers), zero filled on unused
+        slots """
+        nr_questions = sum(quiz.nr_questions() for quiz in self.quizes)
+        slots = self.options.maxanswers
+        padding = _EVAL_NPY_RECORD.pack(0.0, 0, 0)
+        write_npy_header(f, _EVAL_NPY_DESCR, (nr_questions, slots))
+        for quiz, order in zip(self.quizes, self.orders):
+            for question, answer_order, weights in quiz.iter_in_order(order):
+                answers = question.answers_in_order(answer_order)
+                answer_weights = question.weights_in_order(answer_order, weights)
+                for answer, weight in zip(answers, answer_weights):
+                    f.write(_EVAL_NPY_RECORD.pack(weight, answer.is_correct, answer.is_final))
+                f.write(padding * (slots - len(answers)))
+
+    def write_gift(self, f):
+        """ writes the evaluation information in gift format to file f """
+        start_nr = self.options.startnr
+        for quiz, order in zip(self.quizes, self.orders):
+            f.write(quiz.toEvalGift(start_nr, order))
+            start_nr += quiz.nr_questions()
 
     def _process(self, filename):
         """ processes the corresponding quiz """
@@ -592,8 +1170,116 @@ class QuizSet:
         quiz.run()
         self.quizes.append(quiz)
 
+    def _process_bank(self):
+        """ composes a quiz for each source file on the bank with
+        selected questions. No quiz file is scanned """
+        for quiz, question in self._iter_bank_questions():
+            self._add_question(quiz, question)
+        if self.quizes == []:
+            raise quizerrors.QuizError("No questions selected from the bank")
+
+    def _process_selection(self):
+        """ composes the quizes of the questions of the quiz files (or of
+        the selection of the bank) selected by the quotas, or sampled
+        from all of them, with seed on a single pass (see
+        QuestionSelector). They keep the order of the files.
+        Raises QuizError, showing every quota that can't be met, before
+        anything is rendered """
+        options = self.options
+        if options.sample != None:
+            groupquotas = [ ("*", options.sample) ]
+        else:
+            groupquotas = options.groupquotas
+        selector = QuestionSelector(options.filequotas, groupquotas, random.Random(options.seed))
+        selector.select(self._iter_source_questions())
+        infeasible = selector.infeasible()
+        if infeasible:
+            raise quizerrors.QuizError("Quotas can't be met: %s"%"; ".join(infeasible))
+        for quiz, question in selector.selected():
+            self._add_question(quiz, question)
+
+    def _iter_source_questions(self):
+        """ generator of (quiz, question) of each (not yet
+        postprocessed) question of the quiz files, or of the selection
+        of the bank, in order. The questions are not kept on the quizes """
+        if self.options.bank != None:
+            for quiz, question in self._iter_bank_questions():
+                yield quiz, question
+            return
+        for filename in self.options.files:
+            quiz = Quiz(filename, self.options)
+            for question in quiz._questions_from_file():
+                yield quiz, question
+
+    def _iter_bank_questions(self):
+        """ generator of (quiz, question) of the questions on the bank
+        whose source file matches options.files, selected by title
+        pattern and number of answers, with a quiz per source file """
+        options = self.options
+        bank = open_question_bank(options.bank)
+        try:
+            for file_id, filename in bank.find_files(options.files):
+                quiz = Quiz(filename, options)
+                for record in bank.iter_records(file_id, options.titlepattern, options.answercount):
+                    title, descr, answers, line = record
+                    if len(answers) > options.maxanswers:
+                        raise quizerrors.QuizScanError(filename, line, "exceded max nr of answers per question")
+                    yield quiz, Question.from_record(record, quiz.settings, filename)
+        finally:
+            bank.close()
+
+    def _add_question(self, quiz, question):
+        """ adds question to quiz, and quiz to the quizes when it is not
+        the last one """
+        if self.quizes == [] or self.quizes[-1] is not quiz:
+            self.quizes.append(quiz)
+        quiz.questions.append(question)
+
+    def _process_in_pool(self):
+        """ processes the quizes on a pool of options.jobs processes,
+            keeping the order of the files.
+            On scan errors, it raises the error of the first one """
+        pool = multiprocessing.Pool(self.options.jobs)
+        try:
+            results = pool.map(scan_quiz_file, [ (filename, self.options) for filename in self.options.files ])
+        finally:
+            pool.close()
+            pool.join()
+        for filename, questions, cached, error in results:
+            if error is not None:
+                raise error
+            if self.options.cache != None:
+                self.options.cache.count(cached)
+            self.quizes.append(Quiz(filename, self.options, questions))
+
+    def _drop_duplicates(self):
+        """ drops from the quizes the exact and near duplicates (see
+        quizdedupe) of questions that come before, showing each one.
+        Quizes left with no question are dropped too """
+        finder = quizdedupe.DuplicateFinder(self.options.duplicatethreshold)
+        questions = [ question for quiz in self.quizes for question in quiz.questions ]
+        for question in questions:
+            add_to_duplicate_finder(finder, question)
+        dropped = set()
+        for cluster in finder.clusters():
+            first = questions[cluster[0]]
+            for index in cluster[1:]:
+                dropped.add(index)
+                question = questions[index]
+                print >> sys.stderr, "dropped duplicate: file: %s [line: %s] of file: %s [line: %s]"%(
+                        question.filename, question.line, first.filename, first.line)
+        index = 0
+        for quiz in self.quizes:
+            kept = []
+            for question in quiz.questions:
+                if index not in dropped:
+                    kept.append(question)
+                index += 1
+            quiz.questions = kept
+        self.quizes = [ quiz for quiz in self.quizes if quiz.questions ]
+
     def _postprocess(self):
-        """ performs shuffling and clean up """
+        """ merges quizes when shuffling amongst files, and cleans up """
         if self.options.shufflefiles:
             all_questions = []
             for quiz in self.quizes:
@@ -603,11 +1289,138 @@ class QuizSet:
         for quiz in self.quizes:
             quiz.postprocess()
 #
+class QuotaStratum(object):
+    """ a uniform sample of size questions (reservoir sampling) of the
+    ones offered to it """
+    __slots__ = ("name", "size", "seen", "reservoir")
+
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+        self.seen = 0
+        self.reservoir = []
+
+    def offer(self, entry, rng):
+        """ considers entry for the sample """
+        if self.seen < self.size:
+            self.reservoir.append(entry)
+        else:
+            slot = rng.randint(0, self.seen)
+            if slot < self.size:
+                self.reservoir[slot] = entry
+        self.seen += 1
+#
+class QuestionSelector(object):
+    """ selects questions on a single pass by quotas: the questions of
+    each stratum are sampled uniformly, so just the selected ones are
+    kept in memory.
+        - file quotas: (pattern, size) each file matching pattern (see
+          file_matches()) gives size questions. When more than one
+          matches, the last one applies
+        - group quotas: (pattern, size) all the files matching pattern
+          give size questions between them. They apply before file
+          quotas, the first one matching
+    The questions of files with no quota are all selected.
+    The stratum of each file is found once, not on each question """
+    def __init__(self, file_quotas, group_quotas, rng):
+        self.file_quotas = file_quotas
+        self.group_quotas = group_quotas
+        self.rng = rng
+        self.groups = [ QuotaStratum("group %s"%pattern, size) for pattern, size in group_quotas ]
+        self.strata = list(self.groups)     # of groups and of files with quota
+        self.unmatched = set(pattern for pattern, size in file_quotas)
+        self.kept = []          # (nr, quiz, question) of the files with no quota
+
+    def select(self, source):
+        """ selects the questions of source, an iterator of (quiz,
+        question) with the questions of each quiz one after the other """
+        rng = self.rng
+        kept = self.kept
+        current = None
+        stratum = None
+        for nr, (quiz, question) in enumerate(source):
+            if quiz is not current:
+                current = quiz
+                stratum = self._compose_stratum(quiz.filename)
+            if stratum == None:
+                kept.append((nr, quiz, question))
+            else:
+                stratum.offer((nr, quiz, question), rng)
+
+    def infeasible(self):
+        """ returns the description of each quota that can't be met """
+        descriptions = [ "%s (%s required, %s available)"%(stratum.name, stratum.size, stratum.seen)
+                for stratum in self.strata if stratum.seen < stratum.size ]
+        descriptions += [ "no file matches %s"%pattern for pattern in sorted(self.unmatched) ]
+        return descriptions
+
+    def selected(self):
+        """ returns (quiz, question) of the selected questions, in the
+        order of the source """
+        entries = self.kept + [ entry for stratum in self.strata for entry in stratum.reservoir ]
+        entries.sort(key=lambda entry: entry[0])
+        return [ (quiz, question) for nr, quiz, question in entries ]
+
+    def _compose_stratum(self, filename):
+        """ returns the stratum of the questions of filename, or None when
+        it has no quota. File quotas are matched even when a group
+        quota applies, so they are not reported as unmatched """
+        file_quota = None
+        for pattern, size in self.file_quotas:
+            if file_matches(filename, pattern):
+                self.unmatched.discard(pattern)
+                file_quota = size
+        for (pattern, size), group in zip(self.group_quotas, self.groups):
+            if file_matches(filename, pattern):
+                return group
+        if file_quota == None:
+            return None
+        stratum = QuotaStratum("file %s"%filename, file_quota)
+        self.strata.append(stratum)
+        return stratum
+#
+def export_variant(quizes, options, orders, outputfilenames):
+    """ exports quizes, as they appear with orders, to outputfilenames.
+    quizes are shared, not modified """
+    variant_options = copy.copy(options)
+    variant_options.variants = 0
+    variant_options.outputfilenames = outputfilenames
+    variant_options.profiler = quizprofile.PhaseProfile(enabled=False)   # measured as a whole
+    variant = QuizSet(variant_options)
+    variant.quizes = quizes
+    variant.orders = orders
+    variant._export_outputs()
+#
+_variant_worker_state = {}     # quizes and options of a variant worker
+#
+def _init_variant_worker(quizes, options):
+    """ keeps quizes and options on this worker of QuizSet._export_variants() """
+    _variant_worker_state["quizes"] = quizes
+    _variant_worker_state["options"] = options
+#
+def _export_variant_in_worker(args):
+    """ exports a variant on a worker of QuizSet._export_variants() """
+    orders, outputfilenames = args
+    export_variant(_variant_worker_state["quizes"], _variant_worker_state["options"], orders, outputfilenames)
+#
+def scan_quiz_file(args):
+    """ runs the quiz of filename with options.
+        It is meant to be run on a worker of QuizSet._process_in_pool().
+        Returns (filename, questions, cached, error), where error is the
+        QuizError raised, or None """
+    filename, options = args
+    quiz = Quiz(filename, options)
+    try:
+        quiz.run()
+    except quizerrors.QuizError as e:
+        return filename, None, quiz.cached, e
+    return filename, quiz.questions, quiz.cached, None
+#
 def compose_argparse():
     """ composes and returns an ArgumentParser """
-    p = argparse.ArgumentParser(description = "Quiz shuffler", version="1.0")
+    p = argparse.ArgumentParser(description = "Quiz shuffler", version=_VERSION)
 
-    p.add_argument('files', metavar='quizfiles', nargs='+', help="quiz files file paths with .quiz extension")
+    p.add_argument('files', metavar='quizfiles', nargs='+', help="quiz files file paths with .quiz extension, directories containing them or glob patterns. With --bank, they select the source files of the questions on the bank")
 
     # shuffle options
     p.add_argument("-e", "--shuffleAll", action="store_true",
@@ -631,6 +1444,27 @@ def compose_argparse():
     p.add_argument("-r", "--rewriteOutput", action="store_true",
             help="Do not ask when any output file already exists",
             dest="overwrite")
+    p.add_argument("-V", "--variants", action="store",
+            type=int,
+            help=u"Generate this number of independently shuffled variants, each with its own outputs (default 0: just one output)",
+            dest="variants", default=0)
+    p.add_argument("-S", "--seed", action="store",
+            type=int,
+            help=u"Set the seed of the shuffling, so it can be reproduced. Variant nr uses seed + nr",
+            dest="seed", default=None)
+    p.add_argument("--sample", action="store",
+            type=int,
+            help=u"Take just this number of questions, sampled uniformly from all the quiz files (reproducible with --seed)",
+            dest="sample", default=None)
+    p.add_argument("--quota", action="append",
+            help=u"Take just N questions, sampled uniformly, from each quiz file matching PATTERN (a name, glob pattern or directory), given as PATTERN=N. It can be repeated: the last one matching applies. Files with no quota give all their questions",
+            dest="quotas", default=None)
+    p.add_argument("--groupQuota", action="append",
+            help=u"Take just N questions, sampled uniformly, from all the quiz files matching PATTERN together, given as PATTERN=N. It can be repeated and applies before --quota",
+            dest="groupquotas", default=None)
+    p.add_argument("-B", "--rebuildAll", action="store_true",
+            help=u"Rebuild every output, even the ones up to date according to the build manifest",
+            dest="rebuildall")
 
     # other options
     p.add_argument("-s", "--startQuestionNumber", action="store",
@@ -644,24 +1478,119 @@ def compose_argparse():
     p.add_argument("-F", "--fixAvalAnswerNr", action="store_true", 
             help=u"Do fix the number of answers to the maxAnswersPerQuestion on the avaluation output",
             dest="fixavalanswernr")
+    p.add_argument("-E", "--evalFormat", action="append",
+            choices=_EVAL_FORMATS,
+            help=u"Set a format of the evaluation information: wide (one csv row of weights), long (csv row per answer) or npy (numpy array). It can be repeated (default wide)",
+            dest="evalformats", default=None)
     p.add_argument("-c", "--csvSeparator", action="store",
             help=u"Set the separator for the csv file with the evaluation information (default ',')",
             dest="csvseparator", default=',')
+    p.add_argument("-j", "--jobs", action="store",
+            type=int,
+            help=u"Set the number of processes to parse the quiz files (default 1, 0 for as many as cpus)",
+            dest="jobs", default=1)
+
+    # cache options
+    p.add_argument("--noCache", "--no-cache", action="store_false",
+            help=u"Do not use the cache of parsed quiz files",
+            dest="usecache", default=True)
+    p.add_argument("--noMmap", action="store_false",
+            help=u"Do not scan the quiz files on a memory map, but line by line",
+            dest="usemmap", default=True)
+    p.add_argument("--cacheDir", action="store",
+            help=u"Set the directory of the cache of parsed quiz files (default %s)"%quizcache.default_cache_directory(),
+            dest="cachedir", default=None)
+    p.add_argument("--cacheSize", action="store",
+            type=int,
+            help=u"Set the maximum size in MB of the cache of parsed quiz files (default 256)",
+            dest="cachesize", default=256)
+    p.add_argument("--cacheStats", action="store_true",
+            help=u"Show the hits and misses of the cache of parsed quiz files",
+            dest="cachestats")
+
+    # question bank options
+    p.add_argument("--importBank", action="store",
+            help=u"Import the questions of the quiz files into this question bank (a SQLite file, created if missing) instead of generating outputs",
+            dest="importbank", default=None)
+    p.add_argument("--bank", action="store",
+            help=u"Take the questions from this question bank instead of scanning the quiz files",
+            dest="bank", default=None)
+    p.add_argument("--titlePattern", action="store",
+            help=u"Select from the bank just the questions whose title matches this SQL LIKE pattern (e.g. '%%loop%%')",
+            dest="titlepattern", default=None)
+    p.add_argument("--answerCount", action="store",
+            type=int,
+            help=u"Select from the bank just the questions with this number of answers",
+            dest="answercount", default=None)
+
+    # duplicate options
+    p.add_argument("--dedupeReport", action="store",
+            help=u"Write to this csv file the clusters of exact and near duplicate questions of the quiz files instead of generating outputs",
+            dest="dedupereport", default=None)
+    p.add_argument("--dropDuplicates", action="store_true",
+            help=u"Drop the exact and near duplicates of questions that come before (amongst the selected ones, when selecting)",
+            dest="dropduplicates")
+    p.add_argument("--duplicateThreshold", action="store",
+            type=float,
+            help=u"Set the similarity (from 0 to 1) from which two questions are near duplicates (default 0.7)",
+            dest="duplicatethreshold", default=0.7)
+
+    # profile options
+    p.add_argument("--profile", action="store_true",
+            help=u"Show the wall and cpu time, peak memory and counts (files, lines, questions, answers, bytes) of each phase",
+            dest="profile")
+    p.add_argument("--profileJson", action="store",
+            help=u"Write the measures of each phase to this json file (implies --profile)",
+            dest="profilejson", default=None)
+    p.add_argument("--cProfile", action="store",
+            help=u"Run under cProfile, dumping its stats to this file and showing the hottest functions",
+            dest="cprofile", default=None)
+    p.set_defaults(profiler=quizprofile.PhaseProfile(enabled=False))   # enabled by get_options()
+
+    # vocabulary options
+    p.add_argument("--questionMark", action="store",
+            help=u"Set the mark that starts a question (default '%s')"%_QUESTION_MARK,
+            dest="questionmark", default=_QUESTION_MARK)
+    p.add_argument("--descriptionMark", action="store",
+            help=u"Set the mark that starts a description (default '%s')"%_DESCRIPTION_MARK,
+            dest="descriptionmark", default=_DESCRIPTION_MARK)
+    p.add_argument("--answerMark", action="store",
+            help=u"Set the mark that starts an answer (default '%s')"%_ANSWER_MARK,
+            dest="answermark", default=_ANSWER_MARK)
 
     return p
 #
 def exit_if_option_errors(options):
     """ filters option errors and exits if there are any """
-    if not options.outputfile:
+    if not options.outputfile and options.importbank == None and options.dedupereport == None:
         show_error_and_exit("Output filename must be set")
+    if options.importbank != None and (options.bank != None or options.dedupereport != None):
+        show_error_and_exit("Incompatible options")
+    if not 0 < options.duplicatethreshold <= 1:
+        show_error_and_exit("Duplicate threshold must be greater than 0 and up to 1")
+    if options.bank == None and (options.titlepattern != None or options.answercount != None):
+        show_error_and_exit("Questions can only be selected from a bank (--bank)")
     if options.noshuffle:
         if options.shuffleall or options.shufflequestions or options.shuffleanswers or options.shufflefiles:
             show_error_and_exit("Incompatible options")
     if options.maxanswers < 2:
         show_error_and_exit("Maximum number of answers must be at least 2")
-    for fn in options.files:
-        if not fn.endswith(".quiz"):
-            show_error_and_exit("Input files must have .quiz extension")
+    if options.jobs < 0:
+        show_error_and_exit("Number of jobs can't be negative")
+    if options.cachesize < 0:
+        show_error_and_exit("Cache size can't be negative")
+    if options.variants < 0:
+        show_error_and_exit("Number of variants can't be negative")
+    if options.sample != None and options.sample < 1:
+        show_error_and_exit("Number of sampled questions must be at least 1")
+    if options.sample != None and (options.quotas or options.groupquotas):
+        show_error_and_exit("Incompatible options")
+    if options.files == []:
+        show_error_and_exit("No input quiz files found")
+    if options.bank == None:
+        for fn in options.files:
+            if not fn.endswith(".quiz"):
+                show_error_and_exit("Input files must have .quiz extension")
 #
 def expand_options(options):
     """ some options implie others (e.g. shuffleAll implies
@@ -671,31 +1600,103 @@ def expand_options(options):
     options.shufflequestions = options.shufflequestions or options.shuffleall
     options.shufflefiles = options.shufflefiles or options.shuffleall
     options.shufflequestions = options.shufflequestions or options.shufflefiles
+    options.evalformats = options.evalformats or [ "wide" ]
+    options.filequotas = [ parse_quota(quota) for quota in options.quotas or [] ]
+    options.groupquotas = [ parse_quota(quota) for quota in options.groupquotas or [] ]
+    options.reproducible = options.seed != None or not (options.shufflequestions
+            or options.shuffleanswers or options.sample != None or options.filequotas
+            or options.groupquotas)
+    if options.variants:
+        if options.seed == None:
+            options.seed = random.SystemRandom().getrandbits(31)
+        options.variantseeds = [ options.seed + nr for nr in range(1, options.variants + 1) ]
+    if options.jobs == 0:
+        options.jobs = multiprocessing.cpu_count()
 #
 def compose_output_filenames_and_exit_if_no_overwrite(options):
     """ composes output filenames and check whether they already exist
     and overwrite option hasn't been set.
     If everything is ok, it adds outputfilenames to options """
     filenames = compose_output_filenames(options.outputfile)
+    manifestfilename = filenames["manifest"]
+    if options.variants:
+        filenames = { "variants": filenames["variants"], "orders": filenames["orders"] }
+        options.variantfilenames = [ select_output_filenames(
+                compose_variant_output_filenames(options.outputfile, nr, options.variants), options)
+                for nr in range(1, options.variants + 1) ]
+        allfilenames = filenames.values() + [ f for v in options.variantfilenames for f in v.values() ]
+    else:
+        filenames = select_output_filenames(filenames, options)
+        allfilenames = filenames.values()
+    compose_manifest(options, manifestfilename, allfilenames)
     if not options.overwrite:
-        exit_if_outputfiles_already_exist(filenames.values())
+        exit_if_outputfiles_already_exist([ f for f in allfilenames if options.manifest.outdated(f) ])
     options.outputfilenames = filenames
 #
 def get_options():
     """ returns the call arguments as an argparse """
     p = compose_argparse()
     options = p.parse_args()
-    exit_if_option_errors(options)
-    exit_if_inputfiles_do_not_exist(options.files)
-    compose_output_filenames_and_exit_if_no_overwrite(options)
-    expand_options(options)
+    options.profiler = quizprofile.PhaseProfile(options.profile or options.profilejson != None)
+    with options.profiler.phase("setup") as counts:
+        if options.bank == None:    # otherwise, they select files on the bank
+            options.files = expand_input_files(options.files)
+        exit_if_option_errors(options)
+        exit_if_inputfiles_do_not_exist(options.files if options.bank == None else [ options.bank ])
+        expand_options(options)
+        if options.dedupereport != None:
+            if not options.overwrite:
+                exit_if_outputfiles_already_exist([ options.dedupereport ])
+        elif options.importbank == None:
+            compose_output_filenames_and_exit_if_no_overwrite(options)
+        compose_cache(options)
+        counts["files"] = len(options.files)
     return options
 #
+def compose_manifest(options, filename, outputfilenames):
+    """ adds to options the build manifest of outputfilenames, already
+    checked for the ones up to date (none when rebuilding all) """
+    params = [ "shufflequiz", _VERSION, _PARSER_VERSION ] + [ getattr(options, name) for name in
+            ("shuffleanswers", "shufflequestions", "shufflefiles", "placefinals",
+            "variants", "seed", "startnr", "maxanswers", "fixavalanswernr",
+            "evalformats", "csvseparator", "questionmark", "descriptionmark", "answermark",
+            "files", "bank", "titlepattern", "answercount", "sample", "filequotas",
+            "groupquotas", "dropduplicates", "duplicatethreshold") ]
+    if options.bank == None:
+        inputs = options.files
+    else:   # the bank itself could be too big to be hashed
+        inputs = []
+        bank = open_question_bank(options.bank)
+        params.append(bank.digest())
+        bank.close()
+    options.manifest = quizmanifest.BuildManifest(filename, params, inputs, options.reproducible)
+    options.manifest.check(outputfilenames, options.rebuildall)
+#
+def open_question_bank(path):
+    """ returns the question bank of path, or raises QuizError when it
+    is not a question bank """
+    try:
+        return quizbank.QuestionBank(path)
+    except quizbank.QuestionBankError as e:
+        raise quizerrors.QuizError(str(e), 2)
+#
+def compose_cache(options):
+    """ adds to options the cache of parsed quiz files, or None when
+    it must not be used """
+    if options.usecache:
+        options.cache = quizcache.QuizCache(options.cachedir, options.cachesize << 20)
+    else:
+        options.cache = None
+#
 def compose_output_filenames(filename):
     """ composes and returns the output filenames from filename.
         It returns a dict with { "exam":"«filename».rst",
         "revision":«filename».rev.rst", "eval":"«filename».eval.csv",
-        "evalgift":"«filename».eval.gift"
+        "evallong":"«filename».eval.long.csv", "evalnpy":"«filename».eval.npy",
+        "evalgift":"«filename».eval.gift",
+        "variants":"«filename».variants.csv",
+        "orders":"«filename».orders.json",
+        "manifest":"«filename».manifest.json" }
         """
     basename, ext = os.path.splitext(filename)
     if ext == ".rst":
@@ -709,17 +1710,125 @@ def compose_output_filenames(filename):
             "revision":
             "%s.rev.rst"%name, 
             "eval":"%s.eval.csv"%name,
-            "evalgift":"%s.eval.gift"%name
+            "evallong":"%s.eval.long.csv"%name,
+            "evalnpy":"%s.eval.npy"%name,
+            "evalgift":"%s.eval.gift"%name,
+            "variants":"%s.variants.csv"%name,
+            "orders":"%s.orders.json"%name,
+            "manifest":"%s.manifest.json"%name
             }
     return filenames
 #
-def show_scan_error_and_exit(filename, line, msg):
-    """ shows an error in scanning the file, then quits """
-    show_error_and_exit("file: %s [line: %s] -> %s."%(filename, line, msg), 3)
+def select_output_filenames(filenames, options):
+    """ returns filenames without the outputs (variants list, orders and
+    evaluation formats) that won't be generated for a single exam
+    with options, nor the build manifest """
+    unused = [ "variants", "orders", "manifest" ]
+    for kind, evalformat in (("eval", "wide"), ("evallong", "long"), ("evalnpy", "npy")):
+        if evalformat not in options.evalformats:
+            unused.append(kind)
+    return dict((kind, filename) for kind, filename in filenames.items() if kind not in unused)
+#
+def compose_variant_output_filenames(filename, nr, nr_variants):
+    """ composes and returns the output filenames of variant nr from
+    filename, as compose_output_filenames() for «filename».vNR """
+    basename, ext = os.path.splitext(filename)
+    name = basename if ext == ".rst" else filename
+    filenames = compose_output_filenames("%s.v%0*d"%(name, len(str(nr_variants)), nr))
+    del filenames["variants"]
+    del filenames["orders"]
+    del filenames["manifest"]
+    return filenames
+#
+def expand_input_files(filenames):
+    """ returns filenames with each directory replaced by the .quiz
+    files it contains (recursively) and each glob pattern replaced by
+    the files it matches. Both expansions sorted by name """
+    expanded = []
+    for name in filenames:
+        if os.path.isdir(name):
+            found = []
+            for dirpath, dirnames, files in os.walk(name):
+                found += [ os.path.join(dirpath, f) for f in files if f.endswith(".quiz") ]
+            expanded += sorted(found)
+        elif glob.has_magic(name):
+            expanded += sorted(glob.glob(name))
+        else:
+            expanded.append(name)
+    return expanded
+#
+def count_quizes(counts, quizes):
+    """ sets on counts the number of quizes (files), questions and
+    answers of quizes """
+    counts["files"] = len(quizes)
+    counts["questions"] = sum(len(quiz.questions) for quiz in quizes)
+    counts["answers"] = sum(question.get_nr_answers() for quiz in quizes for question in quiz.questions)
+#
+def add_to_duplicate_finder(finder, question):
+    """ adds the (not yet postprocessed) question to finder, a
+    quizdedupe.DuplicateFinder """
+    title, descr, answers, line = question.to_record()
+    finder.add(question.filename, line, title, descr, [ text for flags, text in answers ])
+#
+def parse_quota(quota):
+    """ returns (pattern, size) of quota, as PATTERN=N, or quits when it
+    is badformed """
+    pattern, equal, size = quota.rpartition("=")
+    if not equal or not pattern or not size.isdigit():
+        show_error_and_exit("Badformed quota %s (expected PATTERN=N)"%quota)
+    return pattern, int(size)
+#
+def file_matches(filename, pattern):
+    """ true when filename is pattern, matches it as a glob pattern or
+    is below it as a directory """
+    return (filename == pattern or fnmatch.fnmatchcase(filename, pattern)
+            or filename.startswith(pattern.rstrip("/") + "/"))
+#
+def iter_file_lines(f, classify):
+    """ generator of (kind, lin, nlin) of each line of file f """
+    nlin = 0
+    for lin in f:
+        nlin += 1
+        yield classify(lin), lin, nlin
+#
+def iter_mapped_lines(buf, classify):
+    """ generator of (kind, lin, nlin) of the lines of the mapped file
+        buf, as iter_file_lines(), except that consecutive text lines
+        come as a single block, sliced at once, with the number of its
+        first line.
+        Only the lines starting with ".." can be marks, so they are
+        found by searching buf for "\\n.." and just them are classified """
+    size = len(buf)
+    block_start = 0     # start of the pending block of text lines
+    nlin = 1            # number of the line at block_start
+    find = buf.find
+    try:
+        candidate = 0 if buf[:2] == ".." else find("\n..") + 1 or -1
+        while candidate >= 0:
+            end = find("\n", candidate) + 1 or size
+            lin = buf[candidate:end]
+            kind = classify(lin)
+            if kind <> _LINE_TEXT:
+                if block_start < candidate:
+                    block = buf[block_start:candidate]
+                    yield _LINE_TEXT, block, nlin
+                    nlin += block.count("\n")
+                yield kind, lin, nlin
+                nlin += 1
+                block_start = end
+            candidate = find("\n..", end - 1) + 1 or -1
+        if block_start < size:
+            yield _LINE_TEXT, buf[block_start:size], nlin
+    finally:
+        buf.close()
+#
+def show_error(msg):
+    """ shows an error missage """
+    print >> sys.stderr, "%s: error: %s"%(sys.argv[0], msg)
 #
 def show_error_and_exit(msg, exit_code=1):
     """ shows an error missage and exists with exit_code """
-    print >> sys.stderr, "%s: error: %s"%(sys.argv[0], msg)
+    show_error(msg)
     sys.exit(exit_code)
 #
 
@@ -744,54 +1853,70 @@ def exit_if_inputfiles_do_not_exist(filenames):
     if missing <> [] :
         show_error_and_exit("Input file %s doesn't exist"%missing[0], 2);
 #
-def is_a_comment(lin):
-    """ true if lin is a comment """
-    return lin.startswith(".. #") or lin.startswith(".. /")
-
-def is_a_question(lin):
-    """ true if lin is the start of a question """
-    return lin.startswith(".. %s:"%_QUESTION_MARK)
-#
-def is_a_description(lin):
-    """ true if lin is the start of a question """
-    return lin.startswith(".. %s:"%_DESCRIPTION_MARK)
-#
-def is_an_answer(lin):
-    """ true if lin is the start of a answer """
-    return lin.startswith(".. %s:"%_ANSWER_MARK)
-#
 def compose_underline(text, char="-"):
     """ composes an underline for text with char """
     return char * len(text.decode("utf-8"))
 #
+def write_npy_header(f, descr, shape):
+    """ writes to f the header of a numpy .npy file (format version 1.0)
+    of an array of dtype descr and shape, in C order """
+    header = "{'descr': %s, 'fortran_order': False, 'shape': %r, }"%(descr, tuple(shape))
+    magic = "\x93NUMPY\x01\x00"
+    padding = 64 - (len(magic) + 2 + len(header) + 1) % 64
+    header += " " * padding + "\n"
+    f.write(magic)
+    f.write(struct.pack("<H", len(header)))
+    f.write(header)
+#
+def format_gift_weight(weight):
+    """ returns weight with the format expected by Moodle's Gift.
+    weight is 1/n (or -1/n) for the n answers of its class """
+    nr = int(round(1.0 / weight))
+    return _MAP_GIFT_WEIGHTS.get(nr, "%0.3f"%weight)
+#
 def compose_answer_id(nr):
     """ returns an answer id from nr """
     return chr(ord("a")+nr-1)
 #
-def process_answer_mark(lin):
-    """ it lin is an answer, it returns whether it is 
-    marked as correct and/or final. It returns None if
-    lin is not an answer or is not well formed """
+def process_answer_flags(lin):
+    """ returns whether the answer mark at lin is marked as
+    correct and/or final, or None when it is not well formed.
+    lin is expected to be already known as an answer """
     res = None
-    if is_an_answer(lin):
-        line = lin.rstrip()
-        if line.endswith('f'):
-            final = True
-            value = line[-2:-1]
-        else:
-            final = False
-            value = line[-1:]
+    line = lin.rstrip()
+    if line.endswith('f'):
+        final = True
+        value = line[-2:-1]
+    else:
+        final = False
+        value = line[-1:]
 
-        if value in ('+', '-'):
-            correct = (value == '+')
-            res = (correct, final)
+    if value in ('+', '-'):
+        correct = (value == '+')
+        res = (correct, final)
     return res
 #
-def main():
-    options = get_options()
+def build(options):
+    """ does what options ask for: imports into the bank, reports the
+    duplicates or generates the outputs that are not up to date """
     quiz_set = QuizSet(options)
-    quiz_set.run()
-    quiz_set.export()
+    if options.importbank != None:
+        quiz_set.import_bank()
+    elif options.dedupereport != None:
+        quiz_set.report_duplicates()
+    elif options.manifest.all_up_to_date():
+        quiz_set.close_build()
+    else:
+        quiz_set.run()
+        quiz_set.export()
+#
+def main():
+    try:
+        options = get_options()
+        quizprofile.call_profiled(lambda: build(options), options.cprofile)
+        options.profiler.report("shufflequiz", options.profilejson)
+    except quizerrors.QuizError as e:
+        show_error_and_exit(str(e), e.exit_code)
 #
 if __name__=="__main__":
     sys.exit(main())